@@ -0,0 +1,61 @@
+from typing import Iterable, List
+
+from fastapi import HTTPException
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import existing_ids
+
+def check_batch_ids(update_ids: List[int], delete_ids: List[int]):
+    """Reject batches that touch the same row twice."""
+    ids = update_ids + delete_ids
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Each id may appear only once across update and delete")
+
+async def ensure_exist(session: AsyncSession, column, ids: Iterable[int], detail: str):
+    """Raise 404 unless every id exists in column, querying uncached ids with a single IN query."""
+    wanted = set(ids)
+    if not wanted:
+        return
+    found = await existing_ids(session, column.class_, wanted)
+    missing = sorted(wanted - found)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"{detail}: {missing}")
+
+async def bulk_write(session: AsyncSession, model, creates: List[dict], updates: List[dict], deletes: List[int]) -> List:
+    """Insert, update and delete rows of model with one statement per kind.
+
+    updates are dicts carrying the primary key ``id``. Returns the created
+    ORM objects in the order of creates.
+    """
+    created = []
+    if creates:
+        # Asking SQLAlchemy to keep RETURNING in parameter order makes it fall
+        # back to one INSERT per row on SQLite. New rowids are handed out in
+        # VALUES order, so sorting by id restores the order instead.
+        created = sorted(
+            (await session.scalars(insert(model).returning(model), creates)).all(),
+            key=lambda row: row.id
+        )
+    if updates:
+        await session.execute(update(model), updates)
+    if deletes:
+        await session.execute(delete(model).where(model.id.in_(deletes)))
+    return created
+
+async def insert_ids(session: AsyncSession, model, rows: List[dict]) -> List[int]:
+    """Insert rows of model in one statement and return their new ids in order."""
+    if not rows:
+        return []
+    # Same ordering argument as in bulk_write
+    return sorted((await session.scalars(insert(model).returning(model.id), rows)).all())
+
+async def load_by_ids(session: AsyncSession, model, ids: List[int], *options) -> List:
+    """Load rows of model for ids in the order given, refreshing stale identities."""
+    if not ids:
+        return []
+    rows = (await session.scalars(
+        select(model).options(*options).where(model.id.in_(ids)).execution_options(populate_existing=True)
+    )).all()
+    by_id = {row.id: row for row in rows}
+    return [by_id[id] for id in ids]
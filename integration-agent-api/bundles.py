@@ -0,0 +1,255 @@
+import enum
+import json
+from typing import Dict, List
+
+from fastapi import HTTPException
+from sqlalchemy import Boolean, Enum, Float, Integer, String, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.models import IntegrationAgent, IntegrationProcess, ProcessSchedule, ProcessTask, Field, Connector, Transformation, TaskDependency
+from bulk import insert_ids
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, JSON bundles work without it
+    msgpack = None
+
+BUNDLE_FORMAT = "integration-agent-bundle"
+BUNDLE_VERSION = 1
+BUNDLE_MEDIA_TYPES = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+}
+
+# Tables in insert order with the foreign keys that point at earlier tables.
+# The first reference of each table is its owner. Bundle ids are the ids of
+# the exporting database and are remapped on import.
+BUNDLE_TABLES = [
+    (IntegrationProcess, {}),
+    (ProcessSchedule, {"integration_process_id": IntegrationProcess}),
+    (ProcessTask, {"integration_process_id": IntegrationProcess}),
+    (Field, {"process_task_id": ProcessTask}),
+    (Connector, {"process_task_id": ProcessTask}),
+    (Transformation, {"process_task_id": ProcessTask, "c_field_id": Field, "v_field_id": Field}),
+    (TaskDependency, {"task_id": ProcessTask, "depends_on_id": ProcessTask}),
+]
+
+# The owning agent is implied by the bundle and the run status belongs to
+# the exporting environment
+EXCLUDED_COLUMNS = {"integration_agent_id", "status"}
+
+# JSON and msgpack write a whole float such as 5.0 as the integer 5
+PYTHON_TYPES = {Integer: (int,), Float: (int, float), String: (str,), Boolean: (bool,)}
+
+def _columns(model):
+    return [column for column in model.__table__.columns if column.name not in EXCLUDED_COLUMNS]
+
+def _dump_value(value):
+    return value.value if isinstance(value, enum.Enum) else value
+
+def _invalid(detail: str):
+    raise HTTPException(status_code=400, detail=detail)
+
+def dump_bundle(bundle: dict, format: str) -> bytes:
+    if format == "msgpack":
+        if msgpack is None:
+            raise HTTPException(status_code=501, detail="msgpack bundles need the msgpack package")
+        return msgpack.packb(bundle)
+    return json.dumps(bundle, separators=(",", ":")).encode()
+
+def load_bundle(body: bytes, media_type: str) -> dict:
+    if media_type.split(";")[0].strip() in ("application/msgpack", "application/x-msgpack"):
+        if msgpack is None:
+            raise HTTPException(status_code=501, detail="msgpack bundles need the msgpack package")
+        try:
+            return msgpack.unpackb(body)
+        except (ValueError, msgpack.exceptions.UnpackException):
+            _invalid("Invalid bundle payload")
+    try:
+        return json.loads(body)
+    except ValueError:
+        _invalid("Invalid bundle payload")
+
+async def export_agent(db: AsyncSession, agent: IntegrationAgent) -> dict:
+    """Build the bundle for agent with one column-oriented SELECT per table."""
+    tables = {}
+    id_queries = {}
+    for model, references in BUNDLE_TABLES:
+        if references:
+            column, owner = next(iter(references.items()))
+            condition = getattr(model, column).in_(id_queries[owner])
+        else:
+            condition = IntegrationProcess.integration_agent_id == agent.id
+        id_queries[model] = select(model.id).where(condition)
+
+        columns = _columns(model)
+        rows = (await db.execute(select(*columns).where(condition).order_by(model.id))).all()
+        tables[model.__tablename__] = {
+            "columns": [column.name for column in columns],
+            "rows": [[_dump_value(value) for value in row] for row in rows],
+        }
+
+    return {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "agent": {column.name: _dump_value(getattr(agent, column.name)) for column in _columns(IntegrationAgent) if column.name != "id"},
+        "tables": tables,
+    }
+
+def _convert(column, values: list, where: str) -> list:
+    # Validate a whole column at once by comparing the set of values it holds
+    try:
+        present = set(values)
+    except TypeError:
+        _invalid(f"{where} values must be scalars")
+    if None in present and not column.nullable:
+        _invalid(f"{where} must not be null")
+    present.discard(None)
+
+    if isinstance(column.type, Enum) and column.type.enum_class is not None:
+        enum_class = column.type.enum_class
+        if not all(isinstance(value, str) for value in present):
+            _invalid(f"{where} values must be strings")
+        unknown = present - {member.value for member in enum_class}
+        if unknown:
+            _invalid(f"{where} has unknown values: {sorted(unknown)}")
+        return [None if value is None else enum_class(value) for value in values]
+
+    expected = next((python_type for sql_type, python_type in PYTHON_TYPES.items() if isinstance(column.type, sql_type)), None)
+    if expected is not None and {type(value) for value in present} - set(expected):
+        _invalid(f"{where} values must be of type {' or '.join(python_type.__name__ for python_type in expected)}")
+    return values
+
+def read_bundle(bundle) -> dict:
+    """Validate a decoded bundle and return its agent and tables column-wise.
+
+    Everything is checked before the database is touched, so a bad bundle
+    never leaves a partially imported agent behind.
+    """
+    if not isinstance(bundle, dict) or bundle.get("format") != BUNDLE_FORMAT:
+        _invalid("Not an integration agent bundle")
+    if bundle.get("version") != BUNDLE_VERSION:
+        _invalid(f"Unsupported bundle version: {bundle.get('version')}")
+
+    agent = bundle.get("agent")
+    if not isinstance(agent, dict):
+        _invalid("Bundle has no agent")
+    agent_columns = {column.name: column for column in _columns(IntegrationAgent) if column.name != "id"}
+    unknown = set(agent) - set(agent_columns)
+    if unknown:
+        _invalid(f"Unknown agent columns: {sorted(unknown)}")
+    agent_values = {}
+    for name, column in agent_columns.items():
+        if name in agent:
+            agent_values[name] = _convert(column, [agent[name]], f"agent.{name}")[0]
+        elif not column.nullable and column.default is None:
+            _invalid(f"agent.{name} is required")
+
+    tables = bundle.get("tables") or {}
+    if not isinstance(tables, dict):
+        _invalid("Bundle tables must be an object")
+    unknown = set(tables) - {model.__tablename__ for model, _ in BUNDLE_TABLES}
+    if unknown:
+        _invalid(f"Unknown bundle tables: {sorted(unknown)}")
+
+    plan = {}
+    for model, references in BUNDLE_TABLES:
+        name = model.__tablename__
+        table = tables.get(name) or {"columns": ["id"], "rows": []}
+        columns, rows = table.get("columns"), table.get("rows")
+        if not isinstance(columns, list) or not isinstance(rows, list):
+            _invalid(f"{name} needs columns and rows lists")
+
+        if not all(isinstance(column, str) for column in columns):
+            _invalid(f"{name} columns must be names")
+        model_columns = {column.name: column for column in _columns(model)}
+        unknown = set(columns) - set(model_columns)
+        if unknown:
+            _invalid(f"Unknown {name} columns: {sorted(unknown)}")
+        if len(set(columns)) != len(columns) or "id" not in columns:
+            _invalid(f"{name} columns must be unique and include id")
+        required = set(references) | {
+            column.name for column in model_columns.values()
+            if not column.nullable and column.default is None and not column.primary_key
+        }
+        missing = required - set(columns)
+        if rows and missing:
+            _invalid(f"{name} is missing required columns: {sorted(missing)}")
+        if any(not isinstance(row, list) or len(row) != len(columns) for row in rows):
+            _invalid(f"Every {name} row must have {len(columns)} values")
+
+        # Transpose to one list per column so each check is a set operation
+        values = dict(zip(columns, map(list, zip(*rows)))) if rows else {column: [] for column in columns}
+        ids = values.pop("id")
+        if {type(id) for id in ids} - {int}:
+            _invalid(f"{name}.id values must be integers")
+        if len(set(ids)) != len(ids):
+            _invalid(f"{name} has duplicate ids")
+
+        for column_name, column_values in values.items():
+            values[column_name] = _convert(model_columns[column_name], column_values, f"{name}.{column_name}")
+        for column_name, parent in references.items():
+            missing = set(values.get(column_name, [])) - {None} - set(plan[parent]["ids"])
+            if missing:
+                _invalid(f"{name}.{column_name} references unknown ids: {sorted(missing)}")
+
+        plan[model] = {"ids": ids, "values": values}
+
+    _check_task_graphs(plan)
+    return {"agent": agent_values, "tables": plan}
+
+def _check_task_graphs(plan: dict):
+    # The bundle's tasks are checked as the dependencies endpoint checks a
+    # process, so a cycle fails the import rather than a run
+    from process_engine import EngineError, task_graph, unsaved_tasks
+
+    tasks, dependencies = plan[ProcessTask], plan[TaskDependency]
+    count = len(tasks["ids"])
+    columns = tasks["values"]
+    depends_on: Dict[int, List[int]] = {}
+    for task_id, depends_on_id in zip(dependencies["values"].get("task_id", []), dependencies["values"].get("depends_on_id", [])):
+        depends_on.setdefault(task_id, []).append(depends_on_id)
+    rows = [
+        (task_id, process_id, task_type, sequence_number, enabled, depends_on_id)
+        for task_id, process_id, task_type, sequence_number, enabled in zip(
+            tasks["ids"], columns.get("integration_process_id", []), columns.get("type", []),
+            columns.get("sequence_number", [None] * count), columns.get("enabled", [None] * count),
+        )
+        for depends_on_id in depends_on.get(task_id, [None])
+    ]
+    for process_tasks in unsaved_tasks(rows).values():
+        try:
+            task_graph(process_tasks)
+        except EngineError as error:
+            _invalid(f"process_tasks: {error}")
+
+async def import_agent(session: AsyncSession, plan: dict):
+    """Insert a validated bundle as a new agent with bulk inserts, remapping ids."""
+    agent = IntegrationAgent(**plan["agent"])
+    session.add(agent)
+    await session.flush()
+
+    parents = {parent for _, references in BUNDLE_TABLES for parent in references.values()}
+    id_maps: Dict[type, Dict[int, int]] = {}
+    counts = {}
+    for model, references in BUNDLE_TABLES:
+        table = plan["tables"][model]
+        counts[model.__tablename__] = len(table["ids"])
+        if not table["ids"]:
+            id_maps[model] = {}
+            continue
+
+        values = dict(table["values"])
+        for column_name, parent in references.items():
+            id_map = id_maps[parent]
+            values[column_name] = [None if value is None else id_map[value] for value in values[column_name]]
+        if model is IntegrationProcess:
+            values["integration_agent_id"] = [agent.id] * len(table["ids"])
+
+        rows: List[dict] = [dict(zip(values, row)) for row in zip(*values.values())] if values else [{} for _ in table["ids"]]
+        if model in parents:
+            id_maps[model] = dict(zip(table["ids"], await insert_ids(session, model, rows)))
+        else:
+            await session.execute(insert(model), rows)
+
+    return {"agent": agent, "counts": counts}
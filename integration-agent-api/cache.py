@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Set
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+
+CACHE_MAXSIZE = int(os.getenv("INTEGRATION_AGENT_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("INTEGRATION_AGENT_CACHE_TTL", "60"))
+
+class LRUCache:
+    """Bounded mapping of (table, primary key) entries with LRU and TTL eviction.
+
+    Every table has a generation that moves on each invalidation. A value
+    read from the database is only stored if the generation it was read
+    under is still current, so a read racing a delete cannot bring the
+    deleted row back.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def generation(self, table: str) -> int:
+        return self._generations.get(table, 0)
+
+    def put(self, key, value, generation: int, ttl: float = None):
+        """Store value unless key's table was invalidated since generation.
+
+        ttl shortens the lifetime of this entry below the cache's own TTL.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation != self._generations.get(key[0], 0):
+                return
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, table: str, ids: Iterable = None):
+        """Drop the given ids of table, or every entry of table when ids is None."""
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            if ids is None:
+                keys = [key for key in self._entries if key[0] == table]
+            else:
+                keys = [(table, id) for id in ids]
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+# Only existence is cached: ORM instances belong to one session and must
+# not be shared between requests
+existence_cache = LRUCache(CACHE_MAXSIZE, CACHE_TTL)
+
+async def existing_ids(db: AsyncSession, model, ids: Iterable[int]) -> Set[int]:
+    """Return which of ids exist in model's table, querying only cache misses."""
+    table = model.__tablename__
+    wanted = set(ids)
+    found = {id for id in wanted if existence_cache.get((table, id))}
+    missing = wanted - found
+    if missing:
+        generation = existence_cache.generation(table)
+        loaded = set((await db.scalars(select(model.id).where(model.id.in_(missing)))).all())
+        for id in loaded:
+            existence_cache.put((table, id), True, generation)
+        found |= loaded
+    return found
+
+async def exists(db: AsyncSession, model, id: int) -> bool:
+    return id in await existing_ids(db, model, [id])
+
+# Deletes are collected per session and applied once they are committed
+
+def _pending(session: Session) -> dict:
+    return session.info.setdefault("pending_invalidations", {})
+
+@event.listens_for(Session, "after_flush")
+def _track_deleted(session, flush_context):
+    for obj in session.deleted:
+        table = getattr(obj, "__tablename__", None)
+        ids = _pending(session).setdefault(table, set())
+        if ids is not None:
+            ids.add(getattr(obj, "id", None))
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_delete_statement(orm_execute_state):
+    if not orm_execute_state.is_delete:
+        return
+    table = orm_execute_state.statement.table.name
+    whereclause = orm_execute_state.statement.whereclause
+    pending = _pending(orm_execute_state.session)
+    # "id = value" and "id IN (...)" name the rows, anything else drops
+    # the whole table
+    if (
+        isinstance(whereclause, BinaryExpression)
+        and whereclause.operator in (operators.eq, operators.in_op)
+        and isinstance(whereclause.right, BindParameter)
+        and getattr(whereclause.left, "name", None) == "id"
+        and pending.get(table, set()) is not None
+    ):
+        values = whereclause.right.value
+        pending.setdefault(table, set()).update(values if whereclause.right.expanding else [values])
+    else:
+        pending[table] = None
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(session):
+    for table, ids in session.info.pop("pending_invalidations", {}).items():
+        existence_cache.invalidate(table, ids)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session):
+    session.info.pop("pending_invalidations", None)
@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+from typing import List, Optional
+
+CHECKPOINT_DIR = os.getenv("INTEGRATION_AGENT_CHECKPOINT_DIR", "checkpoints")
+# A run writes its checkpoint at most this often while it makes progress,
+# and once more when it fails or is interrupted
+CHECKPOINT_INTERVAL = float(os.getenv("INTEGRATION_AGENT_CHECKPOINT_INTERVAL", "1"))
+# Whether runs cut off by a shutdown or crash carry on when the app starts;
+# turn off on all but one worker when several share the database
+RESUME_ON_STARTUP = os.getenv("INTEGRATION_AGENT_ENGINE_RESUME_ON_STARTUP", "1") == "1"
+
+class CheckpointStore:
+    """The last checkpoint of each process's unfinished run, one small JSON
+    file per process.
+
+    A checkpoint is replaced whole by writing a temporary file and renaming
+    it over the old one, so a crash leaves either the old or the new one.
+    It is not fsynced: losing the last second of progress to a power cut
+    only means resending those batches.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self.saves = 0
+
+    def _path(self, process_id: int) -> str:
+        return os.path.join(self.root, f"process-{process_id}.json")
+
+    def save(self, process_id: int, checkpoint: dict):
+        data = json.dumps(checkpoint, separators=(",", ":"), default=str)
+        path = self._path(process_id)
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            temporary = f"{path}.tmp"
+            with open(temporary, "w", encoding="utf-8") as file:
+                file.write(data)
+            os.replace(temporary, path)
+            self.saves += 1
+
+    def load(self, process_id: int) -> Optional[dict]:
+        try:
+            with open(self._path(process_id), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Only an interrupted first write can leave this, start over
+            return None
+
+    def clear(self, process_id: int):
+        with self._lock:
+            try:
+                os.remove(self._path(process_id))
+            except FileNotFoundError:
+                pass
+
+    def process_ids(self) -> List[int]:
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            int(name[len("process-"):-len(".json")])
+            for name in names
+            if name.startswith("process-") and name.endswith(".json") and name[len("process-"):-len(".json")].isdigit()
+        )
+
+    def stats(self) -> dict:
+        return {"checkpoints": len(self.process_ids()), "saves": self.saves}
+
+checkpoint_store = CheckpointStore(CHECKPOINT_DIR)
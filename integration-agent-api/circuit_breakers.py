@@ -0,0 +1,147 @@
+import os
+import random
+import time
+from typing import Dict
+
+# A target's breaker opens after this many failures in a row, stays open
+# this long, then lets this many trial calls through (half-open)
+BREAKER_FAILURES = int(os.getenv("INTEGRATION_AGENT_BREAKER_FAILURES", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("INTEGRATION_AGENT_BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("INTEGRATION_AGENT_BREAKER_HALF_OPEN_CALLS", "1"))
+# A failed call is retried at most MAX_RETRIES times, after a backoff drawn
+# from [0, BACKOFF_BASE * 2 ** retry] capped at BACKOFF_MAX
+MAX_RETRIES = int(os.getenv("INTEGRATION_AGENT_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("INTEGRATION_AGENT_BACKOFF_BASE", "0.2"))
+BACKOFF_MAX = float(os.getenv("INTEGRATION_AGENT_BACKOFF_MAX", "10"))
+# Each success earns RETRY_BUDGET_RATIO of a retry; a target starts with
+# RETRY_BUDGET_RESERVE and never saves up more than ten times that
+RETRY_BUDGET_RATIO = float(os.getenv("INTEGRATION_AGENT_RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_RESERVE = float(os.getenv("INTEGRATION_AGENT_RETRY_BUDGET_RESERVE", "10"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitBreaker:
+    """Closed lets every call through and counts failures in a row; open
+    rejects calls until open_seconds have passed; half-open then lets
+    half_open_calls trial calls through, whose outcome closes or reopens it.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, open_seconds: float = BREAKER_OPEN_SECONDS, half_open_calls: int = BREAKER_HALF_OPEN_CALLS):
+        self.failures = failures
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.failures_in_row = 0
+        self.opened_at = 0.0
+        self.trials = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self.state, self.trials = HALF_OPEN, 0
+        if self.state == HALF_OPEN:
+            if self.trials >= self.half_open_calls:
+                self.rejected += 1
+                return False
+            self.trials += 1
+        return True
+
+    def success(self):
+        self.state, self.failures_in_row = CLOSED, 0
+
+    def failure(self):
+        self.failures_in_row += 1
+        if self.state == HALF_OPEN or self.failures_in_row >= self.failures:
+            if self.state != OPEN:
+                self.opened += 1
+            self.state, self.opened_at = OPEN, time.monotonic()
+
+    def abandon(self):
+        # A trial call that never finished, such as one cancelled with its
+        # run, leaves room for another
+        if self.state == HALF_OPEN and self.trials:
+            self.trials -= 1
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures_in_row": self.failures_in_row, "opened": self.opened, "rejected": self.rejected}
+
+class RetryBudget:
+    """Retries allowed as a fraction of successful calls, so a failing
+    target gets a few retries and then none until calls succeed again."""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, reserve: float = RETRY_BUDGET_RESERVE):
+        self.ratio = ratio
+        self.cap = max(reserve, 1) * 10
+        self.tokens = reserve
+        self.retries = 0
+        self.refused = 0
+
+    def deposit(self):
+        self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.refused += 1
+            return False
+        self.tokens -= 1
+        self.retries += 1
+        return True
+
+    def stats(self) -> dict:
+        return {"tokens": round(self.tokens, 3), "retries": self.retries, "refused": self.refused}
+
+def backoff(retry: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    # Full jitter, so callers that failed together do not retry together
+    return random.uniform(0, min(cap, base * 2 ** retry))
+
+class CircuitBreakers:
+    """A breaker and a retry budget per connector target, shared by every
+    process in the worker, so one failing target fails fast without
+    slowing the calls to any other."""
+
+    def __init__(
+        self,
+        max_retries: int = MAX_RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+        failures: int = BREAKER_FAILURES,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        half_open_calls: int = BREAKER_HALF_OPEN_CALLS,
+        retry_ratio: float = RETRY_BUDGET_RATIO,
+        retry_reserve: float = RETRY_BUDGET_RESERVE,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failures = failures
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.retry_ratio = retry_ratio
+        self.retry_reserve = retry_reserve
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.budgets: Dict[str, RetryBudget] = {}
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(self.failures, self.open_seconds, self.half_open_calls)
+        return self.breakers[key]
+
+    def budget(self, key: str) -> RetryBudget:
+        if key not in self.budgets:
+            self.budgets[key] = RetryBudget(self.retry_ratio, self.retry_reserve)
+        return self.budgets[key]
+
+    def backoff(self, retry: int) -> float:
+        return backoff(retry, self.backoff_base, self.backoff_max)
+
+    def stats(self) -> dict:
+        return {
+            key: {**breaker.stats(), **self.budget(key).stats()}
+            for key, breaker in self.breakers.items()
+        }
+
+circuit_breakers = CircuitBreakers()
@@ -0,0 +1,339 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from models.models import Connector, ConnectorType, DataType, QueryType
+from circuit_breakers import circuit_breakers
+from rate_limits import rate_limiter
+
+try:
+    import httpx
+except ImportError:  # httpx is optional, only WebService connectors need it
+    httpx = None
+
+# Records fetched from a source are handed on in batches of this size
+BATCH_SIZE = int(os.getenv("INTEGRATION_AGENT_ENGINE_BATCH_SIZE", "500"))
+REQUEST_TIMEOUT = float(os.getenv("INTEGRATION_AGENT_ENGINE_REQUEST_TIMEOUT", "30"))
+
+# HTTP statuses worth trying again: the target is busy or briefly down
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+class ConnectorError(Exception):
+    """A connector could not fetch or send records. retryable marks a
+    failure of the target rather than of the request, which another try may
+    get past."""
+
+    def __init__(self, message: str, retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+class CircuitOpenError(ConnectorError):
+    """Calls to a target are rejected while its circuit breaker is open."""
+
+def batches(records: List[dict], size: int = BATCH_SIZE) -> List[List[dict]]:
+    return [records[start:start + size] for start in range(0, len(records), size)]
+
+def records_from(value, tag: Optional[str] = None) -> List[dict]:
+    """The records in a decoded JSON document, under tag if given."""
+    if tag and isinstance(value, dict):
+        value = value.get(tag)
+    if value is None:
+        return []
+    values = value if isinstance(value, list) else [value]
+    return [item if isinstance(item, dict) else {"value": item} for item in values]
+
+class ConnectorClient:
+    """Fetches records from, or sends records to, one connector target.
+
+    After each batch fetch yields, position says where the next one starts;
+    fetch(position) picks up from there when a run resumes.
+    """
+
+    def __init__(self, connector: Connector):
+        self.connector = connector
+        self.position = None
+        self.throttled_ms = 0.0
+        self.retries = 0
+
+    @property
+    def target(self) -> str:
+        return f"{self.connector.connector_type.value}:{self.connector.end_point or self.connector.queue_path or self.connector.id}"
+
+    async def throttle(self):
+        # Rate limits are per target, so connectors of other processes
+        # calling the same one draw from the same bucket
+        waited = await rate_limiter.acquire(self.target, self.connector.rate_limit, self.connector.rate_burst or 1)
+        self.throttled_ms += waited * 1000
+
+    async def call(self, attempt: Callable[[], Awaitable]):
+        """Make one call to the target through its circuit breaker and rate
+        limit, retrying retryable failures with jittered exponential backoff
+        while the target's retry budget allows."""
+        breaker, budget = circuit_breakers.breaker(self.target), circuit_breakers.budget(self.target)
+        retry = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"{self.target} is failing, calls are paused for up to {breaker.open_seconds:g}s")
+            await self.throttle()
+            try:
+                result = await attempt()
+            except ConnectorError as error:
+                if not error.retryable:
+                    # The target answered, the request was at fault
+                    breaker.success()
+                    raise
+                breaker.failure()
+                if retry >= circuit_breakers.max_retries or not budget.withdraw():
+                    raise
+                retry += 1
+                self.retries += 1
+                await asyncio.sleep(max(circuit_breakers.backoff(retry), error.retry_after or 0))
+                continue
+            except BaseException:
+                breaker.abandon()
+                raise
+            breaker.success()
+            budget.deposit()
+            return result
+
+    async def fetch(self, position=None) -> AsyncIterator[List[dict]]:
+        raise ConnectorError(f"{self.connector.connector_type.value} connectors cannot be read by this engine")
+        yield []
+
+    async def send(self, records: List[dict]):
+        raise ConnectorError(f"{self.connector.connector_type.value} connectors cannot be written by this engine")
+
+    async def send_one(self, record: dict):
+        # What a Single connector does per record; the engine fans these out
+        await self.send([record])
+
+    async def close(self):
+        pass
+
+def retry_after(response, default: Optional[float] = 1.0) -> Optional[float]:
+    """The seconds a 429 or 503 response asks callers to wait."""
+    value = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+class WebServiceClient(ConnectorClient):
+    def __init__(self, connector: Connector):
+        super().__init__(connector)
+        if httpx is None:
+            raise ConnectorError("WebService connectors need the httpx package")
+        if not connector.end_point:
+            raise ConnectorError(f"Connector {connector.id} has no end point")
+        self.client = httpx.AsyncClient(timeout=REQUEST_TIMEOUT)
+
+    async def _request(self, method: str, body=None):
+        return await self.call(lambda: self._attempt(method, body))
+
+    async def _attempt(self, method: str, body=None):
+        try:
+            response = await self.client.request(method, self.connector.end_point, json=body)
+        except httpx.HTTPError as error:
+            # Timeouts and connection failures
+            raise ConnectorError(f"{method} {self.connector.end_point} failed: {error}", retryable=True) from error
+        if response.status_code == 429:
+            # Everyone calling this target backs off, not just this call
+            await rate_limiter.hold(
+                self.target, retry_after(response), self.connector.rate_limit, self.connector.rate_burst or 1,
+            )
+        if response.is_error:
+            # A 429 already holds the target's rate limit for its Retry-After
+            waited = retry_after(response, None) if response.status_code == 503 else None
+            raise ConnectorError(
+                f"{method} {self.connector.end_point} failed: {response.status_code} {response.reason_phrase}",
+                retryable=response.status_code in RETRYABLE_STATUSES, retry_after=waited,
+            )
+        return response.json() if response.content else None
+
+    async def fetch(self, position=None) -> AsyncIterator[List[dict]]:
+        # The response is read again on resume and the records before the
+        # position skipped
+        self.position = position or 0
+        records = records_from(await self._request("GET"), self.connector.response_tag)
+        for batch in batches(records[self.position:]):
+            self.position += len(batch)
+            yield batch
+
+    async def send(self, records: List[dict]):
+        # A List connector takes the whole batch in one request, a Single
+        # connector one request per record
+        if self.connector.data_type == DataType.List:
+            await self._request("POST", records)
+        else:
+            for record in records:
+                await self.send_one(record)
+
+    async def send_one(self, record: dict):
+        await self._request("POST", record)
+
+    async def close(self):
+        await self.client.aclose()
+
+class FileClient(ConnectorClient):
+    """JSON lines at the path given as the connector's end point."""
+
+    def __init__(self, connector: Connector):
+        super().__init__(connector)
+        if not connector.end_point:
+            raise ConnectorError(f"Connector {connector.id} has no file path")
+        self.path = connector.end_point
+
+    async def fetch(self, position=None) -> AsyncIterator[List[dict]]:
+        # Read lazily, a batch ahead of what the engine has taken, on a
+        # worker thread so the run's other tasks keep going. The position is
+        # a byte offset, so a resumed run seeks straight to it
+        try:
+            file = await asyncio.to_thread(open, self.path, "rb")
+        except OSError as error:
+            raise ConnectorError(f"Reading {self.path} failed: {error}") from error
+        try:
+            await asyncio.to_thread(file.seek, position or 0)
+            while True:
+                try:
+                    batch, self.position = await asyncio.to_thread(self._read_batch, file)
+                except (OSError, ValueError) as error:
+                    raise ConnectorError(f"Reading {self.path} failed: {error}") from error
+                if not batch:
+                    return
+                yield batch
+        finally:
+            await asyncio.to_thread(file.close)
+
+    def _read_batch(self, file) -> Tuple[List[dict], int]:
+        batch = []
+        while len(batch) < BATCH_SIZE:
+            line = file.readline()
+            if not line:
+                break
+            if line.strip():
+                batch.extend(records_from(json.loads(line)))
+        return batch, file.tell()
+
+    async def send(self, records: List[dict]):
+        lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        try:
+            await asyncio.to_thread(self._append, lines)
+        except OSError as error:
+            raise ConnectorError(f"Writing {self.path} failed: {error}") from error
+
+    def _append(self, lines: str):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(lines)
+
+class DatabaseClient(ConnectorClient):
+    """Runs the connector's query through SQLAlchemy on a worker thread."""
+
+    def __init__(self, connector: Connector):
+        super().__init__(connector)
+        if not connector.connection_string or not connector.query:
+            raise ConnectorError(f"Connector {connector.id} needs a connection string and a query")
+        self.engine = None
+
+    def _engine(self):
+        from sqlalchemy import create_engine
+        if self.engine is None:
+            self.engine = create_engine(self.connector.connection_string)
+        return self.engine
+
+    @property
+    def target(self) -> str:
+        # Connectors to the same database share a target, without exposing
+        # the credentials in the connection string
+        return f"Database:{hashlib.sha256(self.connector.connection_string.encode()).hexdigest()[:16]}"
+
+    def _select(self, skip: int = 0):
+        from sqlalchemy import text
+        connection = self._engine().connect()
+        try:
+            rows = connection.execution_options(stream_results=True).execute(text(self.connector.query)).mappings()
+            # Skipped on the cursor, without building records of them
+            while skip > 0:
+                skipped = len(rows.fetchmany(min(skip, BATCH_SIZE)))
+                if not skipped:
+                    break
+                skip -= skipped
+        except Exception:
+            connection.close()
+            raise
+        return connection, rows
+
+    async def _in_thread(self, function, *args):
+        from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, TimeoutError as PoolTimeout
+        failed = f"Query of connector {self.connector.id} failed"
+        try:
+            return await asyncio.to_thread(function, *args)
+        except (OperationalError, InterfaceError, PoolTimeout) as error:
+            # Lost connections, locks and timeouts may pass
+            raise ConnectorError(f"{failed}: {error}", retryable=True) from error
+        except DBAPIError as error:
+            raise ConnectorError(f"{failed}: {error}", retryable=error.connection_invalidated) from error
+        except Exception as error:
+            raise ConnectorError(f"{failed}: {error}") from error
+
+    def _execute(self, records: List[dict]):
+        from sqlalchemy import text
+        with self._engine().begin() as connection:
+            connection.execute(text(self.connector.query), records)
+
+    async def fetch(self, position=None) -> AsyncIterator[List[dict]]:
+        if self.connector.query_type != QueryType.SelectQuery:
+            raise ConnectorError(f"Connector {self.connector.id} does not run a select query")
+        # Rows are read a batch at a time off an open cursor, so a caller
+        # that stops asking stops the reading. The position counts rows; a
+        # resumed run runs the query again and skips that many
+        self.position = position or 0
+        connection, rows = await self.call(lambda: self._in_thread(self._select, self.position))
+        try:
+            while True:
+                try:
+                    batch = await asyncio.to_thread(rows.fetchmany, BATCH_SIZE)
+                except Exception as error:
+                    raise ConnectorError(f"Query of connector {self.connector.id} failed: {error}") from error
+                if not batch:
+                    return
+                self.position += len(batch)
+                yield [dict(row) for row in batch]
+        finally:
+            await asyncio.to_thread(connection.close)
+
+    async def send(self, records: List[dict]):
+        if not records:
+            return
+        await self.call(lambda: self._in_thread(self._execute, records))
+
+    async def close(self):
+        if self.engine is not None:
+            self.engine.dispose()
+
+class StubClient(ConnectorClient):
+    """Keeps what would have been sent, for dry runs."""
+
+    def __init__(self, connector: Connector):
+        super().__init__(connector)
+        self.sent: List[dict] = []
+
+    async def send(self, records: List[dict]):
+        self.sent.extend(records)
+
+CLIENTS = {
+    ConnectorType.WebService: WebServiceClient,
+    ConnectorType.File: FileClient,
+    ConnectorType.Database: DatabaseClient,
+}
+
+def client_for(connector: Connector) -> ConnectorClient:
+    return CLIENTS.get(connector.connector_type, ConnectorClient)(connector)
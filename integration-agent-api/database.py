@@ -1,20 +1,87 @@
-from sqlalchemy import create_engine
+import os
+from typing import Dict
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from group_commit import GroupCommitter
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./integration_agent.db"
+# The configuration database; tests and other deployments point this elsewhere
+SQLALCHEMY_DATABASE_URL = os.getenv("INTEGRATION_AGENT_DATABASE_URL", "sqlite+aiosqlite:///./integration_agent.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# "default" commits every write on the request's own session; "wal" switches
+# SQLite to WAL journaling and funnels writes through a single group-commit writer
+DB_PROFILE = os.getenv("INTEGRATION_AGENT_DB_PROFILE", "default")
+
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL)
+# expire_on_commit=False so handlers can return ORM objects after commit
+# without triggering an implicit (and, under asyncio, illegal) lazy refresh
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
+def _set_wal_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode NORMAL only syncs at checkpoints and is still corruption safe
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+def _disable_driver_begin(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself so SAVEPOINTs behave
+    dbapi_connection.isolation_level = None
+
+def _begin_immediate(conn):
+    # Take the write lock up front instead of upgrading mid-transaction
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+if DB_PROFILE == "wal":
+    event.listen(engine.sync_engine, "connect", _set_wal_pragmas)
+
+# One writer per database, keyed by the URL of the engine a request's session
+# is bound to, so writes land wherever get_db (or an override of it) points
+group_committers: Dict[str, GroupCommitter] = {}
+_writer_engines: Dict[str, AsyncEngine] = {}
+
+def group_committer_for(bind: AsyncEngine) -> GroupCommitter:
+    key = bind.url.render_as_string(hide_password=False)
+    committer = group_committers.get(key)
+    if committer is None:
+        writer_engine = create_async_engine(bind.url, pool_size=1, max_overflow=0)
+        event.listen(writer_engine.sync_engine, "connect", _set_wal_pragmas)
+        event.listen(writer_engine.sync_engine, "connect", _disable_driver_begin)
+        event.listen(writer_engine.sync_engine, "begin", _begin_immediate)
+        committer = GroupCommitter(
+            async_sessionmaker(bind=writer_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+        )
+        group_committers[key] = committer
+        _writer_engines[key] = writer_engine
+    return committer
+
+async def close_group_committers():
+    """Commit what is queued and close every writer."""
+    for key in list(group_committers):
+        await group_committers.pop(key).close()
+        await _writer_engines.pop(key).dispose()
+
 # Dependency
 async def get_db():
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+async def commit_write(db: AsyncSession, work):
+    """Run ``work(session)`` and commit it, returning its result.
+
+    Under the default profile the work runs on the request session ``db``.
+    Under the "wal" profile it is handed to the group-commit writer of the
+    database ``db`` is bound to and shares a transaction with whatever other
+    writes are in flight. ``db`` then ends its read transaction, so its next
+    query sees the write; objects it had already loaded keep their values.
+    """
+    if DB_PROFILE != "wal":
+        result = await work(db)
+        await db.commit()
+        return result
+    result = await group_committer_for(db.bind).submit(work)
+    await db.commit()
+    return result
@@ -1,8 +1,20 @@
+import asyncio
+import os
 from database import engine
-from models.models import Base
+from migrations import check_schema, migrate_in_transaction
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+# "migrate" brings the database up to date on startup; "check" only verifies
+# the version stamp, for workers started after the migration has been run
+STARTUP_MODE = os.getenv("INTEGRATION_AGENT_STARTUP", "migrate")
+
+async def init_db(mode: str = STARTUP_MODE):
+    if mode == "check":
+        async with engine.connect() as conn:
+            await conn.run_sync(check_schema)
+        return
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.run_sync(migrate_in_transaction)
 
 if __name__ == "__main__":
-    init_db() 
\ No newline at end of file
+    asyncio.run(init_db("migrate"))
@@ -0,0 +1,110 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+# A unit of write work: receives the writer session, stages its changes and
+# returns whatever the caller should get back (usually the ORM object)
+WriteWork = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class GroupCommitter:
+    """Single writer task that coalesces concurrent writes into one transaction.
+
+    Every submitted unit of work runs inside its own SAVEPOINT on a shared
+    writer session, so a failing request only rolls back its own changes.
+    Whatever has queued up while the previous batch was committing is then
+    committed at once, paying a single lock acquisition and WAL sync.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        max_batch_size: int = 256,
+        max_batch_delay: float = 0.0,
+    ):
+        self.session_factory = session_factory
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.batches = 0
+        self.writes = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def submit(self, work: WriteWork) -> Any:
+        """Queue work for the next batch and wait for that batch to commit."""
+        if self._writer is None or self._writer.done():
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((work, future))
+        return await future
+
+    async def close(self):
+        """Commit everything already queued, then stop the writer task."""
+        if self._writer is None or self._writer.done():
+            return
+        await self._queue.put(None)
+        await self._writer
+        self._writer = None
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = await self._fill_batch(batch)
+            await self._commit_batch(batch)
+            if stop:
+                return
+
+    async def _fill_batch(self, batch: List[Tuple[WriteWork, asyncio.Future]]) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_batch_delay
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    return False
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    return False
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    async def _commit_batch(self, batch: List[Tuple[WriteWork, asyncio.Future]]):
+        outcomes = []
+        async with self.session_factory() as session:
+            for work, future in batch:
+                # The request went away before its turn; don't apply its write
+                if future.done():
+                    continue
+                try:
+                    async with session.begin_nested():
+                        result = await work(session)
+                except Exception as exc:
+                    outcomes.append((future, exc, False))
+                else:
+                    outcomes.append((future, result, True))
+
+            try:
+                await session.commit()
+            except Exception as exc:
+                await session.rollback()
+                outcomes = [(future, value if not ok else exc, False) for future, value, ok in outcomes]
+
+        self.batches += 1
+        self.writes += len(outcomes)
+        for future, value, ok in outcomes:
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
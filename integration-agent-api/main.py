@@ -1,12 +1,72 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from routers import integration_agents, integration_processes, process_schedules, process_tasks, connectors, fields, transformations, auth
-from db_init import init_db
+import logging
+from contextlib import asynccontextmanager
+from startup import startup_report
 
-app = FastAPI()
+with startup_report.phase("import fastapi"):
+    from fastapi import FastAPI
+    from fastapi.middleware.cors import CORSMiddleware
 
-# Initialize database tables
-init_db()
+with startup_report.phase("import database"):
+    from db_init import init_db, STARTUP_MODE
+    from database import engine, close_group_committers
+    from cache import existence_cache
+    from password_pool import password_pool
+    from status_hub import status_hub
+
+# One at a time with dependencies first, so each phase only counts the
+# router's own models and routes
+ROUTER_MODULES = [
+    "auth", "integration_processes", "process_schedules", "process_tasks",
+    "connectors", "fields", "transformations", "integration_agents", "process_status", "run_logs", "run_history", "search",
+]
+for name in ROUTER_MODULES:
+    startup_report.import_module(f"routers.{name}")
+from routers import integration_agents, integration_processes, process_schedules, process_tasks, connectors, fields, transformations, auth, process_status, run_logs, run_history, search
+from checkpoints import RESUME_ON_STARTUP
+from worker_lock import directory_locks
+from rate_limits import rate_limiter
+from circuit_breakers import circuit_breakers
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Migrate the database, or only check its version stamp
+    with startup_report.phase(f"init_db ({STARTUP_MODE})"):
+        await init_db()
+    # The local stores belong to one worker; a second one sharing their
+    # directories stops here
+    directory_locks.acquire([
+        run_logs.run_log_store.root, run_history.run_history.root,
+        integration_processes.checkpoint_store.root, integration_processes.webhook_ingest.root,
+    ])
+    # Runs cut off by the last shutdown or crash carry on from their
+    # checkpoints. The engine is only loaded here when there are any; routers
+    # import it with the first request that runs a process
+    if RESUME_ON_STARTUP and integration_processes.checkpoint_store.process_ids():
+        with startup_report.phase("import process engine"):
+            from process_engine import process_engine
+        resumed = await process_engine.resume_interrupted(engine)
+        if resumed:
+            logger.info("Resumed interrupted runs of processes %s", resumed)
+    # Webhooks taken before the last shutdown but not yet run
+    recovered = await integration_processes.webhook_ingest.recover(engine)
+    if recovered:
+        logger.info("Recovered waiting webhooks of processes %s", recovered)
+    logger.info("Startup took %sms: %s", startup_report.stats()["total_ms"], startup_report.phases)
+    yield
+    # Nothing starts new runs once the webhook streams are closed
+    await integration_processes.webhook_ingest.shutdown()
+    # Runs still write their status, so they stop before the writers do
+    from process_engine import process_engine
+    await process_engine.shutdown()
+    await close_group_committers()
+    await rate_limiter.close()
+    password_pool.shutdown()
+    directory_locks.release()
+    await engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 origins = [
@@ -27,18 +87,76 @@ app.add_middleware(
 )
 
 # Include routers
-app.include_router(auth.router, prefix="/api")
-app.include_router(integration_agents.router, prefix="/api", tags=["integration-agents"])
-app.include_router(integration_processes.router, prefix="/api")
-app.include_router(process_schedules.router, prefix="/api")
-app.include_router(process_tasks.router, prefix="/api")
-app.include_router(connectors.router, prefix="/api", tags=["connectors"])
-app.include_router(fields.router, prefix="/api")
-app.include_router(transformations.router, prefix="/api")
+with startup_report.phase("include routers"):
+    app.include_router(auth.router, prefix="/api")
+    app.include_router(integration_agents.router, prefix="/api", tags=["integration-agents"])
+    app.include_router(integration_processes.router, prefix="/api")
+    app.include_router(process_schedules.router, prefix="/api")
+    app.include_router(process_tasks.router, prefix="/api")
+    app.include_router(connectors.router, prefix="/api", tags=["connectors"])
+    app.include_router(fields.router, prefix="/api")
+    app.include_router(transformations.router, prefix="/api")
+    app.include_router(process_status.router, prefix="/api", tags=["process-status"])
+    app.include_router(run_logs.router, prefix="/api", tags=["run-logs"])
+    app.include_router(run_history.router, prefix="/api", tags=["run-history"])
+    app.include_router(search.router, prefix="/api", tags=["search"])
 
 @app.get("/")
 async def root():
     return {"message": "Integration Agent API"}
 
+@app.get("/api/metrics/cache")
+async def cache_metrics():
+    return existence_cache.stats()
+
+@app.get("/api/metrics/principals")
+async def principal_metrics():
+    return auth.principal_cache.stats()
+
+@app.get("/api/metrics/password-pool")
+async def password_pool_metrics():
+    return password_pool.stats()
+
+@app.get("/api/metrics/status-hub")
+async def status_hub_metrics():
+    return status_hub.stats()
+
+@app.get("/api/metrics/run-logs")
+async def run_log_metrics():
+    return run_logs.run_log_store.stats()
+
+@app.get("/api/metrics/run-history")
+async def run_history_metrics():
+    return run_history.run_history.stats()
+
+@app.get("/api/metrics/engine")
+async def engine_metrics():
+    from process_engine import process_engine
+    return process_engine.stats()
+
+@app.get("/api/metrics/checkpoints")
+async def checkpoint_metrics():
+    return integration_processes.checkpoint_store.stats()
+
+@app.get("/api/metrics/rate-limits")
+async def rate_limit_metrics():
+    return rate_limiter.stats()
+
+@app.get("/api/metrics/circuit-breakers")
+async def circuit_breaker_metrics():
+    return circuit_breakers.stats()
+
+@app.get("/api/metrics/webhooks")
+async def webhook_metrics():
+    return integration_processes.webhook_ingest.stats()
+
+@app.get("/api/metrics/directory-locks")
+async def directory_lock_metrics():
+    return directory_locks.stats()
+
+@app.get("/api/metrics/startup")
+async def startup_metrics():
+    return startup_report.stats()
+
 # Run the application with: uvicorn main:app --reload
 # Access the Swagger UI at: http://localhost:8000/docs 
\ No newline at end of file
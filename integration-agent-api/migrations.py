@@ -0,0 +1,164 @@
+from typing import Callable, List, Tuple, Union
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+
+from models.models import Base
+from search_index import create_search_index
+
+# The tables as they stood when versioning began, for databases from before
+# it: create_all built those and may have left out tables added since, such
+# as entity_versions. Frozen here rather than taken from the models, which
+# move on. The indexes come with migration 2.
+BASELINE_TABLES = [
+    "CREATE TABLE IF NOT EXISTS entity_versions (scope VARCHAR NOT NULL, version INTEGER NOT NULL, PRIMARY KEY (scope))",
+    "CREATE TABLE IF NOT EXISTS integration_agents ("
+    "id INTEGER NOT NULL, name VARCHAR NOT NULL, code VARCHAR NOT NULL, type VARCHAR(7) NOT NULL, "
+    "enabled BOOLEAN, updates_available BOOLEAN, PRIMARY KEY (id))",
+    "CREATE TABLE IF NOT EXISTS users (id INTEGER NOT NULL, username VARCHAR NOT NULL, password VARCHAR NOT NULL, PRIMARY KEY (id))",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users (username)",
+    "CREATE TABLE IF NOT EXISTS integration_processes ("
+    "id INTEGER NOT NULL, integration_agent_id INTEGER, name VARCHAR, description VARCHAR, auto_start BOOLEAN, "
+    "trigger_type VARCHAR(12) NOT NULL, status VARCHAR(7), PRIMARY KEY (id), "
+    "FOREIGN KEY(integration_agent_id) REFERENCES integration_agents (id))",
+    "CREATE TABLE IF NOT EXISTS process_schedules ("
+    "id INTEGER NOT NULL, integration_process_id INTEGER, recurrence_type VARCHAR(8) NOT NULL, start_date VARCHAR NOT NULL, "
+    "enabled BOOLEAN, interval_minutes INTEGER, day_of_week INTEGER, day_of_month INTEGER, month INTEGER, hour INTEGER, "
+    "minute INTEGER, PRIMARY KEY (id), FOREIGN KEY(integration_process_id) REFERENCES integration_processes (id))",
+    "CREATE TABLE IF NOT EXISTS process_tasks ("
+    "id INTEGER NOT NULL, integration_process_id INTEGER NOT NULL, task_name VARCHAR NOT NULL, description VARCHAR, "
+    "type VARCHAR(6) NOT NULL, sequence_number INTEGER, enabled BOOLEAN, input_source VARCHAR(4), input VARCHAR, "
+    "save_input BOOLEAN, logic_type VARCHAR(14), response VARCHAR, connector_type VARCHAR(12), option_type VARCHAR(19), "
+    "PRIMARY KEY (id), FOREIGN KEY(integration_process_id) REFERENCES integration_processes (id))",
+    "CREATE TABLE IF NOT EXISTS connectors ("
+    "id INTEGER NOT NULL, process_task_id INTEGER NOT NULL, data_type VARCHAR(6) NOT NULL, connector_type VARCHAR(12) NOT NULL, "
+    "from_email VARCHAR, email VARCHAR, subject VARCHAR, queue_path VARCHAR, service_type VARCHAR(4), end_point VARCHAR, "
+    "response_tag VARCHAR, database_type VARCHAR(15), connection_string VARCHAR, query_type VARCHAR(14), \"query\" VARCHAR, "
+    "PRIMARY KEY (id), FOREIGN KEY(process_task_id) REFERENCES process_tasks (id))",
+    "CREATE TABLE IF NOT EXISTS fields ("
+    "id INTEGER NOT NULL, process_task_id INTEGER NOT NULL, field_name VARCHAR NOT NULL, data_type VARCHAR(6) NOT NULL, "
+    "value VARCHAR, PRIMARY KEY (id), FOREIGN KEY(process_task_id) REFERENCES process_tasks (id))",
+    "CREATE TABLE IF NOT EXISTS task_fields ("
+    "task_id INTEGER, field_id INTEGER, FOREIGN KEY(task_id) REFERENCES process_tasks (id), "
+    "FOREIGN KEY(field_id) REFERENCES fields (id))",
+    "CREATE TABLE IF NOT EXISTS transformations ("
+    "id INTEGER NOT NULL, condition_type VARCHAR(16) NOT NULL, c_field_id INTEGER, v_field_id INTEGER, "
+    "process_task_id INTEGER NOT NULL, PRIMARY KEY (id), FOREIGN KEY(c_field_id) REFERENCES fields (id), "
+    "FOREIGN KEY(v_field_id) REFERENCES fields (id), FOREIGN KEY(process_task_id) REFERENCES process_tasks (id))",
+]
+
+def _add_missing_columns(connection: Connection, table: str, columns: List[Tuple[str, str]]):
+    # Databases created by create_all since the columns were added have
+    # them already
+    existing = {column["name"] for column in inspect(connection).get_columns(table)}
+    for name, definition in columns:
+        if name not in existing:
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+def _add_fan_out_settings(connection: Connection):
+    _add_missing_columns(connection, "integration_processes", [
+        ("parallelism", "INTEGER DEFAULT 1"),
+        ("max_in_flight", "INTEGER DEFAULT 100"),
+        ("preserve_order", "BOOLEAN DEFAULT 1"),
+    ])
+
+def _add_rate_limits(connection: Connection):
+    _add_missing_columns(connection, "connectors", [("rate_limit", "FLOAT"), ("rate_burst", "INTEGER")])
+    connection.exec_driver_sql("CREATE TABLE IF NOT EXISTS rate_limit_state (key VARCHAR NOT NULL, due_at FLOAT NOT NULL, PRIMARY KEY (key))")
+
+# Applied in order to bring an existing database up to date. The version of
+# the last one applied is stored in PRAGMA user_version. A step is either a
+# function of the connection or a list of SQL statements. Never edit a
+# released migration, add a new one instead.
+MIGRATIONS: List[Tuple[int, str, Union[Callable[[Connection], None], List[str]]]] = [
+    (1, "baseline tables", BASELINE_TABLES),
+    (2, "index foreign keys and the task order", [
+        # INTEGER PRIMARY KEY is the rowid, an index on it is pure overhead
+        "DROP INDEX IF EXISTS ix_process_tasks_id",
+        "DROP INDEX IF EXISTS ix_fields_id",
+        "DROP INDEX IF EXISTS ix_users_id",
+        "CREATE INDEX IF NOT EXISTS ix_integration_processes_integration_agent_id ON integration_processes (integration_agent_id)",
+        "CREATE INDEX IF NOT EXISTS ix_process_schedules_integration_process_id ON process_schedules (integration_process_id)",
+        "CREATE INDEX IF NOT EXISTS ix_process_tasks_process_sequence ON process_tasks (integration_process_id, sequence_number)",
+        "CREATE INDEX IF NOT EXISTS ix_process_tasks_sequence_number ON process_tasks (sequence_number)",
+        "CREATE INDEX IF NOT EXISTS ix_fields_process_task_id ON fields (process_task_id)",
+        "CREATE INDEX IF NOT EXISTS ix_connectors_process_task_id ON connectors (process_task_id)",
+        "CREATE INDEX IF NOT EXISTS ix_transformations_process_task_id ON transformations (process_task_id)",
+        "CREATE INDEX IF NOT EXISTS ix_transformations_c_field_id ON transformations (c_field_id)",
+        "CREATE INDEX IF NOT EXISTS ix_transformations_v_field_id ON transformations (v_field_id)",
+    ]),
+    (3, "full-text search index", create_search_index),
+    (4, "task dependencies", [
+        "CREATE TABLE IF NOT EXISTS task_dependencies ("
+        "id INTEGER NOT NULL, task_id INTEGER NOT NULL, depends_on_id INTEGER NOT NULL, PRIMARY KEY (id), "
+        "UNIQUE (task_id, depends_on_id), FOREIGN KEY(task_id) REFERENCES process_tasks (id), "
+        "FOREIGN KEY(depends_on_id) REFERENCES process_tasks (id))",
+        "CREATE INDEX IF NOT EXISTS ix_task_dependencies_depends_on_id ON task_dependencies (depends_on_id)",
+    ]),
+    (5, "per-process fan-out settings", _add_fan_out_settings),
+    (6, "connector rate limits", _add_rate_limits),
+    # Shared rate limits moved to a database file of their own (rate_limits.py)
+    (7, "move rate limit state out", ["DROP TABLE IF EXISTS rate_limit_state"]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+def migrate(connection: Connection) -> int:
+    """Bring the database on connection to SCHEMA_VERSION and return it.
+
+    A new database is created straight from the models, which always
+    describe the latest schema. Run through migrate_in_transaction so a
+    failed migration leaves the previous version in place.
+    """
+    version = schema_version(connection)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this build supports ({SCHEMA_VERSION})")
+    if version == SCHEMA_VERSION:
+        return version
+
+    if version == 0 and not inspect(connection).get_table_names():
+        Base.metadata.create_all(connection)
+    else:
+        for number, _, step in MIGRATIONS:
+            if number <= version:
+                continue
+            if callable(step):
+                step(connection)
+            else:
+                for statement in step:
+                    connection.exec_driver_sql(statement)
+
+    connection.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return SCHEMA_VERSION
+
+def migrate_in_transaction(connection: Connection) -> int:
+    """migrate() as one SQLite transaction, DDL included.
+
+    pysqlite only opens a transaction of its own before DML, so under the
+    usual begin() every CREATE, ALTER and DROP commits as it runs. This
+    wants a connection in AUTOCOMMIT, where the driver leaves transactions
+    alone, and begins and ends its own.
+    """
+    connection.exec_driver_sql("BEGIN IMMEDIATE")
+    try:
+        version = migrate(connection)
+    except BaseException:
+        connection.exec_driver_sql("ROLLBACK")
+        raise
+    connection.exec_driver_sql("COMMIT")
+    return version
+
+def check_schema(connection: Connection) -> int:
+    """Fail unless the database is already at SCHEMA_VERSION.
+
+    Reads only the version stamp in the database header, so workers that
+    leave migrations to a single deploy step start without reflecting
+    tables or taking the write lock.
+    """
+    version = schema_version(connection)
+    if version != SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} does not match this build ({SCHEMA_VERSION}), run the migrations first")
+    return version
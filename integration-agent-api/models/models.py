@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Enum, Table
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Enum, Table, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
@@ -96,23 +96,31 @@ class IntegrationProcess(Base):
     __tablename__ = 'integration_processes'
 
     id = Column(Integer, primary_key=True)
-    integration_agent_id = Column(Integer, ForeignKey('integration_agents.id'))
+    integration_agent_id = Column(Integer, ForeignKey('integration_agents.id'), index=True)
     name = Column(String, nullable=True)
     description = Column(String, nullable=True)
     auto_start = Column(Boolean, default=False)
     trigger_type = Column(Enum(TriggerType), nullable=False)
     status = Column(Enum(ProcessStatus), default=ProcessStatus.Stopped)
-    
+
+    # Per-record calls of a task (a Single connector given a batch) run up
+    # to parallelism at a time, with at most max_in_flight records started
+    # but not yet handed on. Without preserve_order records are handed on
+    # as their calls finish.
+    parallelism = Column(Integer, default=1)
+    max_in_flight = Column(Integer, default=100)
+    preserve_order = Column(Boolean, default=True)
+
     # Relationships
     integration_agent = relationship('IntegrationAgent')
     scheduler = relationship('ProcessSchedule', back_populates='process', uselist=False)
-    tasks = relationship("ProcessTask", back_populates="integration_process")
+    tasks = relationship("ProcessTask", back_populates="integration_process", order_by="ProcessTask.sequence_number")
 
 class ProcessSchedule(Base):
     __tablename__ = 'process_schedules'
 
     id = Column(Integer, primary_key=True)
-    integration_process_id = Column(Integer, ForeignKey('integration_processes.id'))
+    integration_process_id = Column(Integer, ForeignKey('integration_processes.id'), index=True)
     recurrence_type = Column(Enum(Recurrence), nullable=False)
     start_date = Column(String, nullable=False)
     enabled = Column(Boolean, default=True)
@@ -128,13 +136,17 @@ class ProcessSchedule(Base):
 
 class ProcessTask(Base):
     __tablename__ = "process_tasks"
+    # Serves tasks of a process in sequence order; the rowid that ends every
+    # SQLite index is the id tie-breaker of the task cursor. The index on
+    # sequence_number alone does the same for the unfiltered list.
+    __table_args__ = (Index("ix_process_tasks_process_sequence", "integration_process_id", "sequence_number"),)
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     integration_process_id = Column(Integer, ForeignKey("integration_processes.id"), nullable=False)
     task_name = Column(String, nullable=False)
     description = Column(String, nullable=True)
     type = Column(Enum(TaskType), nullable=False)
-    sequence_number = Column(Integer, default=10)
+    sequence_number = Column(Integer, default=10, index=True)
     enabled = Column(Boolean, default=True)
     
     # Task Common Fields
@@ -155,6 +167,25 @@ class ProcessTask(Base):
     static_fields = relationship("Field", back_populates="process_task", cascade="all, delete-orphan")
     transformations = relationship("Transformation", back_populates="process_task", cascade="all, delete-orphan")
     connectors = relationship("Connector", back_populates="process_task", cascade="all, delete-orphan")
+    dependencies = relationship(
+        "TaskDependency", foreign_keys="TaskDependency.task_id", back_populates="task", cascade="all, delete-orphan"
+    )
+    dependents = relationship(
+        "TaskDependency", foreign_keys="TaskDependency.depends_on_id", back_populates="depends_on", cascade="all, delete-orphan"
+    )
+
+class TaskDependency(Base):
+    __tablename__ = "task_dependencies"
+    # A task with dependencies starts on their output instead of on the
+    # tasks of the previous sequence number
+    __table_args__ = (UniqueConstraint("task_id", "depends_on_id"),)
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey("process_tasks.id"), nullable=False)
+    depends_on_id = Column(Integer, ForeignKey("process_tasks.id"), nullable=False, index=True)
+
+    task = relationship("ProcessTask", foreign_keys=[task_id], back_populates="dependencies")
+    depends_on = relationship("ProcessTask", foreign_keys=[depends_on_id], back_populates="dependents")
 
 # Association table for task and fields
 task_fields = Table('task_fields', Base.metadata,
@@ -166,7 +197,7 @@ class Connector(Base):
     __tablename__ = 'connectors'
 
     id = Column(Integer, primary_key=True)
-    process_task_id = Column(Integer, ForeignKey('process_tasks.id'), nullable=False)
+    process_task_id = Column(Integer, ForeignKey('process_tasks.id'), nullable=False, index=True)
     data_type = Column(Enum(DataType), nullable=False)
     connector_type = Column(Enum(ConnectorType), nullable=False)
     
@@ -188,6 +219,11 @@ class Connector(Base):
     connection_string = Column(String, nullable=True)
     query_type = Column(Enum(QueryType), nullable=True)
     query = Column(String, nullable=True)
+
+    # Calls per second and how many may go at once after a quiet spell,
+    # shared with every connector of the same target
+    rate_limit = Column(Float, nullable=True)
+    rate_burst = Column(Integer, nullable=True)
     
     # Relationships
     process_task = relationship("ProcessTask", back_populates="connectors")
@@ -195,8 +231,8 @@ class Connector(Base):
 class Field(Base):
     __tablename__ = "fields"
     
-    id = Column(Integer, primary_key=True, index=True)
-    process_task_id = Column(Integer, ForeignKey("process_tasks.id"), nullable=False)
+    id = Column(Integer, primary_key=True)
+    process_task_id = Column(Integer, ForeignKey("process_tasks.id"), nullable=False, index=True)
     field_name = Column(String, nullable=False)
     data_type = Column(Enum(DataType), nullable=False)
     value = Column(String, nullable=True)
@@ -208,19 +244,27 @@ class Transformation(Base):
 
     id = Column(Integer, primary_key=True)
     condition_type = Column(Enum(ConditionType), nullable=False)
-    c_field_id = Column(Integer, ForeignKey('fields.id'))
+    c_field_id = Column(Integer, ForeignKey('fields.id'), index=True)
     c_field = relationship('Field', foreign_keys=[c_field_id])
-    v_field_id = Column(Integer, ForeignKey('fields.id'))
+    v_field_id = Column(Integer, ForeignKey('fields.id'), index=True)
     v_field = relationship('Field', foreign_keys=[v_field_id])
     
     # Add relationship to ProcessTask
-    process_task_id = Column(Integer, ForeignKey("process_tasks.id"), nullable=False)
+    process_task_id = Column(Integer, ForeignKey("process_tasks.id"), nullable=False, index=True)
     process_task = relationship("ProcessTask", back_populates="transformations")
 
+class EntityVersion(Base):
+    __tablename__ = 'entity_versions'
+
+    # A table name for list endpoints, or agent:<id>, process:<id> and
+    # task:<id> for an entity together with everything below it
+    scope = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
 class User(Base):
     __tablename__ = 'users'
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     username = Column(String, unique=True, index=True, nullable=False)
     password = Column(String, nullable=False)
 
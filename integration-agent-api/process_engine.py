@@ -0,0 +1,983 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import tracemalloc
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import selectinload
+
+from models.models import (
+    IntegrationProcess, ProcessTask, Transformation, TaskDependency, TaskType, LogicType, ConditionType, InputSource, ProcessStatus, DataType,
+)
+import checkpoints
+from checkpoints import checkpoint_store
+from connector_clients import ConnectorClient, ConnectorError, StubClient, batches, client_for, records_from
+from database import commit_write
+from run_history import run_history
+from run_logs import run_log_store
+from status_hub import STATUS_TICK, status_hub
+
+logger = logging.getLogger(__name__)
+
+# What a task may hold, queued or waiting at a join, before the tasks
+# feeding it wait: records, or bytes of JSON when QUEUE_BYTES is set
+QUEUE_RECORDS = int(os.getenv("INTEGRATION_AGENT_ENGINE_QUEUE_RECORDS", "5000"))
+QUEUE_BYTES = int(os.getenv("INTEGRATION_AGENT_ENGINE_QUEUE_BYTES", "0"))
+# Input tasks with a File input source read it from under this directory;
+# paths leading anywhere else are refused, so editing a task does not give
+# access to the server's other files
+INPUT_FILE_DIR = os.getenv("INTEGRATION_AGENT_ENGINE_INPUT_FILE_DIR", "input_files")
+
+class EngineError(Exception):
+    """A process cannot be run as configured."""
+
+class MemoryTracing:
+    """Shares tracemalloc, which traces the whole process, between the runs
+    profiling memory: the first starts it and the last stops it, unless it
+    was already on, so one run finishing does not cut another's off."""
+
+    def __init__(self):
+        self.users = 0
+        self.started = False
+
+    def acquire(self):
+        if self.users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started = True
+        self.users += 1
+
+    def release(self):
+        self.users -= 1
+        if self.users == 0 and self.started:
+            tracemalloc.stop()
+            self.started = False
+
+memory_tracing = MemoryTracing()
+
+async def load_process(db: AsyncSession, process_id: int) -> Optional[IntegrationProcess]:
+    """A process with everything its tasks need, loaded up front so the run
+    never goes back to the database."""
+    return await db.scalar(
+        select(IntegrationProcess)
+        .where(IntegrationProcess.id == process_id)
+        .options(
+            selectinload(IntegrationProcess.tasks).selectinload(ProcessTask.connectors),
+            selectinload(IntegrationProcess.tasks).selectinload(ProcessTask.static_fields),
+            selectinload(IntegrationProcess.tasks).selectinload(ProcessTask.dependencies),
+            selectinload(IntegrationProcess.tasks).selectinload(ProcessTask.transformations).selectinload(Transformation.c_field),
+            selectinload(IntegrationProcess.tasks).selectinload(ProcessTask.transformations).selectinload(Transformation.v_field),
+        )
+    )
+
+COMPARISONS = {
+    ConditionType.Equal: lambda a, b: a == b,
+    ConditionType.NotEqual: lambda a, b: a != b,
+    ConditionType.GreaterThan: lambda a, b: a > b,
+    ConditionType.LessThan: lambda a, b: a < b,
+    ConditionType.GreaterThanEqual: lambda a, b: a >= b,
+    ConditionType.LessThanEqual: lambda a, b: a <= b,
+}
+
+def compare(condition: ConditionType, value, expected) -> bool:
+    # Field values are stored as text, so numbers compare as numbers when
+    # both sides read as one
+    try:
+        value, expected = float(value), float(expected)
+    except (TypeError, ValueError):
+        value, expected = ("" if value is None else str(value)), ("" if expected is None else str(expected))
+    return COMPARISONS[condition](value, expected)
+
+class TaskStats:
+    """What one task did during a run, and what it cost."""
+
+    def __init__(self, task: ProcessTask, sample_size: int):
+        self.task = task
+        self.sample_size = sample_size
+        self.records_in = 0
+        self.records_out = 0
+        self.batches = 0
+        self.wall_ms = 0.0
+        self.cpu_ms = 0.0
+        self.peak_memory_bytes = 0
+        self.peak_in_flight = 0
+        self.peak_reordered = 0
+        self.stall_ms = 0.0
+        self.sample: List[dict] = []
+        self.error: Optional[str] = None
+
+    def add_output(self, records: List[dict]):
+        self.records_out += len(records)
+        if len(self.sample) < self.sample_size:
+            self.sample.extend(records[:self.sample_size - len(self.sample)])
+
+    def as_dict(self) -> dict:
+        return {
+            "task_id": self.task.id,
+            "task_name": self.task.task_name,
+            "type": self.task.type.value,
+            "sequence_number": self.task.sequence_number,
+            "records_in": self.records_in,
+            "records_out": self.records_out,
+            "batches": self.batches,
+            "wall_ms": round(self.wall_ms, 3),
+            "cpu_ms": round(self.cpu_ms, 3),
+            "peak_memory_bytes": self.peak_memory_bytes,
+            "peak_in_flight": self.peak_in_flight,
+            "peak_reordered": self.peak_reordered,
+            "stall_ms": round(self.stall_ms, 3),
+            "sample": self.sample,
+            "error": self.error,
+        }
+
+async def fan_out(
+    items: Iterable,
+    work: Callable[..., Awaitable],
+    parallelism: int = 1,
+    max_in_flight: int = 0,
+    ordered: bool = True,
+    stats: Optional[TaskStats] = None,
+) -> AsyncIterator:
+    """Yield work(item) for every item, with up to parallelism calls running.
+
+    In order, a result that finishes ahead of an earlier item's waits in a
+    reorder buffer; unordered, results are yielded as they finish.
+    max_in_flight bounds the items started but not yet yielded, running or
+    buffered, so one slow item holds back new calls instead of letting the
+    buffer grow. The first call to fail cancels the rest.
+    """
+    parallelism = max(1, parallelism)
+    max_in_flight = max(parallelism, max_in_flight)
+    pending = enumerate(items)
+    exhausted = False
+    running: Dict[asyncio.Future, int] = {}
+    reordered: Dict[int, object] = {}
+    started = yielded = 0
+    try:
+        while True:
+            while not exhausted and len(running) < parallelism and started - yielded < max_in_flight:
+                try:
+                    index, item = next(pending)
+                except StopIteration:
+                    exhausted = True
+                    break
+                running[asyncio.ensure_future(work(item))] = index
+                started += 1
+            if not running:
+                return
+            if stats is not None:
+                stats.peak_in_flight = max(stats.peak_in_flight, started - yielded)
+            finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                if ordered:
+                    reordered[index] = future.result()
+                else:
+                    yielded += 1
+                    yield future.result()
+            if ordered:
+                while yielded in reordered:
+                    result = reordered.pop(yielded)
+                    yielded += 1
+                    yield result
+                if stats is not None:
+                    stats.peak_reordered = max(stats.peak_reordered, len(reordered))
+    finally:
+        for future in running:
+            future.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+class TaskRunner:
+    """Runs one task: fetching for Input tasks, the logic of Logic tasks and
+    sending for Output tasks. Every task hands its records on."""
+
+    def __init__(self, task: ProcessTask, run: "Run"):
+        self.task = task
+        self.run = run
+        self.stats = TaskStats(task, run.sample_size)
+        # Static fields are constants merged into records, apart from those
+        # the task's transformations compare against or assign
+        referenced = {t.c_field_id for t in task.transformations} | {t.v_field_id for t in task.transformations}
+        self.constants = {field.field_name: field.value for field in task.static_fields if field.id not in referenced}
+        self.clients: List[ConnectorClient] = []
+        # Where the batch after the last one source yielded starts, as
+        # [connector index, connector position]
+        self.position = None
+        self._published_at = 0.0
+
+    def publish_progress(self, final: bool = False):
+        # At most once per status tick, since watchers only see the latest
+        # counters of a tick anyway; once more when the task is done
+        if self.run.dry_run:
+            return
+        now = time.monotonic()
+        if not final and now - self._published_at < STATUS_TICK:
+            return
+        self._published_at = now
+        stats = self.stats
+        status_hub.publish(self.run.process.id, tasks={
+            self.task.id: {"in": stats.records_in, "out": stats.records_out, "errors": int(stats.error is not None)},
+        })
+
+    def open(self):
+        # Dry runs read sample input instead of Input connectors and keep
+        # what Output connectors would have sent
+        task, dry_run = self.task, self.run.dry_run
+        if task.type == TaskType.Output:
+            self.clients = [StubClient(c) if dry_run else client_for(c) for c in task.connectors]
+        elif task.type == TaskType.Input and not dry_run:
+            self.clients = [client_for(c) for c in task.connectors]
+
+    def _read_input_file(self) -> str:
+        root = os.path.realpath(INPUT_FILE_DIR)
+        path = os.path.realpath(os.path.join(root, self.task.input))
+        if os.path.commonpath([root, path]) != root:
+            raise EngineError(f"Task {self.task.id} input file must be under {INPUT_FILE_DIR}")
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return file.read()
+        except OSError as error:
+            raise EngineError(f"Task {self.task.id} input file cannot be read: {error}") from error
+
+    async def sample_input(self) -> List[dict]:
+        if not self.task.input:
+            return []
+        if self.task.input_source == InputSource.File:
+            text = await asyncio.to_thread(self._read_input_file)
+        else:
+            text = self.task.input
+        try:
+            return records_from(json.loads(text))
+        except ValueError:
+            return [{"value": text}]
+
+    async def source(self, position=None) -> AsyncIterator[List[dict]]:
+        start, offset = position or (0, None)
+        if not self.clients:
+            offset = offset or 0
+            for batch in batches((await self.sample_input())[offset:]):
+                offset += len(batch)
+                self.position = [0, offset]
+                yield self.enrich(batch)
+            return
+        for index, client in enumerate(self.clients):
+            if index < start:
+                continue
+            async for batch in client.fetch(offset if index == start else None):
+                self.position = [index, client.position]
+                yield self.enrich(batch)
+
+    def enrich(self, batch: List[dict]) -> List[dict]:
+        if not self.constants:
+            return batch
+        return [{**record, **self.constants} for record in batch]
+
+    async def process(self, batch: List[dict]) -> List[dict]:
+        task = self.task
+        if task.type == TaskType.Output:
+            payload = self.enrich(batch)
+            per_record = [client for client in self.clients if client.connector.data_type != DataType.List]
+            for client in self.clients:
+                if client.connector.data_type == DataType.List:
+                    await client.send(payload)
+            if not per_record:
+                return batch
+
+            async def send(index: int):
+                for client in per_record:
+                    await client.send_one(payload[index])
+                return batch[index]
+            process = self.run.process
+            return [
+                record async for record in fan_out(
+                    range(len(batch)), send, process.parallelism or 1, process.max_in_flight or 0,
+                    process.preserve_order is not False, self.stats,
+                )
+            ]
+        if task.type != TaskType.Logic:
+            return batch
+        if task.logic_type == LogicType.RecordFilter:
+            return [
+                record for record in batch
+                if all(compare(t.condition_type, record.get(t.c_field.field_name), t.c_field.value) for t in task.transformations)
+            ]
+        if task.logic_type == LogicType.UniqueFilter:
+            keys = list(self.constants) or None
+            seen = self.run.state.setdefault(task.id, set())
+            unique = []
+            for record in batch:
+                key = json.dumps([record.get(name) for name in keys] if keys else record, sort_keys=True, default=str)
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(record)
+            return unique
+        if task.logic_type == LogicType.Transformation:
+            output = []
+            for record in self.enrich(batch):
+                record = dict(record)
+                for t in task.transformations:
+                    if compare(t.condition_type, record.get(t.c_field.field_name), t.c_field.value):
+                        record[t.v_field.field_name] = t.v_field.value
+                output.append(record)
+            return output
+        return batch
+
+    async def close(self):
+        for client in self.clients:
+            await client.close()
+
+class Inbox:
+    """The batches waiting for one task, bounded by their cost in records
+    or bytes.
+
+    A batch counts against the bound from the moment it is put until the
+    task has processed it, including while it waits at a join. A put waits
+    while the bound is reached, so a slow task holds back the tasks before
+    it and in the end the fetch loop of the source. A batch is always let in
+    when the task holds nothing, or when it completes a join the task is
+    waiting on, as otherwise neither side could make progress.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.held = 0
+        self.peak = 0
+        # The join keys the task holds part of, kept by the task
+        self.joining: Dict[tuple, dict] = {}
+        self._waiters: List[asyncio.Future] = []
+
+    def _admits(self, cost: int, key) -> bool:
+        return not self.limit or not self.held or self.held + cost <= self.limit or key in self.joining
+
+    async def put(self, item: tuple, cost: int = 0) -> float:
+        """Queue item once there is room and return the seconds waited."""
+        key = item[1]
+        stalled = 0.0
+        if not self._admits(cost, key):
+            started = time.perf_counter()
+            while not self._admits(cost, key):
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+                await waiter
+            stalled = time.perf_counter() - started
+        self.held += cost
+        self.peak = max(self.peak, self.held)
+        self.queue.put_nowait(item + (cost,))
+        return stalled
+
+    async def get(self) -> tuple:
+        return await self.queue.get()
+
+    def release(self, cost: int = 0):
+        self.held -= cost
+        self.wake()
+
+    def wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+class Watermark:
+    """How many of a source's batches, numbered from start, are all done,
+    whatever order they finish in."""
+
+    def __init__(self, start: int = 0):
+        self.next = start
+        self.ahead = set()
+
+    def add(self, number: int):
+        if number < self.next:
+            return
+        self.ahead.add(number)
+        while self.next in self.ahead:
+            self.ahead.remove(self.next)
+            self.next += 1
+
+# Stands for the uploaded payload of a process without Input tasks
+PAYLOAD = -1
+# Sent by a task to the tasks after it once it has no more batches
+DONE = object()
+
+def unsaved_tasks(rows: Iterable[tuple]) -> Dict[int, List[ProcessTask]]:
+    """Tasks to check with task_graph, by process, built from (id, process
+    id, type, sequence number, enabled, depends on id) rows: one per
+    dependency of a task, or one with None for a task without any."""
+    tasks: Dict[int, ProcessTask] = {}
+    by_process: Dict[int, List[ProcessTask]] = {}
+    for task_id, process_id, task_type, sequence_number, enabled, depends_on_id in rows:
+        task = tasks.get(task_id)
+        if task is None:
+            task = tasks[task_id] = ProcessTask(
+                id=task_id, type=task_type, sequence_number=sequence_number, enabled=enabled is not False,
+            )
+            by_process.setdefault(process_id, []).append(task)
+        if depends_on_id is not None:
+            task.dependencies.append(TaskDependency(depends_on_id=depends_on_id))
+    return by_process
+
+def task_graph(tasks: List[ProcessTask]) -> Dict[int, List[int]]:
+    """The ids of the tasks each enabled task takes its records from.
+
+    A task with declared dependencies takes them from those; any other task
+    from every task of the sequence number before its own, so tasks that
+    share a sequence number run side by side and the next number joins
+    them. Nothing comes before the first sequence number, so its tasks
+    other than Input tasks run in the order they were created, after its
+    Input tasks: tasks created without a sequence number all get the
+    default one and would otherwise start with no records. Disabled tasks
+    are skipped over, their dependencies taking their place.
+    """
+    sequences = sorted({task.sequence_number or 0 for task in tasks})
+    by_sequence: Dict[int, List[int]] = {}
+    for task in tasks:
+        by_sequence.setdefault(task.sequence_number or 0, []).append(task.id)
+    first = sorted(
+        (task for task in tasks if (task.sequence_number or 0) == sequences[0] and not task.dependencies),
+        key=lambda task: task.id,
+    ) if tasks else []
+    in_order: Dict[int, List[int]] = {}
+    previous = [task.id for task in first if task.type == TaskType.Input]
+    for task in first:
+        if task.type != TaskType.Input:
+            in_order[task.id], previous = previous, [task.id]
+    declared = {}
+    for task in tasks:
+        if task.dependencies:
+            declared[task.id] = [dependency.depends_on_id for dependency in task.dependencies]
+        else:
+            position = sequences.index(task.sequence_number or 0)
+            declared[task.id] = by_sequence[sequences[position - 1]] if position else in_order.get(task.id, [])
+
+    enabled = {task.id for task in tasks if task.enabled}
+
+    def resolve(task_id: int, path: tuple) -> List[int]:
+        resolved = []
+        for dependency in declared.get(task_id, []):
+            if dependency in path:
+                raise EngineError(f"Task {dependency} depends on itself through {list(path)}")
+            if dependency in enabled:
+                resolved.append(dependency)
+            elif dependency in declared:
+                resolved.extend(resolve(dependency, path + (dependency,)))
+        return list(dict.fromkeys(resolved))
+
+    graph = {task_id: resolve(task_id, (task_id,)) for task_id in declared if task_id in enabled}
+    # Depth-first search with the tasks on the current path marked, so every
+    # task and edge is visited once
+    finished, active = set(), []
+    def visit(task_id: int):
+        active.append(task_id)
+        for dependency in graph[task_id]:
+            if dependency in active:
+                raise EngineError(f"Task {dependency} depends on itself through {active[active.index(dependency):]}")
+            if dependency not in finished:
+                visit(dependency)
+        active.pop()
+        finished.add(task_id)
+    for task_id in graph:
+        if task_id not in finished:
+            visit(task_id)
+    return graph
+
+class Run:
+    """One execution of a process.
+
+    Every enabled task runs as its own worker and the tasks form a graph
+    (see task_graph), so independent branches run concurrently and a run
+    takes as long as its critical path. Records move through the graph in
+    batches, each keyed by the source that produced it. A task with several
+    dependencies waits for a batch from each of those that see its source
+    and processes them together, which is the join point; a batch handed
+    on unchanged by several branches is only taken once. Every task's
+    Inbox is bounded, so a slow task holds back everything before it down to
+    the fetch loop of the sources.
+
+    A real run without a payload keeps a checkpoint: for each source, how
+    many of its batches every Output task and every last task has finished,
+    and where the source's next batch starts, plus how far each Output task
+    got past that. A run given that checkpoint fetches from there, and its
+    Output tasks skip what they had sent, so it redoes at most the batches
+    in flight when the last checkpoint was written. UniqueFilter only
+    remembers the records seen since the resume.
+
+    The time, CPU and memory of each call are charged to the task that made
+    it.
+    """
+
+    def __init__(
+        self,
+        process: IntegrationProcess,
+        dry_run: bool = False,
+        payload=None,
+        sample_size: int = 0,
+        profile_memory: bool = False,
+        checkpoint: Optional[dict] = None,
+    ):
+        self.run_id = uuid.uuid4().hex
+        self.process = process
+        self.dry_run = dry_run
+        self.payload = payload
+        self.sample_size = sample_size
+        self.profile_memory = profile_memory
+        self.state: Dict[int, set] = {}
+        self.runners = [TaskRunner(task, self) for task in process.tasks if task.enabled]
+        self.status = ProcessStatus.Running
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.graph: Dict[int, List[int]] = {}
+        self.dependents: Dict[int, List[int]] = {}
+        self.inboxes: Dict[int, Inbox] = {}
+        self.queue_bytes = QUEUE_BYTES
+        self.queue_limit = QUEUE_BYTES or QUEUE_RECORDS
+        self.checkpointing = not dry_run and payload is None
+        self.resume = checkpoint if self.checkpointing else None
+        self.resumed_from: Optional[str] = None
+        self.acks: Dict[int, Dict[int, Watermark]] = {}
+        self.sent: Dict[int, Dict[int, int]] = {}
+        self.positions: Dict[tuple, object] = {}
+        self.resume_sources: Dict[int, dict] = {}
+        self._saved_at = time.monotonic()
+
+    async def _timed(self, stats: TaskStats, call: Callable):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        if self.profile_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        try:
+            return await call()
+        finally:
+            # CPU time is the event loop thread's, so it includes whatever
+            # other branches and runs did while this call was waiting
+            stats.wall_ms += (time.perf_counter() - wall) * 1000
+            stats.cpu_ms += (time.thread_time() - cpu) * 1000
+            # Process-wide: allocations by other runs and requests while
+            # this call was waiting count too
+            if self.profile_memory:
+                stats.peak_memory_bytes = max(stats.peak_memory_bytes, tracemalloc.get_traced_memory()[1] - baseline)
+
+    def _plan(self):
+        runners = {runner.task.id: runner for runner in self.runners}
+        self.graph = task_graph(self.process.tasks)
+        inputs = [runner for runner in self.runners if runner.task.type == TaskType.Input]
+        # An uploaded payload stands in for the first Input task, or feeds
+        # the first tasks of a process without any
+        self.payload_task = inputs[0].task.id if inputs and self.payload is not None else None
+        if self.payload is not None and not inputs:
+            for task_id, dependencies in self.graph.items():
+                if not dependencies:
+                    dependencies.append(PAYLOAD)
+            self.graph[PAYLOAD] = []
+
+        self.dependents: Dict[int, List[int]] = {task_id: [] for task_id in self.graph}
+        for task_id, dependencies in self.graph.items():
+            for dependency in dependencies:
+                self.dependents[dependency].append(task_id)
+
+        # The sources whose batches reach each task, and so which of its
+        # dependencies a batch from a given source will arrive through
+        self.sources: Dict[int, set] = {}
+        def sources(task_id: int) -> set:
+            if task_id not in self.sources:
+                own = {task_id} if task_id == PAYLOAD or runners[task_id].task.type == TaskType.Input else set()
+                self.sources[task_id] = own.union(*(sources(dependency) for dependency in self.graph[task_id]))
+            return self.sources[task_id]
+        for task_id in self.graph:
+            sources(task_id)
+
+        if self.resume is not None:
+            if self.resume.get("tasks") == sorted(self.graph):
+                self.resumed_from = self.resume.get("run_id")
+                self.resume_sources = {int(source): value for source, value in self.resume["sources"].items()}
+                self.sent = {
+                    int(task_id): {int(source): number for source, number in sent.items()}
+                    for task_id, sent in self.resume.get("sent", {}).items()
+                }
+            else:
+                logger.warning("Process %s changed since its checkpoint, starting over", self.process.id)
+        if self.checkpointing:
+            # Batches count as done once every Output task and every last
+            # task they reach has finished them
+            for task_id in self.graph:
+                if runners[task_id].task.type == TaskType.Output or not self.dependents[task_id]:
+                    self.acks[task_id] = {
+                        source: Watermark(self.resume_sources.get(source, {}).get("batches", 0))
+                        for source in self.sources[task_id]
+                    }
+        self.inboxes = {task_id: Inbox(self.queue_limit) for task_id in self.graph}
+
+    def _cost(self, batch) -> int:
+        if batch is DONE:
+            return 0
+        if self.queue_bytes:
+            return len(json.dumps(batch, separators=(",", ":"), default=str))
+        return len(batch)
+
+    async def _emit(self, task_id: int, key, batch, stats: Optional[TaskStats] = None):
+        # Waiting for room downstream is the stall time of the task emitting
+        cost = self._cost(batch) if self.dependents[task_id] else 0
+        for dependent in self.dependents[task_id]:
+            stalled = await self.inboxes[dependent].put((task_id, key, batch), cost)
+            if stats is not None:
+                stats.stall_ms += stalled * 1000
+
+    async def _source(self, task_id: int):
+        if task_id == PAYLOAD or task_id == self.payload_task:
+            runner = None if task_id == PAYLOAD else next(r for r in self.runners if r.task.id == task_id)
+            for number, batch in enumerate(batches(records_from(self.payload))):
+                if runner is not None:
+                    batch = runner.enrich(batch)
+                    runner.stats.batches += 1
+                    runner.stats.add_output(batch)
+                await self._emit(task_id, (task_id, number), batch, runner.stats if runner else None)
+            return
+
+        runner = next(r for r in self.runners if r.task.id == task_id)
+        resume = self.resume_sources.get(task_id, {})
+        batches_out = runner.source(resume.get("position")).__aiter__()
+        number = resume.get("batches", 0)
+        while True:
+            try:
+                batch = await self._timed(runner.stats, batches_out.__anext__)
+            except StopAsyncIteration:
+                return
+            except Exception as error:
+                runner.stats.error = str(error)
+                raise
+            runner.stats.batches += 1
+            runner.stats.add_output(batch)
+            runner.publish_progress()
+            if self.checkpointing:
+                self.positions[(task_id, number)] = runner.position
+            # Waits while the tasks after this one are full, so the source is
+            # read no faster than they keep up
+            await self._emit(task_id, (task_id, number), batch, runner.stats)
+            await self._acknowledge(task_id, (task_id, number))
+            number += 1
+
+    async def _work(self, runner: TaskRunner):
+        task_id = runner.task.id
+        dependencies = self.graph[task_id]
+        source = None
+        if runner.task.type == TaskType.Input:
+            source = asyncio.create_task(self._source(task_id))
+        inbox = self.inboxes[task_id]
+        try:
+            pending = inbox.joining
+            costs: Dict[tuple, int] = {}
+            open_dependencies = len(dependencies)
+            while open_dependencies:
+                dependency, key, batch, cost = await inbox.get()
+                if batch is DONE:
+                    open_dependencies -= 1
+                    continue
+                parts = pending.setdefault(key, {})
+                parts[dependency] = batch
+                costs[key] = costs.get(key, 0) + cost
+                if len(parts) < sum(key[0] in self.sources[d] for d in dependencies):
+                    # The other parts of this key may now be let in
+                    inbox.wake()
+                    continue
+                del pending[key]
+
+                distinct = list({id(part): part for part in (parts[d] for d in dependencies if d in parts)}.values())
+                merged = distinct[0] if len(distinct) == 1 else [record for part in distinct for record in part]
+                # What an Output task sent before the run this one resumes was
+                # cut off is handed on without sending it again
+                sent = key[1] < self.sent.get(task_id, {}).get(key[0], 0)
+                if merged and not sent:
+                    runner.stats.records_in += len(merged)
+                    runner.stats.batches += 1
+                    try:
+                        merged = await self._timed(runner.stats, lambda: runner.process(merged))
+                    except Exception as error:
+                        runner.stats.error = str(error)
+                        raise
+                    runner.stats.add_output(merged)
+                    runner.publish_progress()
+                inbox.release(costs.pop(key))
+                await self._emit(task_id, key, merged, runner.stats)
+                await self._acknowledge(task_id, key)
+                if not self.dependents[task_id] and not self.dry_run:
+                    status_hub.publish(self.process.id, run={"run_id": self.run_id, "records": self.records})
+            if source is not None:
+                await source
+        finally:
+            if source is not None and not source.done():
+                source.cancel()
+            runner.publish_progress(final=True)
+        await self._emit(task_id, None, DONE)
+
+    async def _acknowledge(self, task_id: int, key: tuple):
+        acks = self.acks.get(task_id)
+        if acks is None:
+            return
+        acks[key[0]].add(key[1])
+        if time.monotonic() - self._saved_at >= checkpoints.CHECKPOINT_INTERVAL:
+            self._saved_at = time.monotonic()
+            await run_in_threadpool(checkpoint_store.save, self.process.id, self.checkpoint())
+
+    def checkpoint(self) -> dict:
+        sources = {}
+        for source in {source for acks in self.acks.values() for source in acks}:
+            done = min(acks[source].next for acks in self.acks.values() if source in acks)
+            resume = self.resume_sources.get(source, {})
+            if done == resume.get("batches", 0):
+                position = resume.get("position")
+            else:
+                position = self.positions[(source, done - 1)]
+            # Positions before the last done batch are never needed again
+            for key in [key for key in self.positions if key[0] == source and key[1] < done - 1]:
+                del self.positions[key]
+            sources[str(source)] = {"batches": done, "position": position}
+        return {
+            "run_id": self.run_id,
+            "process_id": self.process.id,
+            "saved_at": time.time(),
+            "tasks": sorted(self.graph),
+            "sources": sources,
+            "sent": {
+                str(task_id): {str(source): watermark.next for source, watermark in acks.items()}
+                for task_id, acks in self.acks.items()
+                if next(r for r in self.runners if r.task.id == task_id).task.type == TaskType.Output
+            },
+        }
+
+    async def _feed_payload(self):
+        await self._source(PAYLOAD)
+        await self._emit(PAYLOAD, None, DONE)
+
+    @property
+    def records(self) -> int:
+        # What reached the end of the graph, counted once across fan-out
+        sinks = [runner for runner in self.runners if not self.dependents.get(runner.task.id, True)]
+        return max((runner.stats.records_out for runner in sinks), default=0)
+
+    def queue_stats(self, task_id: int) -> dict:
+        """What waits for a task now and at most, in records or bytes. A
+        full queue behind stalled producers marks the bottleneck."""
+        inbox = self.inboxes.get(task_id)
+        return {
+            "queue_unit": "bytes" if self.queue_bytes else "records",
+            "queue_depth": inbox.held if inbox else 0,
+            "peak_queue_depth": inbox.peak if inbox else 0,
+        }
+
+    def critical_path(self) -> List[int]:
+        """The chain of tasks with the most time spent, which bounds the run."""
+        walls = {runner.task.id: runner.stats.wall_ms for runner in self.runners}
+        longest: Dict[int, tuple] = {}
+        def path(task_id: int) -> tuple:
+            if task_id not in longest:
+                before = max((path(d) for d in self.graph.get(task_id, []) if d != PAYLOAD), default=(0.0, []))
+                longest[task_id] = (before[0] + walls[task_id], before[1] + [task_id])
+            return longest[task_id]
+        return max((path(task_id) for task_id in walls), default=(0.0, []))[1]
+
+    async def execute(self):
+        if self.profile_memory:
+            memory_tracing.acquire()
+        workers = []
+        try:
+            for runner in self.runners:
+                runner.open()
+            self._plan()
+            workers = [asyncio.create_task(self._work(runner)) for runner in self.runners]
+            if PAYLOAD in self.graph:
+                workers.append(asyncio.create_task(self._feed_payload()))
+            await asyncio.gather(*workers)
+            self.status = ProcessStatus.Stopped
+        except (EngineError, ConnectorError) as error:
+            self.status, self.error = ProcessStatus.Error, str(error)
+        except Exception as error:
+            logger.exception("Run %s of process %s failed", self.run_id, self.process.id)
+            self.status, self.error = ProcessStatus.Error, f"{type(error).__name__}: {error}"
+        finally:
+            # One failed branch ends the run, and the others with it
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if self.profile_memory:
+                memory_tracing.release()
+            for runner in self.runners:
+                await runner.close()
+            self.finished_at = time.time()
+
+    def result(self) -> dict:
+        walls = {runner.task.id: runner.stats.wall_ms for runner in self.runners}
+        critical_path = self.critical_path() if self.graph else []
+        return {
+            "run_id": self.run_id,
+            "process_id": self.process.id,
+            "dry_run": self.dry_run,
+            "status": self.status.value,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration_ms": round(((self.finished_at or time.time()) - self.started_at) * 1000, 3),
+            "records": self.records,
+            "resumed_from": self.resumed_from,
+            "critical_path": critical_path,
+            "critical_path_ms": round(sum(walls[task_id] for task_id in critical_path), 3),
+            "tasks": [
+                {
+                    **runner.stats.as_dict(),
+                    "depends_on": [d for d in self.graph.get(runner.task.id, []) if d != PAYLOAD],
+                    "throttled_ms": round(sum(client.throttled_ms for client in runner.clients), 3),
+                    "retries": sum(client.retries for client in runner.clients),
+                    **self.queue_stats(runner.task.id),
+                }
+                for runner in self.runners
+            ],
+        }
+
+async def _set_status(db: AsyncSession, process_id: int, status: ProcessStatus):
+    async def apply(session: AsyncSession):
+        process = await session.get(IntegrationProcess, process_id)
+        if process is not None:
+            process.status = status
+    await commit_write(db, apply)
+
+class ProcessEngine:
+    """Runs processes in the background, one run per process at a time."""
+
+    def __init__(self):
+        self.active: Dict[int, Run] = {}
+        # Processes whose start is still loading them, so a second start
+        # arriving in the meantime is turned away too
+        self._starting: Set[int] = set()
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self.runs = 0
+        self.failed = 0
+
+    async def dry_run(
+        self, db: AsyncSession, process_id: int, payload=None, sample_size: int = 10, profile_memory: bool = False,
+    ) -> Optional[dict]:
+        """Run a process with Output connectors stubbed and report per task.
+
+        profile_memory traces allocations for the peak memory figures, which
+        slows the whole worker while the run lasts.
+        """
+        process = await load_process(db, process_id)
+        if process is None:
+            return None
+        run = Run(process, dry_run=True, payload=payload, sample_size=sample_size, profile_memory=profile_memory)
+        await run.execute()
+        return run.result()
+
+    async def start(self, db: AsyncSession, process_id: int, payload=None, resume: bool = False) -> Optional[Run]:
+        """Start a run in the background, from the process's checkpoint if
+        resume is set and it has one."""
+        if process_id in self.active or process_id in self._starting:
+            raise EngineError(f"Process {process_id} is already running")
+        self._starting.add(process_id)
+        try:
+            process = await load_process(db, process_id)
+            if process is None:
+                return None
+            checkpoint = await run_in_threadpool(checkpoint_store.load, process_id) if resume else None
+            run = Run(process, payload=payload, checkpoint=checkpoint)
+            self.active[process_id] = run
+            # The request's session is gone by the time the run ends, so the
+            # run opens its own on the same engine
+            sessions = async_sessionmaker(bind=db.bind, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+            self._tasks[process_id] = asyncio.create_task(self._run(sessions, run))
+            return run
+        finally:
+            self._starting.discard(process_id)
+
+    async def _run(self, sessions: async_sessionmaker, run: Run):
+        process_id = run.process.id
+        try:
+            async with sessions() as db:
+                await _set_status(db, process_id, ProcessStatus.Running)
+            await run_in_threadpool(run_log_store.append, process_id, [{"level": "INFO", "message": "Run started", "run_id": run.run_id}])
+            try:
+                await run.execute()
+            except asyncio.CancelledError:
+                # Shut down part way, the next start carries on from here
+                if run.checkpointing:
+                    checkpoint_store.save(process_id, run.checkpoint())
+                raise
+            if run.checkpointing:
+                if run.status == ProcessStatus.Error:
+                    await run_in_threadpool(checkpoint_store.save, process_id, run.checkpoint())
+                else:
+                    await run_in_threadpool(checkpoint_store.clear, process_id)
+            await self._record(run)
+            async with sessions() as db:
+                await _set_status(db, process_id, run.status)
+        except Exception:
+            logger.exception("Recording run %s of process %s failed", run.run_id, process_id)
+        finally:
+            self.runs += 1
+            self.failed += run.status == ProcessStatus.Error
+            self.active.pop(process_id, None)
+            self._tasks.pop(process_id, None)
+
+    async def _record(self, run: Run):
+        result = run.result()
+        records = [
+            {"level": "ERROR", "message": stats["error"], "run_id": run.run_id, "task_id": stats["task_id"]}
+            for stats in result["tasks"] if stats["error"]
+        ]
+        if run.resumed_from:
+            records.insert(0, {"level": "INFO", "message": f"Resumed run {run.resumed_from} from its checkpoint", "run_id": run.run_id})
+        records.append({
+            "level": "ERROR" if run.error else "INFO",
+            "message": f"Run failed: {run.error}" if run.error else f"Run finished, {result['records']} records",
+            "run_id": run.run_id,
+        })
+        await run_in_threadpool(run_log_store.append, run.process.id, records)
+        await run_in_threadpool(
+            run_history.record_run,
+            {
+                "run_id": run.run_id, "process_id": run.process.id, "started_at": run.started_at,
+                "finished_at": run.finished_at, "status": run.status.value,
+                "duration_ms": result["duration_ms"], "records": result["records"],
+            },
+            [
+                {"task_id": stats["task_id"], "duration_ms": stats["wall_ms"], "records_in": stats["records_in"],
+                 "records_out": stats["records_out"], "errors": int(stats["error"] is not None)}
+                for stats in result["tasks"]
+            ],
+        )
+
+    async def resume_interrupted(self, bind) -> List[int]:
+        """Start again, from their checkpoints, the runs a shutdown or crash
+        cut off, which left their processes Running."""
+        process_ids = await run_in_threadpool(checkpoint_store.process_ids)
+        if not process_ids:
+            return []
+        sessions = async_sessionmaker(bind=bind, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+        async with sessions() as db:
+            interrupted = (await db.scalars(
+                select(IntegrationProcess.id)
+                .where(IntegrationProcess.id.in_(process_ids), IntegrationProcess.status == ProcessStatus.Running)
+            )).all()
+            for process_id in interrupted:
+                if process_id not in self.active:
+                    await self.start(db, process_id, resume=True)
+        return list(interrupted)
+
+    async def wait(self, process_id: int):
+        task = self._tasks.get(process_id)
+        if task is not None:
+            await asyncio.shield(task)
+
+    async def shutdown(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"active": len(self.active), "runs": self.runs, "failed": self.failed}
+
+process_engine = ProcessEngine()
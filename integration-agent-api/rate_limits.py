@@ -0,0 +1,111 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import _set_wal_pragmas
+
+# "worker" shares each target's limit between the runs of this worker,
+# "database" also with the other workers on the same machine
+RATE_LIMIT_SHARING = os.getenv("INTEGRATION_AGENT_RATE_LIMIT_SHARING", "worker")
+# Shared limits live in a SQLite file of their own, so throttled calls never
+# queue for the write lock of the configuration database
+RATE_LIMIT_DATABASE = os.getenv("INTEGRATION_AGENT_RATE_LIMIT_DATABASE", "rate_limits.db")
+
+CREATE = "CREATE TABLE IF NOT EXISTS rate_limit_state (key VARCHAR NOT NULL PRIMARY KEY, due_at FLOAT NOT NULL)"
+RESERVE = text(
+    "INSERT INTO rate_limit_state (key, due_at) VALUES (:key, :now + :interval) "
+    "ON CONFLICT (key) DO UPDATE SET due_at = max(due_at, :now) + :interval "
+    "RETURNING due_at"
+)
+HOLD = text(
+    "INSERT INTO rate_limit_state (key, due_at) VALUES (:key, :until) "
+    "ON CONFLICT (key) DO UPDATE SET due_at = max(due_at, :until)"
+)
+
+def _prepare_state(dbapi_connection, connection_record):
+    _set_wal_pragmas(dbapi_connection, connection_record)
+    cursor = dbapi_connection.cursor()
+    cursor.execute(CREATE)
+    cursor.close()
+
+class RateLimiter:
+    """Token buckets keyed by connector target.
+
+    Each bucket is kept as the single time its next call is due (GCRA): a
+    call reserves a slot by moving that time on by 1 / rate and waits, with
+    asyncio.sleep, only for as long as it is more than burst calls ahead.
+    Callers queue in the order they asked and nothing is polled, so a run
+    held back by a limit costs a sleeping task rather than failed calls.
+    Shared through the database the reservation is one upsert in the
+    rate_limit_state table of the file at path, which SQLite serialises
+    across workers.
+    """
+
+    def __init__(self, sharing: str = RATE_LIMIT_SHARING, path: str = RATE_LIMIT_DATABASE):
+        self.sharing = sharing
+        self.path = path
+        self.bind = None
+        self._due: Dict[str, float] = {}
+        self.targets: Dict[str, dict] = {}
+
+    def _shared(self, rate: Optional[float]) -> bool:
+        return self.sharing == "database" and bool(rate)
+
+    def _engine(self):
+        if self.bind is None:
+            self.bind = create_async_engine(f"sqlite+aiosqlite:///{self.path}")
+            event.listen(self.bind.sync_engine, "connect", _prepare_state)
+        return self.bind
+
+    async def close(self):
+        if self.bind is not None:
+            await self.bind.dispose()
+            self.bind = None
+
+    async def acquire(self, key: str, rate: Optional[float] = None, burst: int = 1) -> float:
+        """Wait for the next call to key and return the seconds waited.
+
+        Without a rate only a hold (see hold) is waited for.
+        """
+        now = time.time()
+        interval = 1 / rate if rate else 0.0
+        if self._shared(rate):
+            async with self._engine().begin() as connection:
+                due = (await connection.execute(RESERVE, {"key": key, "now": now, "interval": interval})).scalar()
+        else:
+            due = max(self._due.get(key, 0.0), now) + interval
+            self._due[key] = due
+        wait = max(0.0, due - max(burst, 1) * interval - now)
+
+        target = self.targets.setdefault(key, {"calls": 0, "throttled": 0, "waited_ms": 0.0, "holds": 0})
+        target["calls"] += 1
+        if wait > 0:
+            target["throttled"] += 1
+            target["waited_ms"] += wait * 1000
+            await asyncio.sleep(wait)
+        return wait
+
+    async def hold(self, key: str, seconds: float, rate: Optional[float] = None, burst: int = 1):
+        """Stop calls to key for seconds, as when the target answers 429."""
+        interval = 1 / rate if rate else 0.0
+        # Pushed on by the burst as well, so the first call after the hold
+        # waits for all of it
+        until = time.time() + seconds + (max(burst, 1) - 1) * interval
+        if self._shared(rate):
+            async with self._engine().begin() as connection:
+                await connection.execute(HOLD, {"key": key, "until": until})
+        else:
+            self._due[key] = max(self._due.get(key, 0.0), until)
+        self.targets.setdefault(key, {"calls": 0, "throttled": 0, "waited_ms": 0.0, "holds": 0})["holds"] += 1
+
+    def stats(self) -> dict:
+        return {
+            "sharing": self.sharing,
+            "targets": {key: {**target, "waited_ms": round(target["waited_ms"], 3)} for key, target in self.targets.items()},
+        }
+
+rate_limiter = RateLimiter()
@@ -1,14 +1,18 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from sqlalchemy import String, cast, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from passlib.context import CryptContext
-from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
 from models.models import User  # Assuming a User model is defined in models
-from database import SessionLocal
+from database import get_db, commit_write
+from cache import LRUCache
+from versions import bump_versions, current_version, with_version
 from fastapi.security import OAuth2PasswordBearer
+from password_pool import password_pool
+from functools import lru_cache
 import logging
+import time
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/user/login")
 
@@ -17,8 +21,20 @@ SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Verified principals by token, so repeated calls skip the JWT parse and the
+# User query. Entries expire with the token, and after at most
+# PRINCIPAL_CACHE_TTL seconds so that revocations made by another worker
+# are picked up.
+PRINCIPAL_CACHE_SIZE = 10000
+PRINCIPAL_CACHE_TTL = 60
+principal_cache = LRUCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+# Password hashing context. passlib and jose are imported on first use,
+# which keeps them out of worker startup.
+@lru_cache(maxsize=None)
+def pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -26,14 +42,6 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Dependency to get the database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # Pydantic models
 class UserBase(BaseModel):
     username: str
@@ -56,12 +64,13 @@ class TokenData(BaseModel):
 
 # Utility functions
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -73,28 +82,28 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 # Register a new user
 @router.post("/user/register", response_model=UserResponse)
-async def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     try:
         logger.info(f"Attempting to register user: {user.username}")
         
         # Check if user exists
-        db_user = db.query(User).filter(User.username == user.username).first()
+        db_user = await db.scalar(select(User).filter(User.username == user.username))
         if db_user:
             logger.warning(f"Username already exists: {user.username}")
             raise HTTPException(status_code=400, detail="Username already registered")
         
         # Create new user
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await password_pool.run(get_password_hash, user.password)
         new_user = User(username=user.username, password=hashed_password)
         
         try:
             db.add(new_user)
-            db.commit()
-            db.refresh(new_user)
+            await db.commit()
+            await db.refresh(new_user)
             logger.info(f"Successfully registered user: {user.username}")
             return new_user
         except Exception as db_error:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Database error: {str(db_error)}")
             raise HTTPException(status_code=500, detail="Database error occurred")
             
@@ -106,18 +115,26 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
 
 # Login user
 @router.post("/user/login", response_model=Token)
-def login_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if not db_user or not verify_password(user.password, db_user.password):
+async def login_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(User).filter(User.username == user.username))
+    if not db_user or not await password_pool.run(verify_password, user.password, db_user.password):
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # ver is checked against the user's version stamp to support revocation
     access_token = create_access_token(
-        data={"sub": db_user.username}, expires_delta=access_token_expires
+        data={"sub": db_user.username, "ver": await current_version(db, f"user:{db_user.id}")},
+        expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 # Dependency to get the current user
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)):
+    principal = principal_cache.get(("tokens", token))
+    if principal is not None:
+        return User(**principal)
+    from jose import JWTError, jwt
+    generation = principal_cache.generation("tokens")
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -131,12 +148,33 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
+    # The user and its token version in one query
+    row = (await db.execute(
+        with_version(select(User), literal("user:") + cast(User.id, String)).filter(User.username == token_data.username)
+    )).first()
+    if row is None:
+        raise credentials_exception
+    user, version = row
+    if payload.get("ver", 0) != version:
         raise credentials_exception
+
+    principal_cache.put(
+        ("tokens", token), {"id": user.id, "username": user.username}, generation, ttl=payload["exp"] - time.time()
+    )
     return user
 
+# Revoke every token issued to the current user so far
+@router.post("/user/revoke-tokens")
+async def revoke_tokens(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    async def apply(session: AsyncSession):
+        await bump_versions(session, f"user:{current_user.id}")
+
+    await commit_write(db, apply)
+    # Drop every cached principal; the others are verified again once
+    principal_cache.invalidate("tokens")
+    return {"message": "Tokens revoked"}
+
 # Protect an endpoint
 @router.get("/user/protected-route")
-def protected_route(current_user: User = Depends(get_current_user)):
+async def protected_route(current_user: User = Depends(get_current_user)):
     return {"message": "This is a protected route", "user": current_user.username} 
\ No newline at end of file
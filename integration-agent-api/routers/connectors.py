@@ -1,20 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from models.models import Connector, ConnectorType, DataType, ServiceType, DatabaseType, QueryType, ProcessTask
-from database import SessionLocal, get_db
+from database import get_db, commit_write
+from serialization import RowSerializer, list_response
+from cache import exists
+from versions import conditional_get
+from bulk import check_batch_ids, ensure_exist, bulk_write, load_by_ids
 
 router = APIRouter()
 
-# Dependency to get the database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # Pydantic models
 class ConnectorBase(BaseModel):
     process_task_id: int
@@ -40,6 +37,11 @@ class ConnectorBase(BaseModel):
     query_type: Optional[QueryType] = None
     query: Optional[str] = None
 
+    # Calls per second to the connector's target, shared by every connector
+    # with the same target
+    rate_limit: Optional[float] = Field(None, gt=0)
+    rate_burst: Optional[int] = Field(None, ge=1)
+
     class Config:
         use_enum_values = True
         # Add these if using Pydantic v2 style
@@ -59,15 +61,23 @@ class ConnectorResponse(ConnectorBase):
         populate_by_name = True
         orm_mode = True # Keep orm_mode for compatibility if needed, but from_attributes is preferred
 
-# Create a Connector
-@router.post("/connectors/", response_model=ConnectorResponse)
-def create_connector(connector: ConnectorCreate, db: Session = Depends(get_db)):
-    # Verify that process task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == connector.process_task_id).first()
-    if not task:
-        raise HTTPException(status_code=404, detail="Process task not found")
+connectors_serializer = RowSerializer(ConnectorResponse, Connector)
 
-    # --- Add Validation based on connector_type ---
+class ConnectorUpdate(ConnectorCreate):
+    id: int
+
+class ConnectorBatch(BaseModel):
+    create: List[ConnectorCreate] = []
+    update: List[ConnectorUpdate] = []
+    delete: List[int] = []
+
+class ConnectorBatchResponse(BaseModel):
+    created: List[ConnectorResponse] = []
+    updated: List[ConnectorResponse] = []
+    deleted: List[int] = []
+
+# Validation based on connector_type
+def validate_connector(connector: ConnectorCreate):
     # Example: If connector_type is Email, ensure email fields are provided
     if connector.connector_type == ConnectorType.Email:
         if not connector.from_email or not connector.email or not connector.subject:
@@ -76,88 +86,139 @@ def create_connector(connector: ConnectorCreate, db: Session = Depends(get_db)):
         if not connector.service_type or not connector.end_point:
              raise HTTPException(status_code=400, detail="WebService connector requires service_type and end_point.")
     # Add similar validation for other connector types...
-    # --- End Validation ---
 
-    db_connector = Connector(**connector.dict())
-    db.add(db_connector)
-    db.commit()
-    db.refresh(db_connector)
-    return db_connector
+# Create a Connector
+@router.post("/connectors/", response_model=ConnectorResponse)
+async def create_connector(connector: ConnectorCreate, db: AsyncSession = Depends(get_db)):
+    # Verify that process task exists
+    if not await exists(db, ProcessTask, connector.process_task_id):
+        raise HTTPException(status_code=404, detail="Process task not found")
+
+    validate_connector(connector)
+
+    async def apply(session: AsyncSession):
+        db_connector = Connector(**connector.dict())
+        session.add(db_connector)
+        await session.flush()
+        return db_connector
+
+    return await commit_write(db, apply)
 
 # Read all Connectors
 @router.get("/connectors/", response_model=List[ConnectorResponse])
-def read_connectors(
+async def read_connectors(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     process_task_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    query = db.query(Connector)
+    await conditional_get(request, response, db, "connectors")
+    query = select(Connector)
     if process_task_id:
         query = query.filter(Connector.process_task_id == process_task_id)
-    connectors = query.offset(skip).limit(limit).all()
-    return connectors
+    return await list_response(
+        request, response, db, query, connectors_serializer, Connector.id, limit=limit, after=after, skip=skip
+    )
 
 # Read a single Connector by ID
 @router.get("/connectors/{connector_id}", response_model=ConnectorResponse)
-def read_connector(connector_id: int, db: Session = Depends(get_db)):
-    connector = db.query(Connector).filter(Connector.id == connector_id).first()
+async def read_connector(connector_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, "connectors")
+    connector = await db.scalar(select(Connector).filter(Connector.id == connector_id))
     if connector is None:
         raise HTTPException(status_code=404, detail="Connector not found")
     return connector
 
 # Update a Connector
 @router.put("/connectors/{connector_id}", response_model=ConnectorResponse)
-def update_connector(connector_id: int, updated_connector: ConnectorCreate, db: Session = Depends(get_db)):
-    connector = db.query(Connector).filter(Connector.id == connector_id).first()
-    if connector is None:
+async def update_connector(connector_id: int, updated_connector: ConnectorCreate, db: AsyncSession = Depends(get_db)):
+    if not await exists(db, Connector, connector_id):
         raise HTTPException(status_code=404, detail="Connector not found")
 
     # Verify that process task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == updated_connector.process_task_id).first()
-    if not task:
+    if not await exists(db, ProcessTask, updated_connector.process_task_id):
         raise HTTPException(status_code=404, detail="Process task not found")
 
     # Add validation similar to create_connector here...
 
-    # Update attributes
-    for key, value in updated_connector.dict().items():
-         # Only update if the value is provided in the request
-         if value is not None:
-            setattr(connector, key, value)
+    async def apply(session: AsyncSession):
+        connector = await session.get(Connector, connector_id)
+        if connector is None:
+            raise HTTPException(status_code=404, detail="Connector not found")
 
-    db.commit()
-    db.refresh(connector)
-    return connector
+        # Update attributes
+        for key, value in updated_connector.dict().items():
+             # Only update if the value is provided in the request
+             if value is not None:
+                setattr(connector, key, value)
+        return connector
+
+    return await commit_write(db, apply)
 
 # Delete a Connector
 @router.delete("/connectors/{connector_id}", response_model=ConnectorResponse)
-def delete_connector(connector_id: int, db: Session = Depends(get_db)):
-    connector = db.query(Connector).filter(Connector.id == connector_id).first()
-    if connector is None:
-        raise HTTPException(status_code=404, detail="Connector not found")
-
-    db.delete(connector)
-    db.commit()
-    return connector
+async def delete_connector(connector_id: int, db: AsyncSession = Depends(get_db)):
+    async def apply(session: AsyncSession):
+        connector = await session.get(Connector, connector_id)
+        if connector is None:
+            raise HTTPException(status_code=404, detail="Connector not found")
+
+        await session.delete(connector)
+        return connector
+
+    return await commit_write(db, apply)
+
+# Create, update and delete Connectors in one transaction
+@router.post("/connectors/batch", response_model=ConnectorBatchResponse)
+async def batch_connectors(batch: ConnectorBatch, db: AsyncSession = Depends(get_db)):
+    check_batch_ids([connector.id for connector in batch.update], batch.delete)
+    for connector in batch.create + batch.update:
+        validate_connector(connector)
+
+    async def apply(session: AsyncSession):
+        # Set-based existence checks: one IN query per referenced table
+        await ensure_exist(
+            session, ProcessTask.id,
+            [connector.process_task_id for connector in batch.create + batch.update],
+            "Process task not found"
+        )
+        await ensure_exist(
+            session, Connector.id,
+            [connector.id for connector in batch.update] + batch.delete,
+            "Connector not found"
+        )
+
+        # Updates leave columns given as None alone, as PUT does
+        created = await bulk_write(
+            session, Connector,
+            [connector.dict() for connector in batch.create],
+            [connector.dict(exclude_none=True) for connector in batch.update],
+            batch.delete
+        )
+        updated = await load_by_ids(session, Connector, [connector.id for connector in batch.update])
+        return {"created": created, "updated": updated, "deleted": batch.delete}
+
+    return await commit_write(db, apply)
 
 # Get connectors for a specific task
 @router.get("/process-tasks/{task_id}/connectors", response_model=List[ConnectorResponse])
-def get_connectors_for_task(task_id: int, db: Session = Depends(get_db)):
+async def get_connectors_for_task(task_id: int, db: AsyncSession = Depends(get_db)):
     # Verify task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
-    if task is None:
+    if not await exists(db, ProcessTask, task_id):
         raise HTTPException(status_code=404, detail="Process task not found")
 
-    connectors = db.query(Connector).filter(Connector.process_task_id == task_id).all()
+    connectors = (await db.scalars(select(Connector).filter(Connector.process_task_id == task_id))).all()
     return connectors
 
 @router.put("/connectors/{connector_id}")
-async def update_connector(connector_id: int, connector_data: dict, db: Session = Depends(get_db)):
+async def update_connector(connector_id: int, connector_data: dict, db: AsyncSession = Depends(get_db)):
     # Implementation here
     pass
 
 @router.delete("/connectors/{connector_id}")
-async def delete_connector(connector_id: int, db: Session = Depends(get_db)):
+async def delete_connector(connector_id: int, db: AsyncSession = Depends(get_db)):
     # Implementation here
     pass 
\ No newline at end of file
@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from pydantic import BaseModel, Field as PydanticField
 from models.models import Field, DataType, ProcessTask
-from database import get_db
+from database import get_db, commit_write
+from serialization import RowSerializer, list_response
+from cache import exists
+from versions import conditional_get
+from bulk import check_batch_ids, ensure_exist, bulk_write, load_by_ids
 
 router = APIRouter()
 
@@ -35,126 +40,178 @@ class FieldResponse(BaseModel):
         populate_by_name = True
         allow_population_by_field_name = True
 
+fields_serializer = RowSerializer(FieldResponse, Field)
+
+class FieldUpdate(FieldCreate):
+    id: int
+
+class FieldBatch(BaseModel):
+    create: List[FieldCreate] = []
+    update: List[FieldUpdate] = []
+    delete: List[int] = []
+
+class FieldBatchResponse(BaseModel):
+    created: List[FieldResponse] = []
+    updated: List[FieldResponse] = []
+    deleted: List[int] = []
+
 # Create a Field
 @router.post("/fields/", response_model=FieldResponse)
-def create_field(field: FieldCreate, db: Session = Depends(get_db)):
+async def create_field(field: FieldCreate, db: AsyncSession = Depends(get_db)):
     # Verify that process task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == field.process_task_id).first()
-    if not task:
+    if not await exists(db, ProcessTask, field.process_task_id):
         raise HTTPException(status_code=404, detail="Process task not found")
     
-    # Map from client model to database model
-    db_field = Field(
-        process_task_id=field.process_task_id,
-        field_name=field.key,
-        data_type=field.data_type,
-        value=field.value
-    )
+    async def apply(session: AsyncSession):
+        # Map from client model to database model
+        db_field = Field(
+            process_task_id=field.process_task_id,
+            field_name=field.key,
+            data_type=field.data_type,
+            value=field.value
+        )
+        
+        session.add(db_field)
+        await session.flush()
+        return db_field
     
-    db.add(db_field)
-    db.commit()
-    db.refresh(db_field)
-    return db_field
+    return await commit_write(db, apply)
 
 # Read all Fields
 @router.get("/fields/", response_model=List[FieldResponse])
-def read_fields(
+async def read_fields(
+    request: Request,
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
     process_task_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    query = db.query(Field)
+    await conditional_get(request, response, db, "fields")
+    query = select(Field)
     
     # Filter by process task if specified
     if process_task_id:
         query = query.filter(Field.process_task_id == process_task_id)
         
-    fields = query.offset(skip).limit(limit).all()
-    return fields
+    return await list_response(
+        request, response, db, query, fields_serializer, Field.id, limit=limit, after=after, skip=skip
+    )
 
 # Read a single Field by ID
 @router.get("/fields/{field_id}", response_model=FieldResponse)
-def read_field(field_id: int, db: Session = Depends(get_db)):
-    field = db.query(Field).filter(Field.id == field_id).first()
+async def read_field(field_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, "fields")
+    field = await db.scalar(select(Field).filter(Field.id == field_id))
     if field is None:
         raise HTTPException(status_code=404, detail="Field not found")
     return field
 
 # Update a Field
 @router.put("/fields/{field_id}", response_model=FieldResponse)
-def update_field(field_id: int, updated_field: FieldCreate, db: Session = Depends(get_db)):
+async def update_field(field_id: int, updated_field: FieldCreate, db: AsyncSession = Depends(get_db)):
     # Verify field exists
-    field = db.query(Field).filter(Field.id == field_id).first()
-    if field is None:
+    if not await exists(db, Field, field_id):
         raise HTTPException(status_code=404, detail="Field not found")
     
     # Verify that process task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == updated_field.process_task_id).first()
-    if not task:
+    if not await exists(db, ProcessTask, updated_field.process_task_id):
         raise HTTPException(status_code=404, detail="Process task not found")
     
-    # Update field attributes
-    field.process_task_id = updated_field.process_task_id
-    field.field_name = updated_field.key
-    field.data_type = updated_field.data_type
-    field.value = updated_field.value
+    async def apply(session: AsyncSession):
+        field = await session.get(Field, field_id)
+        if field is None:
+            raise HTTPException(status_code=404, detail="Field not found")
+        
+        # Update field attributes
+        field.process_task_id = updated_field.process_task_id
+        field.field_name = updated_field.key
+        field.data_type = updated_field.data_type
+        field.value = updated_field.value
+        return field
     
-    db.commit()
-    db.refresh(field)
-    return field
+    return await commit_write(db, apply)
 
 # Delete a Field
 @router.delete("/fields/{field_id}", response_model=FieldResponse)
-def delete_field(field_id: int, db: Session = Depends(get_db)):
-    field = db.query(Field).filter(Field.id == field_id).first()
-    if field is None:
-        raise HTTPException(status_code=404, detail="Field not found")
+async def delete_field(field_id: int, db: AsyncSession = Depends(get_db)):
+    async def apply(session: AsyncSession):
+        field = await session.get(Field, field_id)
+        if field is None:
+            raise HTTPException(status_code=404, detail="Field not found")
+        
+        await session.delete(field)
+        return field
     
-    db.delete(field)
-    db.commit()
-    return field
+    return await commit_write(db, apply)
+
+# Create, update and delete Fields in one transaction
+@router.post("/fields/batch", response_model=FieldBatchResponse)
+async def batch_fields(batch: FieldBatch, db: AsyncSession = Depends(get_db)):
+    check_batch_ids([field.id for field in batch.update], batch.delete)
+    
+    async def apply(session: AsyncSession):
+        # Set-based existence checks: one IN query per referenced table
+        await ensure_exist(
+            session, ProcessTask.id,
+            [field.process_task_id for field in batch.create + batch.update],
+            "Process task not found"
+        )
+        await ensure_exist(
+            session, Field.id,
+            [field.id for field in batch.update] + batch.delete,
+            "Field not found"
+        )
+        
+        # by_alias maps the client's key onto the field_name column
+        created = await bulk_write(
+            session, Field,
+            [field.dict(by_alias=True) for field in batch.create],
+            [field.dict(by_alias=True) for field in batch.update],
+            batch.delete
+        )
+        updated = await load_by_ids(session, Field, [field.id for field in batch.update])
+        return {"created": created, "updated": updated, "deleted": batch.delete}
+    
+    return await commit_write(db, apply)
 
 # Get fields for a specific task
 @router.get("/process-tasks/{task_id}/fields", response_model=List[FieldResponse])
-def get_fields_for_task(task_id: int, db: Session = Depends(get_db)):
+async def get_fields_for_task(task_id: int, db: AsyncSession = Depends(get_db)):
     # Verify task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
+    task = await db.scalar(select(ProcessTask).filter(ProcessTask.id == task_id))
     if task is None:
         raise HTTPException(status_code=404, detail="Process task not found")
     
-    fields = db.query(Field).filter(Field.process_task_id == task_id).all()
+    fields = (await db.scalars(select(Field).filter(Field.process_task_id == task_id))).all()
     return fields
 
 # Bulk create fields for a task
 @router.post("/process-tasks/{task_id}/fields", response_model=List[FieldResponse])
-def create_fields_for_task(task_id: int, fields: List[FieldCreate], db: Session = Depends(get_db)):
+async def create_fields_for_task(task_id: int, fields: List[FieldCreate], db: AsyncSession = Depends(get_db)):
     # Verify task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
+    task = await db.scalar(select(ProcessTask).filter(ProcessTask.id == task_id))
     if task is None:
         raise HTTPException(status_code=404, detail="Process task not found")
     
-    db_fields = []
-    for field_data in fields:
-        # Ensure task_id in request matches URL parameter
-        if field_data.process_task_id != task_id:
-            raise HTTPException(status_code=400, detail="Field task ID must match the task ID in the URL")
-        
-        # Map from client model to database model
-        db_field = Field(
-            process_task_id=field_data.process_task_id,
-            field_name=field_data.key,
-            data_type=field_data.data_type,
-            value=field_data.value
-        )
-        
-        db.add(db_field)
-        db_fields.append(db_field)
-    
-    db.commit()
+    # Ensure task_id in request matches URL parameter
+    if any(field_data.process_task_id != task_id for field_data in fields):
+        raise HTTPException(status_code=400, detail="Field task ID must match the task ID in the URL")
     
-    # Refresh all fields
-    for field in db_fields:
-        db.refresh(field)
+    async def apply(session: AsyncSession):
+        # Map from client model to database model
+        db_fields = [
+            Field(
+                process_task_id=field_data.process_task_id,
+                field_name=field_data.key,
+                data_type=field_data.data_type,
+                value=field_data.value
+            )
+            for field_data in fields
+        ]
+        session.add_all(db_fields)
+        await session.flush()
+        return db_fields
     
-    return db_fields 
\ No newline at end of file
+    return await commit_write(db, apply) 
\ No newline at end of file
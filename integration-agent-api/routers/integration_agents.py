@@ -1,9 +1,18 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import Dict, List, Optional
 from pydantic import BaseModel
-from models.models import IntegrationAgent, IntegrationType
-from database import get_db
+from models.models import IntegrationAgent, IntegrationType, IntegrationProcess, ProcessTask
+from database import get_db, commit_write
+from serialization import RowSerializer, list_response
+from versions import conditional_get
+from routers.integration_processes import IntegrationProcessResponse
+from routers.process_schedules import ProcessScheduleResponse
+from routers.process_tasks import ProcessTaskResponse
+from routers.connectors import ConnectorResponse
+from routers.transformations import TransformationResponse
 
 router = APIRouter()
 
@@ -27,47 +36,149 @@ class IntegrationAgentResponse(IntegrationAgentBase):
     class Config:
         orm_mode = True
 
+agents_serializer = RowSerializer(IntegrationAgentResponse, IntegrationAgent)
+
+# Pydantic models for the agent graph
+class ProcessTaskGraphResponse(ProcessTaskResponse):
+    connectors: List[ConnectorResponse] = []
+    transformations: List[TransformationResponse] = []
+
+class IntegrationProcessGraphResponse(IntegrationProcessResponse):
+    scheduler: Optional[ProcessScheduleResponse] = None
+    tasks: List[ProcessTaskGraphResponse] = []
+
+class IntegrationAgentGraphResponse(IntegrationAgentResponse):
+    processes: List[IntegrationProcessGraphResponse] = []
+
+class IntegrationAgentImportResponse(BaseModel):
+    agent: IntegrationAgentResponse
+    counts: Dict[str, int]
+
 # Create an IntegrationAgent
 @router.post("/integration-agents/", response_model=IntegrationAgentResponse)
-def create_integration_agent(agent: IntegrationAgentCreate, db: Session = Depends(get_db)):
-    db_agent = IntegrationAgent(**agent.dict())
-    db.add(db_agent)
-    db.commit()
-    db.refresh(db_agent)
-    return db_agent
+async def create_integration_agent(agent: IntegrationAgentCreate, db: AsyncSession = Depends(get_db)):
+    async def apply(session: AsyncSession):
+        db_agent = IntegrationAgent(**agent.dict())
+        session.add(db_agent)
+        await session.flush()
+        return db_agent
+
+    return await commit_write(db, apply)
 
 # Read all IntegrationAgents
 @router.get("/integration-agents/", response_model=List[IntegrationAgentResponse])
-def read_integration_agents(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    agents = db.query(IntegrationAgent).offset(skip).limit(limit).all()
-    return agents
+async def read_integration_agents(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 10,
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    await conditional_get(request, response, db, "integration_agents")
+    return await list_response(
+        request, response, db, select(IntegrationAgent), agents_serializer, IntegrationAgent.id, limit=limit, after=after, skip=skip
+    )
 
 # Read a single IntegrationAgent by ID
 @router.get("/integration-agents/{agent_id}", response_model=IntegrationAgentResponse)
-def read_integration_agent(agent_id: int, db: Session = Depends(get_db)):
-    agent = db.query(IntegrationAgent).filter(IntegrationAgent.id == agent_id).first()
+async def read_integration_agent(agent_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, f"agent:{agent_id}")
+    agent = await db.scalar(select(IntegrationAgent).filter(IntegrationAgent.id == agent_id))
     if agent is None:
         raise HTTPException(status_code=404, detail="IntegrationAgent not found")
     return agent
 
 # Update an IntegrationAgent
 @router.put("/integration-agents/{agent_id}", response_model=IntegrationAgentResponse)
-def update_integration_agent(agent_id: int, updated_agent: IntegrationAgentCreate, db: Session = Depends(get_db)):
-    agent = db.query(IntegrationAgent).filter(IntegrationAgent.id == agent_id).first()
-    if agent is None:
-        raise HTTPException(status_code=404, detail="IntegrationAgent not found")
-    for key, value in updated_agent.dict().items():
-        setattr(agent, key, value)
-    db.commit()
-    db.refresh(agent)
-    return agent
+async def update_integration_agent(agent_id: int, updated_agent: IntegrationAgentCreate, db: AsyncSession = Depends(get_db)):
+    async def apply(session: AsyncSession):
+        agent = await session.get(IntegrationAgent, agent_id)
+        if agent is None:
+            raise HTTPException(status_code=404, detail="IntegrationAgent not found")
+        for key, value in updated_agent.dict().items():
+            setattr(agent, key, value)
+        return agent
+
+    return await commit_write(db, apply)
 
 # Delete an IntegrationAgent
 @router.delete("/integration-agents/{agent_id}", response_model=IntegrationAgentResponse)
-def delete_integration_agent(agent_id: int, db: Session = Depends(get_db)):
-    agent = db.query(IntegrationAgent).filter(IntegrationAgent.id == agent_id).first()
+async def delete_integration_agent(agent_id: int, db: AsyncSession = Depends(get_db)):
+    async def apply(session: AsyncSession):
+        agent = await session.get(IntegrationAgent, agent_id)
+        if agent is None:
+            raise HTTPException(status_code=404, detail="IntegrationAgent not found")
+        await session.delete(agent)
+        return agent
+
+    return await commit_write(db, apply)
+
+# Import a bundle (JSON or msgpack, by Content-Type) as a new IntegrationAgent
+@router.post("/integration-agents/import", response_model=IntegrationAgentImportResponse)
+async def import_integration_agent(request: Request, db: AsyncSession = Depends(get_db)):
+    # Bundles, msgpack and the task graph check load with the first import
+    from bundles import BUNDLE_MEDIA_TYPES, import_agent, load_bundle, read_bundle
+    bundle = load_bundle(await request.body(), request.headers.get("content-type", BUNDLE_MEDIA_TYPES["json"]))
+    plan = read_bundle(bundle)
+
+    async def apply(session: AsyncSession):
+        return await import_agent(session, plan)
+
+    return await commit_write(db, apply)
+
+# Read an IntegrationAgent with its whole configuration tree
+@router.get("/integration-agents/{agent_id}/graph", response_model=IntegrationAgentGraphResponse)
+async def read_integration_agent_graph(agent_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, f"agent:{agent_id}")
+    agent = await db.scalar(select(IntegrationAgent).filter(IntegrationAgent.id == agent_id))
+    if agent is None:
+        raise HTTPException(status_code=404, detail="IntegrationAgent not found")
+
+    # One SELECT per level regardless of size: processes, schedules, tasks,
+    # then fields, connectors and transformations for all tasks at once
+    processes = (await db.scalars(
+        select(IntegrationProcess)
+        .filter(IntegrationProcess.integration_agent_id == agent_id)
+        .options(
+            selectinload(IntegrationProcess.scheduler),
+            selectinload(IntegrationProcess.tasks).options(
+                selectinload(ProcessTask.static_fields),
+                selectinload(ProcessTask.connectors),
+                selectinload(ProcessTask.transformations),
+            ),
+        )
+    )).all()
+
+    # IntegrationAgent has no processes relationship, so attach them here
+    graph = {column.name: getattr(agent, column.name) for column in IntegrationAgent.__table__.columns}
+    graph["processes"] = processes
+    return graph
+
+# Export an IntegrationAgent with its whole configuration as a bundle
+@router.get("/integration-agents/{agent_id}/export")
+async def export_integration_agent(
+    agent_id: int,
+    request: Request,
+    response: Response,
+    format: str = "json",
+    db: AsyncSession = Depends(get_db)
+):
+    from bundles import BUNDLE_MEDIA_TYPES, dump_bundle, export_agent
+    if format not in BUNDLE_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported bundle format: {format}")
+    etag = await conditional_get(request, response, db, f"agent:{agent_id}")
+    agent = await db.scalar(select(IntegrationAgent).filter(IntegrationAgent.id == agent_id))
     if agent is None:
         raise HTTPException(status_code=404, detail="IntegrationAgent not found")
-    db.delete(agent)
-    db.commit()
-    return agent 
\ No newline at end of file
+
+    bundle = await export_agent(db, agent)
+    return Response(
+        content=dump_bundle(bundle, format),
+        media_type=BUNDLE_MEDIA_TYPES[format],
+        headers={
+            "ETag": etag,
+            "Cache-Control": "no-cache",
+            "Content-Disposition": f'attachment; filename="{agent.code}.{format}"'
+        }
+    )
@@ -1,13 +1,27 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from pydantic import BaseModel
+from fastapi import APIRouter, Body, Header, HTTPException, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, List, Optional
+from pydantic import BaseModel, Field
 from models.models import IntegrationProcess, TriggerType, ProcessStatus
-from database import get_db
+from database import get_db, commit_write
+from serialization import RowSerializer, list_response
+from cache import exists
+from versions import conditional_get
+from run_logs import run_log_store
+from checkpoints import checkpoint_store
+from webhook_buffer import BufferFull, webhook_ingest
+# The process engine is imported by the endpoints that run processes, so a
+# worker serving only the others never loads it and its connector clients
 import enum
+import logging
+import math
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 # Define ProcessStatus locally if needed
 class ProcessStatus(str, enum.Enum):
     Running = "Running"
@@ -23,6 +37,9 @@ class IntegrationProcessBase(BaseModel):
     auto_start: bool = False
     trigger_type: TriggerType
     status: ProcessStatus = ProcessStatus.Stopped
+    parallelism: int = Field(1, ge=1, le=256)
+    max_in_flight: int = Field(100, ge=1, le=100000)
+    preserve_order: bool = True
 
     class Config:
         use_enum_values = True
@@ -37,141 +54,288 @@ class IntegrationProcessResponse(IntegrationProcessBase):
         orm_mode = True
         from_attributes = True  # Updated from orm_mode for Pydantic v2
 
+class DryRunRequest(BaseModel):
+    # Stands in for what the Input tasks would fetch; without it each Input
+    # task reads its own sample input
+    payload: Optional[Any] = None
+    sample_size: int = Field(10, ge=0, le=1000)
+    # Trace allocations for peak_memory_bytes; this slows every request of
+    # the worker while the dry run lasts
+    profile_memory: bool = False
+
+class WebhookAccepted(BaseModel):
+    # Not set for a duplicate, which was dropped
+    seq: Optional[int] = None
+    duplicate: bool = False
+
+class TaskRunReport(BaseModel):
+    task_id: int
+    task_name: str
+    type: str
+    sequence_number: Optional[int] = None
+    records_in: int
+    records_out: int
+    batches: int
+    wall_ms: float
+    cpu_ms: float
+    # Process-wide peak during the task's calls, so it includes whatever
+    # else the worker allocated meanwhile; 0 unless memory was profiled
+    peak_memory_bytes: int
+    peak_in_flight: int = 0
+    peak_reordered: int = 0
+    # Time spent waiting for room in the queues of the tasks after this one
+    stall_ms: float = 0
+    # What waits for this task, queued or at a join, in queue_unit
+    queue_unit: str = "records"
+    queue_depth: int = 0
+    peak_queue_depth: int = 0
+    # Time spent waiting for connector rate limits
+    throttled_ms: float = 0
+    # Connector calls tried again after a failure of their target
+    retries: int = 0
+    sample: List[Any]
+    error: Optional[str] = None
+    depends_on: List[int] = []
+
+class RunReport(BaseModel):
+    run_id: str
+    process_id: int
+    dry_run: bool
+    status: str
+    error: Optional[str] = None
+    started_at: float
+    finished_at: Optional[float] = None
+    duration_ms: float
+    records: int
+    # The run whose checkpoint this one carried on from
+    resumed_from: Optional[str] = None
+    # The chain of dependent tasks with the most time spent, which bounds
+    # the duration of the run
+    critical_path: List[int] = []
+    critical_path_ms: float = 0
+    tasks: List[TaskRunReport]
+
+class RunStarted(BaseModel):
+    run_id: str
+
+processes_serializer = RowSerializer(IntegrationProcessResponse, IntegrationProcess)
+
 # Create an Integration Process
 @router.post("/integration-processes/", response_model=IntegrationProcessResponse)
-async def create_integration_process(process: IntegrationProcessCreate, db: Session = Depends(get_db)):
+async def create_integration_process(process: IntegrationProcessCreate, db: AsyncSession = Depends(get_db)):
     try:
         # Verify that integration agent exists
         from models.models import IntegrationAgent
-        agent = db.query(IntegrationAgent).filter(IntegrationAgent.id == process.integration_agent_id).first()
-        if not agent:
+        if not await exists(db, IntegrationAgent, process.integration_agent_id):
             raise HTTPException(status_code=404, detail="Integration agent not found")
         
-        # Print the process data for debugging
-        print(f"Process data: {process.dict()}")
+        logger.debug("Process data: %s", process.dict())
         
-        db_process = IntegrationProcess(**process.dict())
-        db.add(db_process)
-        db.commit()
-        db.refresh(db_process)
-        return db_process
+        async def apply(session: AsyncSession):
+            db_process = IntegrationProcess(**process.dict())
+            session.add(db_process)
+            await session.flush()
+            return db_process
+
+        return await commit_write(db, apply)
     except Exception as e:
-        # Log the error
-        print(f"Error creating process: {str(e)}")
+        logger.exception("Error creating process")
         # Re-raise the exception
         raise
 
 # Read all Integration Processes
 @router.get("/integration-processes/", response_model=List[IntegrationProcessResponse])
-def read_integration_processes(
+async def read_integration_processes(
+    request: Request,
+    response: Response,
     skip: int = 0, 
     limit: int = 10, 
     agent_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    query = db.query(IntegrationProcess)
+    await conditional_get(request, response, db, "integration_processes")
+    query = select(IntegrationProcess)
     
     # Filter by agent if specified
     if agent_id:
         query = query.filter(IntegrationProcess.integration_agent_id == agent_id)
         
-    processes = query.offset(skip).limit(limit).all()
-    return processes
+    return await list_response(
+        request, response, db, query, processes_serializer, IntegrationProcess.id, limit=limit, after=after, skip=skip
+    )
 
 # Read a single Integration Process by ID
 @router.get("/integration-processes/{process_id}", response_model=IntegrationProcessResponse)
-def read_integration_process(process_id: int, db: Session = Depends(get_db)):
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == process_id).first()
+async def read_integration_process(process_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, f"process:{process_id}")
+    process = await db.scalar(select(IntegrationProcess).filter(IntegrationProcess.id == process_id))
     if process is None:
         raise HTTPException(status_code=404, detail="Integration process not found")
     return process
 
 # Update an Integration Process
 @router.put("/integration-processes/{process_id}", response_model=IntegrationProcessResponse)
-def update_integration_process(
+async def update_integration_process(
     process_id: int, 
     updated_process: IntegrationProcessCreate, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # Verify process exists
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == process_id).first()
-    if process is None:
+    if not await exists(db, IntegrationProcess, process_id):
         raise HTTPException(status_code=404, detail="Integration process not found")
     
     # Verify that integration agent exists
     from models.models import IntegrationAgent
-    agent = db.query(IntegrationAgent).filter(
-        IntegrationAgent.id == updated_process.integration_agent_id
-    ).first()
-    if not agent:
+    if not await exists(db, IntegrationAgent, updated_process.integration_agent_id):
         raise HTTPException(status_code=404, detail="Integration agent not found")
     
-    # Update attributes
-    for key, value in updated_process.dict().items():
-        setattr(process, key, value)
+    async def apply(session: AsyncSession):
+        process = await session.get(IntegrationProcess, process_id)
+        if process is None:
+            raise HTTPException(status_code=404, detail="Integration process not found")
+        
+        # Update attributes
+        for key, value in updated_process.dict().items():
+            setattr(process, key, value)
+        return process
     
-    db.commit()
-    db.refresh(process)
+    process = await commit_write(db, apply)
+    # Waiting webhooks stay on disk in case the trigger is switched back
+    if updated_process.trigger_type != TriggerType.WebHook.value:
+        await webhook_ingest.close(process_id)
     return process
 
 # Delete an Integration Process
 @router.delete("/integration-processes/{process_id}", response_model=IntegrationProcessResponse)
-def delete_integration_process(process_id: int, db: Session = Depends(get_db)):
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == process_id).first()
-    if process is None:
-        raise HTTPException(status_code=404, detail="Integration process not found")
-    
-    # Check for associated tasks, schedules, etc.
-    # You might want to implement cascade delete in the database schema
+async def delete_integration_process(process_id: int, db: AsyncSession = Depends(get_db)):
+    async def apply(session: AsyncSession):
+        process = await session.get(IntegrationProcess, process_id)
+        if process is None:
+            raise HTTPException(status_code=404, detail="Integration process not found")
+        
+        # Check for associated tasks, schedules, etc.
+        # You might want to implement cascade delete in the database schema
+        
+        await session.delete(process)
+        return process
     
-    db.delete(process)
-    db.commit()
+    process = await commit_write(db, apply)
+    # Run logs and checkpoints have no rows to cascade from, so they go once
+    # the delete is committed; a later process given the same id must not
+    # resume this one's run
+    await run_in_threadpool(run_log_store.drop, process_id)
+    await run_in_threadpool(checkpoint_store.clear, process_id)
+    await webhook_ingest.drop(process_id)
     return process
 
-# Start an Integration Process
-@router.post("/integration-processes/{process_id}/start", response_model=IntegrationProcessResponse)
-def start_process(process_id: int, db: Session = Depends(get_db)):
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == process_id).first()
+async def set_process_status(session: AsyncSession, process_id: int, status: ProcessStatus):
+    process = await session.get(IntegrationProcess, process_id)
     if process is None:
         raise HTTPException(status_code=404, detail="Integration process not found")
-    
-    # Update status to Running
-    process.status = ProcessStatus.Running
-    db.commit()
-    db.refresh(process)
+    process.status = status
     return process
 
+# Start an Integration Process; one whose last run failed part way carries on
+# from that run's checkpoint
+@router.post("/integration-processes/{process_id}/start", response_model=IntegrationProcessResponse)
+async def start_process(process_id: int, db: AsyncSession = Depends(get_db)):
+    previous = await db.scalar(select(IntegrationProcess.status).filter(IntegrationProcess.id == process_id))
+    process = await commit_write(db, lambda session: set_process_status(session, process_id, ProcessStatus.Running))
+    if previous == ProcessStatus.Error and await run_in_threadpool(checkpoint_store.load, process_id) is not None:
+        from process_engine import EngineError, process_engine
+        try:
+            await process_engine.start(db, process_id, resume=True)
+        except EngineError as error:
+            raise HTTPException(status_code=409, detail=str(error))
+    return process
+
+# Get the checkpoint a failed or interrupted run left
+@router.get("/integration-processes/{process_id}/checkpoint")
+async def get_process_checkpoint(process_id: int):
+    checkpoint = await run_in_threadpool(checkpoint_store.load, process_id)
+    if checkpoint is None:
+        raise HTTPException(status_code=404, detail="Integration process has no checkpoint")
+    return checkpoint
+
 # Stop an Integration Process
 @router.post("/integration-processes/{process_id}/stop", response_model=IntegrationProcessResponse)
-def stop_process(process_id: int, db: Session = Depends(get_db)):
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == process_id).first()
-    if process is None:
+async def stop_process(process_id: int, db: AsyncSession = Depends(get_db)):
+    return await commit_write(db, lambda session: set_process_status(session, process_id, ProcessStatus.Stopped))
+
+# Run a process against sample input with Output connectors stubbed, reporting
+# the records and the time, CPU and memory of every task
+@router.post("/integration-processes/{process_id}/dry-run", response_model=RunReport)
+async def dry_run_process(process_id: int, request: Optional[DryRunRequest] = None, db: AsyncSession = Depends(get_db)):
+    from process_engine import process_engine
+    request = request or DryRunRequest()
+    report = await process_engine.dry_run(db, process_id, request.payload, request.sample_size, request.profile_memory)
+    if report is None:
         raise HTTPException(status_code=404, detail="Integration process not found")
-    
-    # Update status to Stopped
-    process.status = ProcessStatus.Stopped
-    db.commit()
-    db.refresh(process)
-    return process
+    return report
+
+# Run a process now, in the background
+@router.post("/integration-processes/{process_id}/execute", response_model=RunStarted, status_code=202)
+async def execute_process(process_id: int, payload: Optional[Any] = Body(None), db: AsyncSession = Depends(get_db)):
+    from process_engine import EngineError, process_engine
+    try:
+        run = await process_engine.start(db, process_id, payload)
+    except EngineError as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    if run is None:
+        raise HTTPException(status_code=404, detail="Integration process not found")
+    return {"run_id": run.run_id}
+
+# Take a webhook for a process triggered by WebHook. It is acknowledged once
+# it is on disk and runs together with the others of its micro-batch; one
+# repeating the Idempotency-Key of an earlier webhook is dropped
+@router.post("/integration-processes/{process_id}/webhook", response_model=WebhookAccepted, status_code=202)
+async def receive_webhook(
+    process_id: int,
+    payload: Any = Body(...),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    db: AsyncSession = Depends(get_db),
+):
+    if process_id not in webhook_ingest.streams:
+        trigger_type = await db.scalar(select(IntegrationProcess.trigger_type).filter(IntegrationProcess.id == process_id))
+        if trigger_type is None:
+            raise HTTPException(status_code=404, detail="Integration process not found")
+        if trigger_type != TriggerType.WebHook:
+            raise HTTPException(status_code=409, detail="Integration process is not triggered by WebHook")
+    try:
+        seq, duplicate = await webhook_ingest.ingest(db.bind, process_id, payload, idempotency_key)
+    except BufferFull as error:
+        retry_after = str(max(1, math.ceil(webhook_ingest.batch_seconds)))
+        raise HTTPException(status_code=503, detail=str(error), headers={"Retry-After": retry_after})
+    return {"seq": seq, "duplicate": duplicate}
+
+# Get the progress of the run in progress, per task
+@router.get("/integration-processes/{process_id}/execution", response_model=RunReport)
+async def get_process_execution(process_id: int):
+    from process_engine import process_engine
+    run = process_engine.active.get(process_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Integration process is not running")
+    return run.result()
 
 # Get Process Tasks
 @router.get("/integration-processes/{process_id}/tasks")
-def get_process_tasks(process_id: int, db: Session = Depends(get_db)):
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == process_id).first()
-    if process is None:
+async def get_process_tasks(process_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, f"process:{process_id}")
+    if not await exists(db, IntegrationProcess, process_id):
         raise HTTPException(status_code=404, detail="Integration process not found")
     
     from models.models import ProcessTask
-    tasks = db.query(ProcessTask).filter(ProcessTask.integration_process_id == process_id).all()
+    tasks = (await db.scalars(select(ProcessTask).filter(ProcessTask.integration_process_id == process_id))).all()
     return tasks
 
 # Get Process Schedule
 @router.get("/integration-processes/{process_id}/schedule")
-def get_process_schedule(process_id: int, db: Session = Depends(get_db)):
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == process_id).first()
-    if process is None:
+async def get_process_schedule(process_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, f"process:{process_id}")
+    if not await exists(db, IntegrationProcess, process_id):
         raise HTTPException(status_code=404, detail="Integration process not found")
     
     from models.models import ProcessSchedule
-    schedules = db.query(ProcessSchedule).filter(ProcessSchedule.integration_process_id == process_id).all()
+    schedules = (await db.scalars(select(ProcessSchedule).filter(ProcessSchedule.integration_process_id == process_id))).all()
     return schedules 
\ No newline at end of file
@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from pydantic import BaseModel
 from models.models import ProcessSchedule, Recurrence, IntegrationProcess
-from database import get_db
+from database import get_db, commit_write
+from serialization import RowSerializer, list_response
+from cache import exists
+from versions import conditional_get
+from bulk import check_batch_ids, ensure_exist, bulk_write, load_by_ids
 from datetime import datetime
 
 router = APIRouter()
@@ -34,122 +39,135 @@ class ProcessScheduleResponse(ProcessScheduleBase):
         orm_mode = True
         from_attributes = True
 
-# Create a Process Schedule
-@router.post("/process-schedules/", response_model=ProcessScheduleResponse)
-def create_process_schedule(schedule: ProcessScheduleCreate, db: Session = Depends(get_db)):
-    # Verify that integration process exists
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == schedule.integration_process_id).first()
-    if not process:
-        raise HTTPException(status_code=404, detail="Integration process not found")
-    
+schedules_serializer = RowSerializer(ProcessScheduleResponse, ProcessSchedule)
+
+class ProcessScheduleUpdate(ProcessScheduleCreate):
+    id: int
+
+class ProcessScheduleBatch(BaseModel):
+    create: List[ProcessScheduleCreate] = []
+    update: List[ProcessScheduleUpdate] = []
+    delete: List[int] = []
+
+class ProcessScheduleBatchResponse(BaseModel):
+    created: List[ProcessScheduleResponse] = []
+    updated: List[ProcessScheduleResponse] = []
+    deleted: List[int] = []
+
+def validate_schedule(schedule: ProcessScheduleCreate):
     # Validate schedule data based on recurrence type
     if schedule.recurrence_type == Recurrence.Interval and schedule.interval_minutes <= 0:
         raise HTTPException(status_code=400, detail="Interval recurrence requires a positive interval_minutes value")
-    
+
     # Additional validation for different recurrence types
     if schedule.recurrence_type == Recurrence.Weekly and not (0 <= schedule.day_of_week <= 6):
         raise HTTPException(status_code=400, detail="Weekly recurrence requires day_of_week between 0-6")
-    
+
     if schedule.recurrence_type == Recurrence.Monthly and not (1 <= schedule.day_of_month <= 31):
         raise HTTPException(status_code=400, detail="Monthly recurrence requires day_of_month between 1-31")
-    
+
     # Validate time components
     if not (0 <= schedule.hour <= 23):
         raise HTTPException(status_code=400, detail="Hour must be between 0-23")
-    
+
     if not (0 <= schedule.minute <= 59):
         raise HTTPException(status_code=400, detail="Minute must be between 0-59")
+
+# Create a Process Schedule
+@router.post("/process-schedules/", response_model=ProcessScheduleResponse)
+async def create_process_schedule(schedule: ProcessScheduleCreate, db: AsyncSession = Depends(get_db)):
+    # Verify that integration process exists
+    if not await exists(db, IntegrationProcess, schedule.integration_process_id):
+        raise HTTPException(status_code=404, detail="Integration process not found")
+    
+    validate_schedule(schedule)
     
-    db_schedule = ProcessSchedule(**schedule.dict())
-    db.add(db_schedule)
-    db.commit()
-    db.refresh(db_schedule)
-    return db_schedule
+    async def apply(session: AsyncSession):
+        db_schedule = ProcessSchedule(**schedule.dict())
+        session.add(db_schedule)
+        await session.flush()
+        return db_schedule
+    
+    return await commit_write(db, apply)
 
 # Read all Process Schedules
 @router.get("/process-schedules/", response_model=List[ProcessScheduleResponse])
-def read_process_schedules(
+async def read_process_schedules(
+    request: Request,
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
     process_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    query = db.query(ProcessSchedule)
+    await conditional_get(request, response, db, "process_schedules")
+    query = select(ProcessSchedule)
     
     # Filter by process if specified
     if process_id:
         query = query.filter(ProcessSchedule.integration_process_id == process_id)
         
-    schedules = query.offset(skip).limit(limit).all()
-    return schedules
+    return await list_response(
+        request, response, db, query, schedules_serializer, ProcessSchedule.id, limit=limit, after=after, skip=skip
+    )
 
 # Read a single Process Schedule by ID
 @router.get("/process-schedules/{schedule_id}", response_model=ProcessScheduleResponse)
-def read_process_schedule(schedule_id: int, db: Session = Depends(get_db)):
-    schedule = db.query(ProcessSchedule).filter(ProcessSchedule.id == schedule_id).first()
+async def read_process_schedule(schedule_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, "process_schedules")
+    schedule = await db.scalar(select(ProcessSchedule).filter(ProcessSchedule.id == schedule_id))
     if schedule is None:
         raise HTTPException(status_code=404, detail="Process schedule not found")
     return schedule
 
 # Update a Process Schedule
 @router.put("/process-schedules/{schedule_id}", response_model=ProcessScheduleResponse)
-def update_process_schedule(schedule_id: int, updated_schedule: ProcessScheduleCreate, db: Session = Depends(get_db)):
+async def update_process_schedule(schedule_id: int, updated_schedule: ProcessScheduleCreate, db: AsyncSession = Depends(get_db)):
     # Verify schedule exists
-    schedule = db.query(ProcessSchedule).filter(ProcessSchedule.id == schedule_id).first()
-    if schedule is None:
+    if not await exists(db, ProcessSchedule, schedule_id):
         raise HTTPException(status_code=404, detail="Process schedule not found")
     
     # Verify that integration process exists
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == updated_schedule.integration_process_id).first()
-    if not process:
+    if not await exists(db, IntegrationProcess, updated_schedule.integration_process_id):
         raise HTTPException(status_code=404, detail="Integration process not found")
     
-    # Validate schedule data based on recurrence type
-    if updated_schedule.recurrence_type == Recurrence.Interval and updated_schedule.interval_minutes <= 0:
-        raise HTTPException(status_code=400, detail="Interval recurrence requires a positive interval_minutes value")
-    
-    # Additional validation for different recurrence types
-    if updated_schedule.recurrence_type == Recurrence.Weekly and not (0 <= updated_schedule.day_of_week <= 6):
-        raise HTTPException(status_code=400, detail="Weekly recurrence requires day_of_week between 0-6")
-    
-    if updated_schedule.recurrence_type == Recurrence.Monthly and not (1 <= updated_schedule.day_of_month <= 31):
-        raise HTTPException(status_code=400, detail="Monthly recurrence requires day_of_month between 1-31")
-    
-    # Validate time components
-    if not (0 <= updated_schedule.hour <= 23):
-        raise HTTPException(status_code=400, detail="Hour must be between 0-23")
+    validate_schedule(updated_schedule)
     
-    if not (0 <= updated_schedule.minute <= 59):
-        raise HTTPException(status_code=400, detail="Minute must be between 0-59")
-    
-    # Update attributes
-    for key, value in updated_schedule.dict().items():
-        setattr(schedule, key, value)
+    async def apply(session: AsyncSession):
+        schedule = await session.get(ProcessSchedule, schedule_id)
+        if schedule is None:
+            raise HTTPException(status_code=404, detail="Process schedule not found")
+        
+        # Update attributes
+        for key, value in updated_schedule.dict().items():
+            setattr(schedule, key, value)
+        return schedule
     
-    db.commit()
-    db.refresh(schedule)
-    return schedule
+    return await commit_write(db, apply)
 
 # Delete a Process Schedule
 @router.delete("/process-schedules/{schedule_id}", response_model=ProcessScheduleResponse)
-def delete_process_schedule(schedule_id: int, db: Session = Depends(get_db)):
-    schedule = db.query(ProcessSchedule).filter(ProcessSchedule.id == schedule_id).first()
-    if schedule is None:
-        raise HTTPException(status_code=404, detail="Process schedule not found")
+async def delete_process_schedule(schedule_id: int, db: AsyncSession = Depends(get_db)):
+    async def apply(session: AsyncSession):
+        schedule = await session.get(ProcessSchedule, schedule_id)
+        if schedule is None:
+            raise HTTPException(status_code=404, detail="Process schedule not found")
+        
+        await session.delete(schedule)
+        return schedule
     
-    db.delete(schedule)
-    db.commit()
-    return schedule
+    return await commit_write(db, apply)
 
 # Get schedule for a specific process
 @router.get("/integration-processes/{process_id}/schedule", response_model=ProcessScheduleResponse)
-def get_schedule_for_process(process_id: int, db: Session = Depends(get_db)):
+async def get_schedule_for_process(process_id: int, db: AsyncSession = Depends(get_db)):
     # Verify process exists
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == process_id).first()
+    process = await db.scalar(select(IntegrationProcess).filter(IntegrationProcess.id == process_id))
     if process is None:
         raise HTTPException(status_code=404, detail="Integration process not found")
     
-    schedule = db.query(ProcessSchedule).filter(ProcessSchedule.integration_process_id == process_id).first()
+    schedule = await db.scalar(select(ProcessSchedule).filter(ProcessSchedule.integration_process_id == process_id))
     if schedule is None:
         raise HTTPException(status_code=404, detail="Schedule not found for this process")
     
@@ -157,9 +175,9 @@ def get_schedule_for_process(process_id: int, db: Session = Depends(get_db)):
 
 # Create schedule for a specific process
 @router.post("/integration-processes/{process_id}/schedule", response_model=ProcessScheduleResponse)
-def create_schedule_for_process(process_id: int, schedule: ProcessScheduleCreate, db: Session = Depends(get_db)):
+async def create_schedule_for_process(process_id: int, schedule: ProcessScheduleCreate, db: AsyncSession = Depends(get_db)):
     # Verify process exists
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == process_id).first()
+    process = await db.scalar(select(IntegrationProcess).filter(IntegrationProcess.id == process_id))
     if process is None:
         raise HTTPException(status_code=404, detail="Integration process not found")
     
@@ -168,7 +186,7 @@ def create_schedule_for_process(process_id: int, schedule: ProcessScheduleCreate
         raise HTTPException(status_code=400, detail="Schedule process ID must match the process ID in the URL")
     
     # Check if process already has a schedule
-    existing_schedule = db.query(ProcessSchedule).filter(ProcessSchedule.integration_process_id == process_id).first()
+    existing_schedule = await db.scalar(select(ProcessSchedule).filter(ProcessSchedule.integration_process_id == process_id))
     if existing_schedule:
         raise HTTPException(status_code=400, detail="This process already has a schedule")
     
@@ -176,8 +194,41 @@ def create_schedule_for_process(process_id: int, schedule: ProcessScheduleCreate
     if schedule.recurrence_type == Recurrence.Interval and schedule.interval_minutes <= 0:
         raise HTTPException(status_code=400, detail="Interval recurrence requires a positive interval_minutes value")
     
-    db_schedule = ProcessSchedule(**schedule.dict())
-    db.add(db_schedule)
-    db.commit()
-    db.refresh(db_schedule)
-    return db_schedule 
\ No newline at end of file
+    async def apply(session: AsyncSession):
+        db_schedule = ProcessSchedule(**schedule.dict())
+        session.add(db_schedule)
+        await session.flush()
+        return db_schedule
+    
+    return await commit_write(db, apply)
+
+# Create, update and delete Process Schedules in one transaction
+@router.post("/process-schedules/batch", response_model=ProcessScheduleBatchResponse)
+async def batch_process_schedules(batch: ProcessScheduleBatch, db: AsyncSession = Depends(get_db)):
+    check_batch_ids([schedule.id for schedule in batch.update], batch.delete)
+    for schedule in batch.create + batch.update:
+        validate_schedule(schedule)
+    
+    async def apply(session: AsyncSession):
+        # Set-based existence checks: one IN query per referenced table
+        await ensure_exist(
+            session, IntegrationProcess.id,
+            [schedule.integration_process_id for schedule in batch.create + batch.update],
+            "Integration process not found"
+        )
+        await ensure_exist(
+            session, ProcessSchedule.id,
+            [schedule.id for schedule in batch.update] + batch.delete,
+            "Process schedule not found"
+        )
+        
+        created = await bulk_write(
+            session, ProcessSchedule,
+            [schedule.dict() for schedule in batch.create],
+            [schedule.dict() for schedule in batch.update],
+            batch.delete
+        )
+        updated = await load_by_ids(session, ProcessSchedule, [schedule.id for schedule in batch.update])
+        return {"created": created, "updated": updated, "deleted": batch.delete}
+    
+    return await commit_write(db, apply)
@@ -0,0 +1,71 @@
+import asyncio
+from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+from database import get_db
+from serialization import dumps
+from status_hub import status_hub, STATUS_TICK, Subscription
+
+router = APIRouter()
+
+async def _sse_events(subscription: Subscription, tick: float):
+    try:
+        async for states in subscription.updates(tick):
+            if states:
+                yield b"event: status\ndata: " + dumps({"processes": states}) + b"\n\n"
+            else:
+                yield b": keepalive\n\n"
+    finally:
+        status_hub.unsubscribe(subscription)
+
+# Stream process status changes as Server-Sent Events. Without process_id
+# every process is watched; each event carries every process that changed
+# during the last tick.
+@router.get("/process-status/stream")
+async def stream_process_status(
+    process_id: List[int] = Query(default=[]),
+    tick: float = STATUS_TICK,
+    db: AsyncSession = Depends(get_db)
+):
+    subscription = await status_hub.subscribe(db, process_id or None)
+    return StreamingResponse(
+        _sse_events(subscription, tick),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Push process status changes over a WebSocket, same messages as the stream
+@router.websocket("/process-status/ws")
+async def process_status_socket(
+    websocket: WebSocket,
+    process_id: List[int] = Query(default=[]),
+    tick: float = STATUS_TICK,
+    db: AsyncSession = Depends(get_db)
+):
+    await websocket.accept()
+    subscription = await status_hub.subscribe(db, process_id or None)
+    # Give the connection back to the pool for the lifetime of the socket
+    await db.close()
+
+    async def send_updates():
+        async for states in subscription.updates(tick):
+            await websocket.send_text(dumps({"processes": states}).decode())
+
+    async def wait_for_close():
+        # Clients only listen, but reading is how a disconnect is noticed
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(send_updates()), asyncio.create_task(wait_for_close())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        status_hub.unsubscribe(subscription)
+    for task in done:
+        error = task.exception()
+        # Sending to a client that has just gone away fails, which is fine
+        if error is not None and not isinstance(error, (WebSocketDisconnect, RuntimeError)):
+            raise error
@@ -1,13 +1,44 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from sqlalchemy import select, insert, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from typing import List, Optional
 from pydantic import BaseModel, Field as PydanticField
 from models.models import ProcessTask, TaskType, LogicType, InputSource, ConnectorType, OptionType, Field, IntegrationProcess, DataType
 import models.models as models
-from database import get_db
+from database import get_db, commit_write
+from serialization import RowSerializer, list_response
+from cache import exists
+from versions import conditional_get
+from bulk import check_batch_ids, ensure_exist, bulk_write, load_by_ids
 
 router = APIRouter()
 
+def _check_graph(tasks: List[ProcessTask]):
+    # Declared dependencies and sequence numbers together must not form a
+    # cycle, or the process would only fail once it runs
+    from process_engine import EngineError, task_graph
+    try:
+        task_graph(tasks)
+    except EngineError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+async def _check_processes(session: AsyncSession, process_ids):
+    """Check the task graphs of processes after a write that changed their tasks."""
+    await session.flush()
+    dependency = models.TaskDependency
+    rows = (await session.execute(
+        select(
+            ProcessTask.id, ProcessTask.integration_process_id, ProcessTask.type,
+            ProcessTask.sequence_number, ProcessTask.enabled, dependency.depends_on_id,
+        )
+        .outerjoin(dependency, dependency.task_id == ProcessTask.id)
+        .filter(ProcessTask.integration_process_id.in_(set(process_ids)))
+    )).all()
+    from process_engine import unsaved_tasks
+    for tasks in unsaved_tasks(rows).values():
+        _check_graph(tasks)
+
 # Pydantic models for Field
 class FieldBase(BaseModel):
     key: str
@@ -82,180 +113,318 @@ class ProcessTaskResponse(ProcessTaskBase):
             }
         }
 
+tasks_serializer = RowSerializer(
+    ProcessTaskResponse, ProcessTask, children={"static_fields": (FieldResponse, Field, Field.process_task_id)}
+)
+
+class ProcessTaskUpdate(ProcessTaskCreate):
+    id: int
+
+class ProcessTaskBatch(BaseModel):
+    create: List[ProcessTaskCreate] = []
+    update: List[ProcessTaskUpdate] = []
+    delete: List[int] = []
+
+class ProcessTaskBatchResponse(BaseModel):
+    created: List[ProcessTaskResponse] = []
+    updated: List[ProcessTaskResponse] = []
+    deleted: List[int] = []
+
 # Create a ProcessTask with fields
 @router.post("/process-tasks/", response_model=ProcessTaskResponse)
-def create_process_task(task: ProcessTaskCreate, db: Session = Depends(get_db)):
+async def create_process_task(task: ProcessTaskCreate, db: AsyncSession = Depends(get_db)):
     # Verify that integration process exists
-    process = db.query(IntegrationProcess).filter(IntegrationProcess.id == task.integration_process_id).first()
-    if not process:
+    if not await exists(db, IntegrationProcess, task.integration_process_id):
         raise HTTPException(status_code=404, detail="Integration process not found")
     
     # Extract static_fields from request
     static_fields = task.static_fields
     task_dict = task.dict(exclude={"static_fields"})
     
-    # Create the task
-    db_task = ProcessTask(**task_dict)
-    db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
-    
-    # Create static fields if provided
-    if static_fields:
-        for field_data in static_fields:
-            # Map from client model to database model
-            db_field = Field(
-                process_task_id=db_task.id,
-                field_name=field_data.key,  # Use key as field_name
-                data_type=field_data.data_type,
-                value=field_data.value
-            )
+    async def apply(session: AsyncSession):
+        # Create the task
+        db_task = ProcessTask(**task_dict)
+        session.add(db_task)
+        await session.flush()
+        
+        # Create static fields if provided
+        if static_fields:
+            for field_data in static_fields:
+                # Map from client model to database model
+                db_field = Field(
+                    process_task_id=db_task.id,
+                    field_name=field_data.key,  # Use key as field_name
+                    data_type=field_data.data_type,
+                    value=field_data.value
+                )
+                
+                session.add(db_field)
             
-            db.add(db_field)
+            await session.flush()
         
-        db.commit()
+        await session.refresh(db_task, attribute_names=["static_fields"])
+        return db_task
     
-    return db_task
+    return await commit_write(db, apply)
 
 # Read all ProcessTasks
 @router.get("/process-tasks/", response_model=List[ProcessTaskResponse])
-def read_process_tasks(
+async def read_process_tasks(
+    request: Request,
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
     process_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    query = db.query(ProcessTask)
+    # Tasks are returned with their static fields
+    await conditional_get(request, response, db, "process_tasks", "fields")
+    query = select(ProcessTask)
     
     # Filter by process if specified
     if process_id:
         query = query.filter(ProcessTask.integration_process_id == process_id)
         
-    # Order by sequence number
-    query = query.order_by(ProcessTask.sequence_number)
-    
-    tasks = query.offset(skip).limit(limit).all()
-    return tasks
+    # Order by sequence number, with id breaking ties so the cursor is unique
+    return await list_response(
+        request, response, db, query, tasks_serializer,
+        ProcessTask.sequence_number, ProcessTask.id, limit=limit, after=after, skip=skip
+    )
 
 # Read a single ProcessTask by ID
 @router.get("/process-tasks/{task_id}", response_model=ProcessTaskResponse)
-def read_process_task(task_id: int, db: Session = Depends(get_db)):
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
+async def read_process_task(task_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, f"task:{task_id}")
+    task = await db.scalar(
+        select(ProcessTask).options(selectinload(ProcessTask.static_fields)).filter(ProcessTask.id == task_id)
+    )
     if task is None:
         raise HTTPException(status_code=404, detail="Process task not found")
     return task
 
 # Update a ProcessTask
 @router.put("/process-tasks/{task_id}", response_model=ProcessTaskResponse)
-def update_process_task(task_id: int, updated_task: ProcessTaskCreate, db: Session = Depends(get_db)):
+async def update_process_task(task_id: int, updated_task: ProcessTaskCreate, db: AsyncSession = Depends(get_db)):
     # Verify task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
-    if task is None:
+    if not await exists(db, ProcessTask, task_id):
         raise HTTPException(status_code=404, detail="Process task not found")
     
     # Verify that integration process exists
-    process = db.query(IntegrationProcess).filter(
-        IntegrationProcess.id == updated_task.integration_process_id
-    ).first()
-    if not process:
+    if not await exists(db, IntegrationProcess, updated_task.integration_process_id):
         raise HTTPException(status_code=404, detail="Integration process not found")
     
     # Extract static fields from request
     static_fields = updated_task.static_fields
     task_dict = updated_task.dict(exclude={"static_fields"})
     
-    # Update task attributes
-    for key, value in task_dict.items():
-        setattr(task, key, value)
-    
-    # Handle fields update - delete existing fields and add new ones
-    db.query(Field).filter(Field.process_task_id == task_id).delete()
-    
-    if static_fields:
-        for field_data in static_fields:
-            db_field = Field(
-                process_task_id=task_id,
-                field_name=field_data.key,  # Use key as field_name
-                data_type=field_data.data_type,
-                value=field_data.value
-            )
-            db.add(db_field)
+    async def apply(session: AsyncSession):
+        task = await session.get(ProcessTask, task_id)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Process task not found")
+        
+        # Update task attributes
+        for key, value in task_dict.items():
+            setattr(task, key, value)
+        
+        # Handle fields update - delete existing fields and add new ones
+        await session.execute(delete(Field).where(Field.process_task_id == task_id))
+        
+        if static_fields:
+            for field_data in static_fields:
+                db_field = Field(
+                    process_task_id=task_id,
+                    field_name=field_data.key,  # Use key as field_name
+                    data_type=field_data.data_type,
+                    value=field_data.value
+                )
+                session.add(db_field)
+        
+        await _check_processes(session, [task.integration_process_id])
+        await session.refresh(task, attribute_names=["static_fields"])
+        return task
     
-    db.commit()
-    db.refresh(task)
-    return task
+    return await commit_write(db, apply)
 
 # Delete a ProcessTask
 @router.delete("/process-tasks/{task_id}", response_model=ProcessTaskResponse)
-def delete_process_task(task_id: int, db: Session = Depends(get_db)):
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
-    if task is None:
-        raise HTTPException(status_code=404, detail="Process task not found")
-    
-    # Check for associated connectors, fields, transformations
-    # You might want to implement cascade delete in the database schema
+async def delete_process_task(task_id: int, db: AsyncSession = Depends(get_db)):
+    async def apply(session: AsyncSession):
+        task = await session.get(ProcessTask, task_id)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Process task not found")
+        
+        # Connectors, fields and transformations go with the task through
+        # the relationship cascades
+        await session.delete(task)
+        return task
     
-    db.delete(task)
-    db.commit()
-    return task
+    return await commit_write(db, apply)
 
 # Reorder ProcessTasks
 @router.post("/process-tasks/reorder")
-def reorder_process_tasks(task_ids: List[int], db: Session = Depends(get_db)):
+async def reorder_process_tasks(task_ids: List[int], db: AsyncSession = Depends(get_db)):
     """
     Reorder process tasks by assigning new sequence numbers.
     The order of task_ids in the list determines the new sequence.
     """
-    # Verify all tasks exist
-    tasks = db.query(ProcessTask).filter(ProcessTask.id.in_(task_ids)).all()
-    if len(tasks) != len(task_ids):
-        raise HTTPException(status_code=404, detail="One or more tasks not found")
-    
-    # Create a mapping of task id to task
-    task_map = {task.id: task for task in tasks}
+    async def apply(session: AsyncSession):
+        # Verify all tasks exist
+        tasks = (await session.scalars(select(ProcessTask).filter(ProcessTask.id.in_(task_ids)))).all()
+        if len(tasks) != len(task_ids):
+            raise HTTPException(status_code=404, detail="One or more tasks not found")
+        
+        # Create a mapping of task id to task
+        task_map = {task.id: task for task in tasks}
+        
+        # Update sequence numbers
+        for i, task_id in enumerate(task_ids):
+            task_map[task_id].sequence_number = (i + 1) * 10
+        await _check_processes(session, [task.integration_process_id for task in tasks])
+        
+        # Return updated tasks
+        return sorted(tasks, key=lambda task: task.sequence_number)
     
-    # Update sequence numbers
-    for i, task_id in enumerate(task_ids):
-        task_map[task_id].sequence_number = (i + 1) * 10
+    return await commit_write(db, apply)
+
+# Create, update and delete ProcessTasks in one transaction
+@router.post("/process-tasks/batch", response_model=ProcessTaskBatchResponse)
+async def batch_process_tasks(batch: ProcessTaskBatch, db: AsyncSession = Depends(get_db)):
+    """
+    Apply task creates, updates and deletes atomically.
+    Like PUT, an update replaces the task's static fields with the ones sent.
+    """
+    check_batch_ids([task.id for task in batch.update], batch.delete)
     
-    db.commit()
+    async def apply(session: AsyncSession):
+        # Set-based existence checks: one IN query per referenced table
+        await ensure_exist(
+            session, IntegrationProcess.id,
+            [task.integration_process_id for task in batch.create + batch.update],
+            "Integration process not found"
+        )
+        updated_ids = [task.id for task in batch.update]
+        await ensure_exist(session, ProcessTask.id, updated_ids + batch.delete, "Process task not found")
+        
+        # Bulk deletes bypass ORM cascades, so remove the children explicitly
+        if batch.delete:
+            for child in (Field, models.Connector, models.Transformation):
+                await session.execute(delete(child).where(child.process_task_id.in_(batch.delete)))
+            dependency = models.TaskDependency
+            await session.execute(
+                delete(dependency).where(dependency.task_id.in_(batch.delete) | dependency.depends_on_id.in_(batch.delete))
+            )
+        if updated_ids:
+            await session.execute(delete(Field).where(Field.process_task_id.in_(updated_ids)))
+        
+        created = await bulk_write(
+            session, ProcessTask,
+            [task.dict(exclude={"static_fields"}) for task in batch.create],
+            [task.dict(exclude={"static_fields"}) for task in batch.update],
+            batch.delete
+        )
+        created_ids = [task.id for task in created]
+        
+        # Static fields for every created and updated task in one INSERT
+        field_rows = [
+            {
+                "process_task_id": task_id,
+                "field_name": field_data.key,
+                "data_type": field_data.data_type,
+                "value": field_data.value,
+            }
+            for task_id, task in zip(created_ids + updated_ids, batch.create + batch.update)
+            for field_data in task.static_fields or []
+        ]
+        if field_rows:
+            await session.execute(insert(Field), field_rows)
+        await _check_processes(session, [task.integration_process_id for task in batch.create + batch.update])
+        
+        tasks = await load_by_ids(session, ProcessTask, created_ids + updated_ids, selectinload(ProcessTask.static_fields))
+        return {"created": tasks[:len(created_ids)], "updated": tasks[len(created_ids):], "deleted": batch.delete}
     
-    # Return updated tasks
-    tasks = db.query(ProcessTask).filter(ProcessTask.id.in_(task_ids)).order_by(ProcessTask.sequence_number).all()
-    return tasks
+    return await commit_write(db, apply)
+
+class TaskDependencies(BaseModel):
+    depends_on: List[int]
+
+# Get the tasks a task takes its records from; empty when it follows the
+# previous sequence number
+@router.get("/process-tasks/{task_id}/dependencies", response_model=TaskDependencies)
+async def get_task_dependencies(task_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, f"task:{task_id}")
+    if not await exists(db, ProcessTask, task_id):
+        raise HTTPException(status_code=404, detail="Process task not found")
+    depends_on = (await db.scalars(
+        select(models.TaskDependency.depends_on_id)
+        .filter(models.TaskDependency.task_id == task_id)
+        .order_by(models.TaskDependency.depends_on_id)
+    )).all()
+    return {"depends_on": depends_on}
+
+# Replace the tasks a task takes its records from
+@router.put("/process-tasks/{task_id}/dependencies", response_model=TaskDependencies)
+async def update_task_dependencies(task_id: int, dependencies: TaskDependencies, db: AsyncSession = Depends(get_db)):
+    depends_on = sorted(set(dependencies.depends_on))
+    if task_id in depends_on:
+        raise HTTPException(status_code=400, detail="A task cannot depend on itself")
+
+    async def apply(session: AsyncSession):
+        process_id = await session.scalar(select(ProcessTask.integration_process_id).filter(ProcessTask.id == task_id))
+        if process_id is None:
+            raise HTTPException(status_code=404, detail="Process task not found")
+        tasks = (await session.scalars(
+            select(ProcessTask)
+            .filter(ProcessTask.integration_process_id == process_id)
+            .options(selectinload(ProcessTask.dependencies))
+        )).all()
+        if set(depends_on) - {other.id for other in tasks}:
+            raise HTTPException(status_code=400, detail="Dependencies must be tasks of the same process")
+        task = next(other for other in tasks if other.id == task_id)
+        # Keep the rows that stay, so no pair is deleted and inserted again
+        kept = [dependency for dependency in task.dependencies if dependency.depends_on_id in depends_on]
+        added = set(depends_on) - {dependency.depends_on_id for dependency in kept}
+        task.dependencies = kept + [models.TaskDependency(depends_on_id=dependency) for dependency in sorted(added)]
+        _check_graph(tasks)
+        return {"depends_on": depends_on}
+
+    return await commit_write(db, apply)
 
 # Get task connectors
 @router.get("/process-tasks/{task_id}/connectors")
-def get_task_connectors(task_id: int, db: Session = Depends(get_db)):
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
+async def get_task_connectors(task_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, f"task:{task_id}")
+    task = await db.scalar(select(ProcessTask).filter(ProcessTask.id == task_id))
     if task is None:
         raise HTTPException(status_code=404, detail="Process task not found")
     
     # Return connectors associated with this task
     from models.models import Connector
-    connectors = db.query(Connector).filter(Connector.process_task_id == task_id).all()
+    connectors = (await db.scalars(select(Connector).filter(Connector.process_task_id == task_id))).all()
     return connectors
 
 # Get task fields
 @router.get("/process-tasks/{task_id}/fields")
-def get_task_fields(task_id: int, db: Session = Depends(get_db)):
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
+async def get_task_fields(task_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, f"task:{task_id}")
+    task = await db.scalar(select(ProcessTask).filter(ProcessTask.id == task_id))
     if task is None:
         raise HTTPException(status_code=404, detail="Process task not found")
     
     # Return fields associated with this task
     from models.models import Field
-    fields = db.query(Field).filter(Field.process_task_id == task_id).all()
+    fields = (await db.scalars(select(Field).filter(Field.process_task_id == task_id))).all()
     return fields
 
 # Get task transformations
 @router.get("/process-tasks/{task_id}/transformations")
-def get_task_transformations(task_id: int, db: Session = Depends(get_db)):
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
+async def get_task_transformations(task_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, f"task:{task_id}")
+    task = await db.scalar(select(ProcessTask).filter(ProcessTask.id == task_id))
     if task is None:
         raise HTTPException(status_code=404, detail="Process task not found")
     
     # Return transformations associated with this task
     from models.models import Transformation
-    transformations = db.query(Transformation).filter(Transformation.process_task_id == task_id).all()
+    transformations = (await db.scalars(select(Transformation).filter(Transformation.process_task_id == task_id))).all()
     return transformations 
\ No newline at end of file
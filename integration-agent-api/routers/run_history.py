@@ -0,0 +1,127 @@
+import time
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from pydantic import BaseModel
+from models.models import IntegrationProcess, ProcessStatus
+from database import get_db
+from cache import exists
+from serialization import dumps, JSON_MEDIA_TYPE
+from run_history import run_history
+import enum
+
+router = APIRouter()
+
+class Bucket(str, enum.Enum):
+    hour = "hour"
+    day = "day"
+
+# Pydantic models
+class TaskMetric(BaseModel):
+    task_id: int
+    started_at: Optional[float] = None
+    duration_ms: float = 0
+    records_in: int = 0
+    records_out: int = 0
+    errors: int = 0
+
+class RunRecord(BaseModel):
+    run_id: str
+    started_at: float
+    finished_at: Optional[float] = None
+    status: ProcessStatus
+    duration_ms: float = 0
+    records: int = 0
+    tasks: List[TaskMetric] = []
+
+    class Config:
+        use_enum_values = True
+
+class RunSummary(BaseModel):
+    run_id: str
+    process_id: int
+    started_at: float
+    finished_at: Optional[float] = None
+    status: str
+    duration_ms: float
+    records: int
+
+class RunBucket(BaseModel):
+    bucket: float
+    process_id: int
+    runs: int
+    failed: int
+    duration_ms_total: float
+    duration_ms_max: float
+    records: int
+
+class TaskBucket(BaseModel):
+    bucket: float
+    process_id: int
+    task_id: int
+    executions: int
+    errors: int
+    duration_ms_total: float
+    duration_ms_max: float
+    records_in: int
+    records_out: int
+
+def _range(since: Optional[datetime], until: Optional[datetime]):
+    # The last hour unless told otherwise
+    end = until.timestamp() if until is not None else time.time()
+    return (since.timestamp() if since is not None else end - 3600), end
+
+# Record a finished run of a process and the metrics of its tasks
+@router.post("/integration-processes/{process_id}/runs", status_code=204)
+async def record_run(process_id: int, run: RunRecord, db: AsyncSession = Depends(get_db)):
+    if not await exists(db, IntegrationProcess, process_id):
+        raise HTTPException(status_code=404, detail="Integration process not found")
+    values = run.dict(exclude={"tasks"})
+    values["process_id"] = process_id
+    tasks = [task.dict(exclude_none=True) for task in run.tasks]
+    try:
+        await run_in_threadpool(run_history.record_run, values, tasks)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return Response(status_code=204)
+
+# List a process's runs within a time range, newest first
+@router.get("/integration-processes/{process_id}/runs", response_model=List[RunSummary])
+async def read_runs(
+    process_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=10000),
+):
+    runs = await run_in_threadpool(run_history.runs, *_range(since, until), process_id, limit)
+    return Response(dumps(runs), media_type=JSON_MEDIA_TYPE)
+
+# Run totals per hour or per day, for every process or one
+@router.get("/run-history/stats", response_model=List[RunBucket])
+async def read_run_stats(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    bucket: Bucket = Bucket.hour,
+    process_id: Optional[int] = None,
+):
+    rows = await run_in_threadpool(run_history.aggregate, *_range(since, until), bucket.value, process_id)
+    return Response(dumps(rows), media_type=JSON_MEDIA_TYPE)
+
+# Task totals per hour or per day, for every process or one
+@router.get("/run-history/task-stats", response_model=List[TaskBucket])
+async def read_task_stats(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    bucket: Bucket = Bucket.hour,
+    process_id: Optional[int] = None,
+):
+    rows = await run_in_threadpool(run_history.aggregate, *_range(since, until), bucket.value, process_id, True)
+    return Response(dumps(rows), media_type=JSON_MEDIA_TYPE)
+
+# Compact finished days and drop expired partitions now rather than on the next write
+@router.post("/run-history/maintain", status_code=204)
+async def maintain_run_history():
+    await run_in_threadpool(run_history.maintain)
+    return Response(status_code=204)
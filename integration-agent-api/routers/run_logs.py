@@ -0,0 +1,110 @@
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from pydantic import BaseModel
+from models.models import IntegrationProcess
+from database import get_db
+from cache import exists
+from serialization import dumps, JSON_MEDIA_TYPE
+from run_logs import SEARCH_PATTERN_CHARS, compile_pattern, run_log_store
+import enum
+
+router = APIRouter()
+
+class LogLevel(str, enum.Enum):
+    DEBUG = "DEBUG"
+    INFO = "INFO"
+    WARNING = "WARNING"
+    ERROR = "ERROR"
+
+# Pydantic models
+class RunLogRecord(BaseModel):
+    level: LogLevel = LogLevel.INFO
+    message: str
+    run_id: Optional[str] = None
+    task_id: Optional[int] = None
+
+    class Config:
+        use_enum_values = True
+
+class RunLogEntry(RunLogRecord):
+    seq: int
+    ts: float
+
+class RunLogAppendResponse(BaseModel):
+    first_seq: int
+    last_seq: int
+
+async def _check_process(db: AsyncSession, process_id: int):
+    if not await exists(db, IntegrationProcess, process_id):
+        raise HTTPException(status_code=404, detail="Integration process not found")
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    return value.timestamp() if value is not None else None
+
+def _records_response(records: List[dict]) -> Response:
+    # Records are stored as the JSON they are served as
+    return Response(dumps(records), media_type=JSON_MEDIA_TYPE)
+
+# Append records to a process's run log
+@router.post("/integration-processes/{process_id}/logs", response_model=RunLogAppendResponse)
+async def append_run_logs(process_id: int, records: List[RunLogRecord], db: AsyncSession = Depends(get_db)):
+    await _check_process(db, process_id)
+    if not records:
+        raise HTTPException(status_code=400, detail="No log records given")
+    rows = [record.dict(exclude_none=True) for record in records]
+    seqs = await run_in_threadpool(run_log_store.append, process_id, rows)
+    return {"first_seq": seqs[0], "last_seq": seqs[-1]}
+
+# Read a process's run log in order, after a sequence number and/or within a time range
+@router.get("/integration-processes/{process_id}/logs", response_model=List[RunLogEntry])
+async def read_run_logs(
+    process_id: int,
+    after_seq: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=10000),
+    db: AsyncSession = Depends(get_db)
+):
+    await _check_process(db, process_id)
+    records = await run_in_threadpool(
+        run_log_store.read, process_id, after_seq, _timestamp(since), _timestamp(until), limit
+    )
+    return _records_response(records)
+
+# Read the last lines of a process's run log
+@router.get("/integration-processes/{process_id}/logs/tail", response_model=List[RunLogEntry])
+async def tail_run_logs(
+    process_id: int,
+    lines: int = Query(100, ge=1, le=10000),
+    db: AsyncSession = Depends(get_db)
+):
+    await _check_process(db, process_id)
+    return _records_response(await run_in_threadpool(run_log_store.tail, process_id, lines))
+
+# Search a process's run log messages for text, or a regular expression
+@router.get("/integration-processes/{process_id}/logs/search", response_model=List[RunLogEntry])
+async def search_run_logs(
+    process_id: int,
+    q: str = Query(..., min_length=1, max_length=SEARCH_PATTERN_CHARS),
+    regex: bool = False,
+    level: Optional[LogLevel] = None,
+    after_seq: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=10000),
+    db: AsyncSession = Depends(get_db)
+):
+    await _check_process(db, process_id)
+    if regex:
+        try:
+            compile_pattern(q)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+    records = await run_in_threadpool(
+        run_log_store.search, process_id, q, level.value if level else None,
+        after_seq, _timestamp(since), _timestamp(until), limit, regex
+    )
+    return _records_response(records)
@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from pydantic import BaseModel
+from database import get_db
+from search_index import search
+import enum
+
+router = APIRouter()
+
+class SearchKind(str, enum.Enum):
+    agent = "agent"
+    process = "process"
+    task = "task"
+    connector = "connector"
+    field = "field"
+
+# Pydantic models
+class SearchHit(BaseModel):
+    kind: SearchKind
+    id: int
+    parent_id: Optional[int] = None
+    process_id: Optional[int] = None
+    name: Optional[str] = None
+    snippet: str
+    rank: float
+
+# Search agents, processes, tasks, connectors and fields by name, description,
+# code, end point, queue path, query or field name, best matches first
+@router.get("/search", response_model=List[SearchHit])
+async def search_entities(
+    q: str = Query(..., min_length=1),
+    kind: Optional[List[SearchKind]] = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db)
+):
+    return await search(db, q, [item.value for item in kind] if kind else None, limit)
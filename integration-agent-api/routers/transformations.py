@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from pydantic import BaseModel
 from models.models import Transformation, ConditionType, Field, ProcessTask
-from database import get_db
+from database import get_db, commit_write
+from serialization import RowSerializer, list_response
+from cache import exists
+from versions import conditional_get
+from bulk import ensure_exist
 
 router = APIRouter()
 
@@ -26,137 +31,138 @@ class TransformationResponse(TransformationBase):
     class Config:
         orm_mode = True
 
+transformations_serializer = RowSerializer(TransformationResponse, Transformation)
+
 # Create a Transformation
 @router.post("/transformations/", response_model=TransformationResponse)
-def create_transformation(transformation: TransformationCreate, db: Session = Depends(get_db)):
+async def create_transformation(transformation: TransformationCreate, db: AsyncSession = Depends(get_db)):
     # Verify that process task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == transformation.process_task_id).first()
-    if not task:
+    if not await exists(db, ProcessTask, transformation.process_task_id):
         raise HTTPException(status_code=404, detail="Process task not found")
     
     # Verify that fields exist
-    c_field = db.query(Field).filter(Field.id == transformation.c_field_id).first()
-    if not c_field:
+    if not await exists(db, Field, transformation.c_field_id):
         raise HTTPException(status_code=404, detail="Condition field not found")
     
-    v_field = db.query(Field).filter(Field.id == transformation.v_field_id).first()
-    if not v_field:
+    if not await exists(db, Field, transformation.v_field_id):
         raise HTTPException(status_code=404, detail="Value field not found")
     
-    db_transformation = Transformation(**transformation.dict())
-    db.add(db_transformation)
-    db.commit()
-    db.refresh(db_transformation)
-    return db_transformation
+    async def apply(session: AsyncSession):
+        db_transformation = Transformation(**transformation.dict())
+        session.add(db_transformation)
+        await session.flush()
+        return db_transformation
+    
+    return await commit_write(db, apply)
 
 # Read all Transformations
 @router.get("/transformations/", response_model=List[TransformationResponse])
-def read_transformations(
+async def read_transformations(
+    request: Request,
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
     process_task_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    query = db.query(Transformation)
+    await conditional_get(request, response, db, "transformations")
+    query = select(Transformation)
     
     # Filter by process task if specified
     if process_task_id:
         query = query.filter(Transformation.process_task_id == process_task_id)
         
-    transformations = query.offset(skip).limit(limit).all()
-    return transformations
+    return await list_response(
+        request, response, db, query, transformations_serializer, Transformation.id, limit=limit, after=after, skip=skip
+    )
 
 # Read a single Transformation by ID
 @router.get("/transformations/{transformation_id}", response_model=TransformationResponse)
-def read_transformation(transformation_id: int, db: Session = Depends(get_db)):
-    transformation = db.query(Transformation).filter(Transformation.id == transformation_id).first()
+async def read_transformation(transformation_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    await conditional_get(request, response, db, "transformations")
+    transformation = await db.scalar(select(Transformation).filter(Transformation.id == transformation_id))
     if transformation is None:
         raise HTTPException(status_code=404, detail="Transformation not found")
     return transformation
 
 # Update a Transformation
 @router.put("/transformations/{transformation_id}", response_model=TransformationResponse)
-def update_transformation(transformation_id: int, updated_transformation: TransformationCreate, db: Session = Depends(get_db)):
+async def update_transformation(transformation_id: int, updated_transformation: TransformationCreate, db: AsyncSession = Depends(get_db)):
     # Verify transformation exists
-    transformation = db.query(Transformation).filter(Transformation.id == transformation_id).first()
-    if transformation is None:
+    if not await exists(db, Transformation, transformation_id):
         raise HTTPException(status_code=404, detail="Transformation not found")
     
     # Verify that process task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == updated_transformation.process_task_id).first()
-    if not task:
+    if not await exists(db, ProcessTask, updated_transformation.process_task_id):
         raise HTTPException(status_code=404, detail="Process task not found")
     
     # Verify that fields exist
-    c_field = db.query(Field).filter(Field.id == updated_transformation.c_field_id).first()
-    if not c_field:
+    if not await exists(db, Field, updated_transformation.c_field_id):
         raise HTTPException(status_code=404, detail="Condition field not found")
     
-    v_field = db.query(Field).filter(Field.id == updated_transformation.v_field_id).first()
-    if not v_field:
+    if not await exists(db, Field, updated_transformation.v_field_id):
         raise HTTPException(status_code=404, detail="Value field not found")
     
-    # Update attributes
-    for key, value in updated_transformation.dict().items():
-        setattr(transformation, key, value)
+    async def apply(session: AsyncSession):
+        transformation = await session.get(Transformation, transformation_id)
+        if transformation is None:
+            raise HTTPException(status_code=404, detail="Transformation not found")
+        
+        # Update attributes
+        for key, value in updated_transformation.dict().items():
+            setattr(transformation, key, value)
+        return transformation
     
-    db.commit()
-    db.refresh(transformation)
-    return transformation
+    return await commit_write(db, apply)
 
 # Delete a Transformation
 @router.delete("/transformations/{transformation_id}", response_model=TransformationResponse)
-def delete_transformation(transformation_id: int, db: Session = Depends(get_db)):
-    transformation = db.query(Transformation).filter(Transformation.id == transformation_id).first()
-    if transformation is None:
-        raise HTTPException(status_code=404, detail="Transformation not found")
+async def delete_transformation(transformation_id: int, db: AsyncSession = Depends(get_db)):
+    async def apply(session: AsyncSession):
+        transformation = await session.get(Transformation, transformation_id)
+        if transformation is None:
+            raise HTTPException(status_code=404, detail="Transformation not found")
+        
+        await session.delete(transformation)
+        return transformation
     
-    db.delete(transformation)
-    db.commit()
-    return transformation
+    return await commit_write(db, apply)
 
 # Get transformations for a specific task
 @router.get("/process-tasks/{task_id}/transformations", response_model=List[TransformationResponse])
-def get_transformations_for_task(task_id: int, db: Session = Depends(get_db)):
+async def get_transformations_for_task(task_id: int, db: AsyncSession = Depends(get_db)):
     # Verify task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
+    task = await db.scalar(select(ProcessTask).filter(ProcessTask.id == task_id))
     if task is None:
         raise HTTPException(status_code=404, detail="Process task not found")
     
-    transformations = db.query(Transformation).filter(Transformation.process_task_id == task_id).all()
+    transformations = (await db.scalars(select(Transformation).filter(Transformation.process_task_id == task_id))).all()
     return transformations
 
 # Bulk create transformations for a task
 @router.post("/process-tasks/{task_id}/transformations", response_model=List[TransformationResponse])
-def create_transformations_for_task(task_id: int, transformations: List[TransformationCreate], db: Session = Depends(get_db)):
+async def create_transformations_for_task(task_id: int, transformations: List[TransformationCreate], db: AsyncSession = Depends(get_db)):
     # Verify task exists
-    task = db.query(ProcessTask).filter(ProcessTask.id == task_id).first()
+    task = await db.scalar(select(ProcessTask).filter(ProcessTask.id == task_id))
     if task is None:
         raise HTTPException(status_code=404, detail="Process task not found")
     
-    db_transformations = []
-    for transformation_data in transformations:
-        # Ensure task_id in request matches URL parameter
-        if transformation_data.process_task_id != task_id:
-            raise HTTPException(status_code=400, detail="Transformation task ID must match the task ID in the URL")
-        
-        # Verify that fields exist
-        c_field = db.query(Field).filter(Field.id == transformation_data.c_field_id).first()
-        if not c_field:
-            raise HTTPException(status_code=404, detail=f"Condition field with ID {transformation_data.c_field_id} not found")
-        
-        v_field = db.query(Field).filter(Field.id == transformation_data.v_field_id).first()
-        if not v_field:
-            raise HTTPException(status_code=404, detail=f"Value field with ID {transformation_data.v_field_id} not found")
-        
-        db_transformation = Transformation(**transformation_data.dict())
-        db.add(db_transformation)
-        db_transformations.append(db_transformation)
+    # Ensure task_id in request matches URL parameter
+    if any(transformation_data.process_task_id != task_id for transformation_data in transformations):
+        raise HTTPException(status_code=400, detail="Transformation task ID must match the task ID in the URL")
     
-    db.commit()
+    # Verify that all referenced fields exist with a single query
+    await ensure_exist(
+        db, Field.id,
+        [field_id for transformation_data in transformations for field_id in (transformation_data.c_field_id, transformation_data.v_field_id)],
+        "Field not found"
+    )
     
-    # Refresh all transformations
-    for transformation in db_transformations:
-        db.refresh(transformation)
+    async def apply(session: AsyncSession):
+        db_transformations = [Transformation(**transformation_data.dict()) for transformation_data in transformations]
+        session.add_all(db_transformations)
+        await session.flush()
+        return db_transformations
     
-    return db_transformations 
\ No newline at end of file
+    return await commit_write(db, apply) 
\ No newline at end of file
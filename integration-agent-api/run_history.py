@@ -0,0 +1,305 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+RUN_HISTORY_DIR = os.getenv("INTEGRATION_AGENT_RUN_HISTORY_DIR", "run_history")
+# Per-run and per-task detail is kept this many days, hourly rollups this
+# many months; daily rollups are kept for good
+DETAIL_DAYS = int(os.getenv("INTEGRATION_AGENT_RUN_DETAIL_DAYS", "7"))
+HOURLY_MONTHS = int(os.getenv("INTEGRATION_AGENT_RUN_HOURLY_MONTHS", "3"))
+# Open partition files kept around between calls
+MAX_OPEN_PARTITIONS = 8
+
+DETAIL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    process_id INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    status TEXT NOT NULL,
+    duration_ms REAL NOT NULL DEFAULT 0,
+    records INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_runs_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS ix_runs_process_started_at ON runs (process_id, started_at);
+CREATE TABLE IF NOT EXISTS task_metrics (
+    run_id TEXT NOT NULL,
+    process_id INTEGER NOT NULL,
+    task_id INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    duration_ms REAL NOT NULL DEFAULT 0,
+    records_in INTEGER NOT NULL DEFAULT 0,
+    records_out INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_task_metrics_started_at ON task_metrics (started_at);
+"""
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS run_rollups (
+    bucket REAL NOT NULL,
+    process_id INTEGER NOT NULL,
+    runs INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    duration_ms_total REAL NOT NULL,
+    duration_ms_max REAL NOT NULL,
+    records INTEGER NOT NULL,
+    PRIMARY KEY (bucket, process_id)
+);
+CREATE TABLE IF NOT EXISTS task_rollups (
+    bucket REAL NOT NULL,
+    process_id INTEGER NOT NULL,
+    task_id INTEGER NOT NULL,
+    executions INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    duration_ms_total REAL NOT NULL,
+    duration_ms_max REAL NOT NULL,
+    records_in INTEGER NOT NULL,
+    records_out INTEGER NOT NULL,
+    PRIMARY KEY (bucket, process_id, task_id)
+);
+CREATE TABLE IF NOT EXISTS compacted_days (day TEXT PRIMARY KEY);
+"""
+
+BUCKET_SECONDS = {"hour": 3600, "day": 86400}
+
+# Detail rows grouped into buckets, shared by compaction and by queries
+# over days that are not compacted yet
+RUN_ROLLUP_QUERY = """
+SELECT started_at - started_at % :size AS bucket, process_id, COUNT(*), SUM(status = 'Error'),
+       SUM(duration_ms), MAX(duration_ms), SUM(records)
+FROM runs WHERE started_at >= :since AND started_at < :until {process_filter}
+GROUP BY bucket, process_id
+"""
+TASK_ROLLUP_QUERY = """
+SELECT started_at - started_at % :size AS bucket, process_id, task_id, COUNT(*), SUM(errors),
+       SUM(duration_ms), MAX(duration_ms), SUM(records_in), SUM(records_out)
+FROM task_metrics WHERE started_at >= :since AND started_at < :until {process_filter}
+GROUP BY bucket, process_id, task_id
+"""
+RUN_COLUMNS = ["bucket", "process_id", "runs", "failed", "duration_ms_total", "duration_ms_max", "records"]
+TASK_COLUMNS = [
+    "bucket", "process_id", "task_id", "executions", "errors",
+    "duration_ms_total", "duration_ms_max", "records_in", "records_out",
+]
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%d")
+
+def _day_start(day: str) -> float:
+    return datetime.strptime(day, "%Y%m%d").replace(tzinfo=timezone.utc).timestamp()
+
+def _days(since: float, until: float) -> List[str]:
+    days = []
+    current = datetime.fromtimestamp(since, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    while current.timestamp() < until:
+        days.append(current.strftime("%Y%m%d"))
+        current += timedelta(days=1)
+    return days
+
+class RunHistoryStore:
+    """Run and task metrics partitioned by time into SQLite files.
+
+    Detail goes to one file per UTC day. Once a day is over it is compacted
+    into hourly rollups, one file per month, and daily rollups in a single
+    small file. Expired partitions are removed by deleting their file, so
+    retention costs the same however much history there is, and a query
+    over the last hour only opens today's file.
+    """
+
+    def __init__(self, root: str, detail_days: int = DETAIL_DAYS, hourly_months: int = HOURLY_MONTHS):
+        self.root = root
+        self.detail_days = detail_days
+        self.hourly_months = hourly_months
+        self._connections: "OrderedDict[str, sqlite3.Connection]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._maintained_day: Optional[str] = None
+        self.dropped_partitions = 0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, f"{name}.db")
+
+    def _connect(self, name: str, create: bool = True) -> Optional[sqlite3.Connection]:
+        connection = self._connections.get(name)
+        if connection is not None:
+            self._connections.move_to_end(name)
+            return connection
+        path = self._path(name)
+        if not create and not os.path.exists(path):
+            return None
+        # Made with the first write, so importing the module creates nothing
+        os.makedirs(self.root, exist_ok=True)
+        connection = sqlite3.connect(path, check_same_thread=False)
+        connection.executescript(DETAIL_SCHEMA if name.startswith("detail-") else ROLLUP_SCHEMA)
+        self._connections[name] = connection
+        while len(self._connections) > MAX_OPEN_PARTITIONS:
+            self._connections.popitem(last=False)[1].close()
+        return connection
+
+    def _drop(self, name: str):
+        connection = self._connections.pop(name, None)
+        if connection is not None:
+            connection.close()
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            if os.path.exists(self._path(name) + suffix):
+                os.remove(self._path(name) + suffix)
+        self.dropped_partitions += 1
+
+    def _partitions(self, prefix: str) -> List[str]:
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-3] for name in names if name.startswith(prefix) and name.endswith(".db"))
+
+    def record_run(self, run: dict, tasks: Optional[List[dict]] = None, now: Optional[float] = None):
+        """Store a finished run and the metrics of its tasks.
+
+        Runs older than the detail retention are refused, because their day
+        has already been compacted and its detail dropped.
+        """
+        now = time.time() if now is None else now
+        day = _day(run["started_at"])
+        if run["started_at"] < _day_start(_day(now)) - self.detail_days * 86400:
+            raise ValueError("Run is older than the run history detail retention")
+
+        with self._lock:
+            self._maintain(now)
+            connection = self._connect(f"detail-{day}")
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO runs VALUES (:run_id, :process_id, :started_at, :finished_at, :status, :duration_ms, :records)",
+                    {"finished_at": None, "duration_ms": 0, "records": 0, **run},
+                )
+                connection.executemany(
+                    "INSERT INTO task_metrics VALUES (:run_id, :process_id, :task_id, :started_at, :duration_ms, :records_in, :records_out, :errors)",
+                    [
+                        {"duration_ms": 0, "records_in": 0, "records_out": 0, "errors": 0, "started_at": run["started_at"],
+                         **task, "run_id": run["run_id"], "process_id": run["process_id"]}
+                        for task in tasks or []
+                    ],
+                )
+            # A late run reopens a day that was already rolled up
+            if day != _day(now):
+                self._connect("daily").execute("DELETE FROM compacted_days WHERE day = ?", (day,))
+                self._connect("daily").commit()
+
+    def maintain(self, now: Optional[float] = None):
+        """Compact finished days and drop expired partitions."""
+        with self._lock:
+            self._maintained_day = None
+            self._maintain(time.time() if now is None else now)
+
+    def _maintain(self, now: float):
+        # Runs on the first call of each UTC day, and on request
+        today = _day(now)
+        if self._maintained_day == today:
+            return
+        daily = self._connect("daily")
+        compacted = {row[0] for row in daily.execute("SELECT day FROM compacted_days")}
+        for name in self._partitions("detail-"):
+            day = name[len("detail-"):]
+            if day < today and day not in compacted:
+                self._compact(day)
+
+        oldest_detail = (datetime.strptime(today, "%Y%m%d") - timedelta(days=self.detail_days)).strftime("%Y%m%d")
+        for name in self._partitions("detail-"):
+            if name[len("detail-"):] < oldest_detail:
+                self._drop(name)
+        current = datetime.strptime(today, "%Y%m%d")
+        oldest_month = current.year * 12 + current.month - 1 - self.hourly_months
+        for name in self._partitions("hourly-"):
+            year, month = int(name[-6:-2]), int(name[-2:])
+            if year * 12 + month - 1 < oldest_month:
+                self._drop(name)
+        self._maintained_day = today
+
+    def _compact(self, day: str):
+        detail = self._connect(f"detail-{day}")
+        start = _day_start(day)
+        parameters = {"since": start, "until": start + 86400}
+        for target, size in ((f"hourly-{day[:6]}", 3600), ("daily", 86400)):
+            connection = self._connect(target)
+            run_rows = detail.execute(RUN_ROLLUP_QUERY.format(process_filter=""), {**parameters, "size": size}).fetchall()
+            task_rows = detail.execute(TASK_ROLLUP_QUERY.format(process_filter=""), {**parameters, "size": size}).fetchall()
+            with connection:
+                connection.executemany(f"INSERT OR REPLACE INTO run_rollups VALUES ({', '.join('?' * len(RUN_COLUMNS))})", run_rows)
+                connection.executemany(f"INSERT OR REPLACE INTO task_rollups VALUES ({', '.join('?' * len(TASK_COLUMNS))})", task_rows)
+        daily = self._connect("daily")
+        with daily:
+            daily.execute("INSERT OR IGNORE INTO compacted_days VALUES (?)", (day,))
+
+    def runs(self, since: float, until: float, process_id: Optional[int] = None, limit: int = 100) -> List[dict]:
+        """Detail of the runs started in [since, until), newest first."""
+        columns = ["run_id", "process_id", "started_at", "finished_at", "status", "duration_ms", "records"]
+        query = "SELECT * FROM runs WHERE started_at >= ? AND started_at < ?"
+        parameters = [since, until]
+        if process_id is not None:
+            query += " AND process_id = ?"
+            parameters.append(process_id)
+        query += " ORDER BY started_at DESC LIMIT ?"
+
+        rows = []
+        with self._lock:
+            for day in reversed(_days(since, until)):
+                connection = self._connect(f"detail-{day}", create=False)
+                if connection is None:
+                    continue
+                rows.extend(connection.execute(query, parameters + [limit - len(rows)]).fetchall())
+                if len(rows) >= limit:
+                    break
+        return [dict(zip(columns, row)) for row in rows]
+
+    def aggregate(
+        self,
+        since: float,
+        until: float,
+        bucket: str = "hour",
+        process_id: Optional[int] = None,
+        tasks: bool = False,
+    ) -> List[dict]:
+        """Per-bucket run (or task) totals over [since, until).
+
+        Compacted days are read from the rollups, the others are grouped
+        from their detail partition on the fly.
+        """
+        size = BUCKET_SECONDS[bucket]
+        since -= since % size
+        table, query, columns = (
+            ("task_rollups", TASK_ROLLUP_QUERY, TASK_COLUMNS) if tasks else ("run_rollups", RUN_ROLLUP_QUERY, RUN_COLUMNS)
+        )
+        detail_query = query.format(process_filter="AND process_id = :process_id" if process_id is not None else "")
+        rollup_query = f"SELECT * FROM {table} WHERE bucket >= :since AND bucket < :until"
+        if process_id is not None:
+            rollup_query += " AND process_id = :process_id"
+
+        rows = []
+        with self._lock:
+            compacted = {row[0] for row in self._connect("daily").execute("SELECT day FROM compacted_days")}
+            for day in _days(since, until):
+                start = _day_start(day)
+                parameters = {"since": max(since, start), "until": min(until, start + 86400), "size": size, "process_id": process_id}
+                if day in compacted:
+                    connection = self._connect(f"hourly-{day[:6]}" if bucket == "hour" else "daily", create=False)
+                    if connection is not None:
+                        rows.extend(connection.execute(rollup_query, parameters).fetchall())
+                else:
+                    connection = self._connect(f"detail-{day}", create=False)
+                    if connection is not None:
+                        rows.extend(connection.execute(detail_query, parameters).fetchall())
+        return sorted((dict(zip(columns, row)) for row in rows), key=lambda row: (row["bucket"], row["process_id"], row.get("task_id", 0)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "detail_partitions": len(self._partitions("detail-")),
+                "hourly_partitions": len(self._partitions("hourly-")),
+                "open_partitions": len(self._connections),
+                "dropped_partitions": self.dropped_partitions,
+            }
+
+run_history = RunHistoryStore(RUN_HISTORY_DIR)
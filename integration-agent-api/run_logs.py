@@ -0,0 +1,381 @@
+import json
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python before 3.11
+    import sre_parse
+
+RUN_LOG_DIR = os.getenv("INTEGRATION_AGENT_RUN_LOG_DIR", "run_logs")
+# A segment is sealed once it reaches either limit
+SEGMENT_BYTES = int(os.getenv("INTEGRATION_AGENT_RUN_LOG_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+SEGMENT_SECONDS = float(os.getenv("INTEGRATION_AGENT_RUN_LOG_SEGMENT_SECONDS", "3600"))
+# Sealed segments are dropped oldest first beyond either limit, per process
+RETENTION_BYTES = int(os.getenv("INTEGRATION_AGENT_RUN_LOG_RETENTION_BYTES", str(256 * 1024 * 1024)))
+RETENTION_SECONDS = float(os.getenv("INTEGRATION_AGENT_RUN_LOG_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# One index entry per this many bytes of log, so a seek reads at most this
+# much before reaching the wanted record
+INDEX_INTERVAL_BYTES = 4096
+
+# A search stops after matching this many bytes of messages, looks at only
+# the first SEARCH_MESSAGE_CHARS of each message, and a regular expression
+# may be at most SEARCH_PATTERN_CHARS long without nested repeats, so one
+# request cannot hold a worker thread for long
+SEARCH_SCAN_BYTES = int(os.getenv("INTEGRATION_AGENT_RUN_LOG_SEARCH_SCAN_BYTES", str(64 * 1024 * 1024)))
+SEARCH_MESSAGE_CHARS = int(os.getenv("INTEGRATION_AGENT_RUN_LOG_SEARCH_MESSAGE_CHARS", "4096"))
+SEARCH_PATTERN_CHARS = 256
+
+REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+
+# Sequence number, timestamp and byte offset of an indexed record
+INDEX_ENTRY = struct.Struct("<qdq")
+
+def _subpatterns(value) -> Iterator:
+    if isinstance(value, sre_parse.SubPattern):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _subpatterns(item)
+
+def _nested_repeat(pattern, repeated: bool = False) -> bool:
+    # An unbounded repeat inside another repeat, such as (a+)+ or (a|b*)*,
+    # can backtrack exponentially on a message that almost matches
+    for op, value in pattern:
+        if op in REPEATS:
+            low, high, body = value
+            if repeated and high == sre_parse.MAXREPEAT:
+                return True
+            if _nested_repeat(body, repeated or high > 1):
+                return True
+        elif any(_nested_repeat(subpattern, repeated) for subpattern in _subpatterns(value)):
+            return True
+    return False
+
+def compile_pattern(text: str) -> re.Pattern:
+    """Compile a search pattern, raising ValueError for ones that are invalid,
+    too long or prone to catastrophic backtracking."""
+    if len(text) > SEARCH_PATTERN_CHARS:
+        raise ValueError(f"Search patterns are limited to {SEARCH_PATTERN_CHARS} characters")
+    try:
+        pattern = re.compile(text)
+    except re.error as error:
+        raise ValueError(f"Invalid search pattern: {error}")
+    if _nested_repeat(sre_parse.parse(text)):
+        raise ValueError("Search patterns must not nest repeats such as (a+)+")
+    return pattern
+
+class Segment:
+    """One append-only file of JSON lines and its sparse index file.
+
+    Files are named after the first sequence number they hold, so the
+    segments of a process sort by name and never need to be opened to be
+    found.
+    """
+
+    def __init__(self, directory: str, base_seq: int):
+        self.base_seq = base_seq
+        self.log_path = os.path.join(directory, f"{base_seq:020d}.log")
+        self.index_path = os.path.join(directory, f"{base_seq:020d}.idx")
+        self.index: List[Tuple[int, float, int]] = []
+        self.size = 0
+        self.last_seq = base_seq - 1
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+
+    @classmethod
+    def open(cls, directory: str, base_seq: int) -> "Segment":
+        segment = cls(directory, base_seq)
+        with open(segment.log_path, "rb+") as log:
+            size = log.seek(0, os.SEEK_END)
+            # Drop a record cut short by a crash
+            if size:
+                log.seek(max(0, size - 1))
+                if log.read(1) != b"\n":
+                    log.seek(0)
+                    size = log.read().rfind(b"\n") + 1
+                    log.truncate(size)
+        segment.size = size
+        if os.path.exists(segment.index_path):
+            with open(segment.index_path, "rb") as index:
+                data = index.read()
+            entries = [INDEX_ENTRY.unpack_from(data, offset) for offset in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size)]
+            segment.index = [entry for entry in entries if entry[2] < size]
+            if len(segment.index) != len(entries):
+                with open(segment.index_path, "wb") as index:
+                    index.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in segment.index))
+        # Only the records after the last index entry need reading
+        for record in segment.records(segment.index[-1][2] if segment.index else 0, size):
+            if segment.first_ts is None:
+                segment.first_ts = record["ts"]
+            segment.last_seq, segment.last_ts = record["seq"], record["ts"]
+        if segment.index:
+            segment.first_ts = segment.index[0][1]
+        return segment
+
+    def records(self, offset: int, end: int) -> Iterator[dict]:
+        """Decode the records between two byte offsets."""
+        with open(self.log_path, "rb") as log:
+            log.seek(offset)
+            position = offset
+            for line in log:
+                position += len(line)
+                if position > end:
+                    return
+                yield json.loads(line)
+
+    def seek_seq(self, seq: int) -> int:
+        position = bisect_right(self.index, seq, key=lambda entry: entry[0]) - 1
+        return self.index[position][2] if position >= 0 else 0
+
+    def seek_ts(self, ts: float) -> int:
+        position = bisect_left(self.index, ts, key=lambda entry: entry[1]) - 1
+        return self.index[position][2] if position >= 0 else 0
+
+class ProcessLog:
+    """The segments of one process; appends are serialized by its lock."""
+
+    def __init__(self, store: "RunLogStore", directory: str):
+        self.store = store
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        bases = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith(".log"))
+        self.segments = [Segment.open(directory, base) for base in bases]
+        with self.lock:
+            self._enforce_retention(time.time())
+
+    @property
+    def next_seq(self) -> int:
+        return self.segments[-1].last_seq + 1 if self.segments else 1
+
+    def append(self, records: List[dict]) -> List[int]:
+        with self.lock:
+            now = time.time()
+            segment = self.segments[-1] if self.segments else None
+            if (
+                segment is None
+                or segment.size >= self.store.segment_bytes
+                or (segment.first_ts is not None and now - segment.first_ts >= self.store.segment_seconds)
+            ):
+                segment = Segment(self.directory, self.next_seq)
+                self.segments.append(segment)
+                self._enforce_retention(now)
+
+            # Timestamps never go backwards within a process, which is what
+            # lets the time index be searched by bisection
+            ts = max([now] + [previous.last_ts for previous in self.segments[-2:] if previous.last_ts is not None])
+            lines = []
+            entries = []
+            offset = segment.size
+            last_indexed = segment.index[-1][2] if segment.index else None
+            seqs = []
+            for record in records:
+                seq = segment.last_seq + 1 + len(seqs)
+                line = json.dumps({"seq": seq, "ts": ts, **record}, separators=(",", ":")).encode() + b"\n"
+                if last_indexed is None or offset - last_indexed >= INDEX_INTERVAL_BYTES:
+                    entries.append((seq, ts, offset))
+                    last_indexed = offset
+                lines.append(line)
+                seqs.append(seq)
+                offset += len(line)
+
+            with open(segment.log_path, "ab") as log:
+                log.write(b"".join(lines))
+            if entries:
+                with open(segment.index_path, "ab") as index:
+                    index.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in entries))
+
+            # Publish the new records to readers only once they are on disk
+            segment.index.extend(entries)
+            if segment.first_ts is None:
+                segment.first_ts = ts
+            segment.last_seq, segment.last_ts = seqs[-1], ts
+            segment.size = offset
+            return seqs
+
+    def _enforce_retention(self, now: float):
+        # Whole segments go at once, the active one is always kept
+        total = sum(segment.size for segment in self.segments)
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            expired = oldest.last_ts is not None and now - oldest.last_ts > self.store.retention_seconds
+            if not expired and total <= self.store.retention_bytes:
+                break
+            for path in (oldest.log_path, oldest.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= oldest.size
+            self.segments.pop(0)
+
+    def scan(
+        self,
+        after_seq: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> Iterator[dict]:
+        """Yield records after after_seq and within [since, until], in order.
+
+        The start is found by bisecting segment names and then the sparse
+        index of one segment, so only the wanted range is read.
+        """
+        with self.lock:
+            segments = [(segment, segment.size) for segment in self.segments]
+        if not segments:
+            return
+
+        start = 0
+        if after_seq is not None:
+            start = max(0, bisect_right(segments, after_seq + 1, key=lambda item: item[0].base_seq) - 1)
+        if since is not None:
+            start = max(start, bisect_left(segments, since, key=lambda item: item[0].last_ts or float("inf")))
+
+        for position in range(start, len(segments)):
+            segment, end = segments[position]
+            if until is not None and segment.first_ts is not None and segment.first_ts > until:
+                return
+            offset = 0
+            if position == start:
+                offset = max(
+                    segment.seek_seq(after_seq + 1) if after_seq is not None else 0,
+                    segment.seek_ts(since) if since is not None else 0,
+                )
+            try:
+                for record in segment.records(offset, end):
+                    if after_seq is not None and record["seq"] <= after_seq:
+                        continue
+                    if since is not None and record["ts"] < since:
+                        continue
+                    if until is not None and record["ts"] > until:
+                        return
+                    yield record
+            except FileNotFoundError:
+                # Removed by retention after the snapshot was taken
+                continue
+
+class RunLogStore:
+    """Append-only run logs, one directory of segments per process."""
+
+    def __init__(
+        self,
+        root: str,
+        segment_bytes: int = SEGMENT_BYTES,
+        segment_seconds: float = SEGMENT_SECONDS,
+        retention_bytes: int = RETENTION_BYTES,
+        retention_seconds: float = RETENTION_SECONDS,
+    ):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.retention_bytes = retention_bytes
+        self.retention_seconds = retention_seconds
+        self._logs: Dict[int, ProcessLog] = {}
+        self._lock = threading.Lock()
+
+    def _log(self, process_id: int, create: bool = False) -> Optional[ProcessLog]:
+        with self._lock:
+            log = self._logs.get(process_id)
+            if log is None:
+                directory = os.path.join(self.root, str(process_id))
+                if not create and not os.path.isdir(directory):
+                    return None
+                log = self._logs[process_id] = ProcessLog(self, directory)
+            return log
+
+    def append(self, process_id: int, records: List[dict]) -> List[int]:
+        """Append records and return the sequence numbers given to them."""
+        if not records:
+            return []
+        return self._log(process_id, create=True).append(records)
+
+    def read(
+        self,
+        process_id: int,
+        after_seq: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 100,
+        match: Optional[Callable[[dict], bool]] = None,
+    ) -> List[dict]:
+        log = self._log(process_id)
+        if log is None:
+            return []
+        records = []
+        for record in log.scan(after_seq, since, until):
+            if match is None or match(record):
+                records.append(record)
+                if len(records) >= limit:
+                    break
+        return records
+
+    def tail(self, process_id: int, lines: int = 100) -> List[dict]:
+        log = self._log(process_id)
+        if log is None:
+            return []
+        return self.read(process_id, after_seq=max(0, log.next_seq - 1 - lines), limit=lines)
+
+    def search(
+        self,
+        process_id: int,
+        text: str,
+        level: Optional[str] = None,
+        after_seq: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 100,
+        regex: bool = False,
+        scan_bytes: int = SEARCH_SCAN_BYTES,
+    ) -> List[dict]:
+        """Records whose message contains text, or matches it as a regular
+        expression when regex is set.
+
+        Only the range selected by after_seq, since and until is read, only
+        the first SEARCH_MESSAGE_CHARS of each message are searched, and the
+        scan stops once scan_bytes of messages have been looked at.
+        """
+        if regex:
+            contains = compile_pattern(text).search
+        else:
+            contains = lambda message: text in message
+        log = self._log(process_id)
+        if log is None:
+            return []
+        records = []
+        for record in log.scan(after_seq, since, until):
+            message = (record.get("message") or "")[:SEARCH_MESSAGE_CHARS]
+            scan_bytes -= len(message)
+            if (level is None or record.get("level") == level) and contains(message):
+                records.append(record)
+                if len(records) >= limit:
+                    break
+            if scan_bytes <= 0:
+                break
+        return records
+
+    def drop(self, process_id: int):
+        """Delete every log of a process, for when the process is deleted."""
+        with self._lock:
+            log = self._logs.pop(process_id, None)
+            directory = os.path.join(self.root, str(process_id))
+        if log is not None:
+            with log.lock:
+                shutil.rmtree(directory, ignore_errors=True)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            logs = list(self._logs.values())
+        return {
+            "open_processes": len(logs),
+            "segments": sum(len(log.segments) for log in logs),
+            "bytes": sum(segment.size for log in logs for segment in log.segments),
+        }
+
+run_log_store = RunLogStore(RUN_LOG_DIR)
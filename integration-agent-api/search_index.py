@@ -0,0 +1,133 @@
+import re
+from typing import List, Optional
+
+from sqlalchemy import event, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Base
+from models.models import ProcessTask
+
+# Each entity kind indexed: its code, table, and the SQL of its parent id
+# and three searchable columns, with {row} standing for the row (new. in
+# triggers). Rows are keyed by rowid = id * 8 + code, so a trigger reaches
+# the row of an entity through the rowid instead of scanning.
+SEARCH_KINDS = {
+    "agent": (1, "integration_agents", "NULL", "{row}name", "NULL", "{row}code"),
+    "process": (2, "integration_processes", "{row}integration_agent_id", "{row}name", "{row}description", "{row}trigger_type"),
+    "task": (3, "process_tasks", "{row}integration_process_id", "{row}task_name", "{row}description", "{row}type"),
+    "connector": (
+        4, "connectors", "{row}process_task_id", "{row}connector_type", "NULL",
+        " || ' ' || ".join(
+            f"coalesce({{row}}{column}, '')"
+            for column in ("end_point", "queue_path", "query", "email", "from_email", "subject", "response_tag")
+        ),
+    ),
+    "field": (5, "fields", "{row}process_task_id", "{row}field_name", "NULL", "NULL"),
+}
+KIND_BITS = 8
+
+# prefix='2 3' keeps short prefix queries on the index too
+CREATE_SEARCH_INDEX = (
+    "CREATE VIRTUAL TABLE search_index USING fts5("
+    "kind UNINDEXED, entity_id UNINDEXED, parent_id UNINDEXED, name, description, detail, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+def _values(kind: str, row: str) -> str:
+    code, _, *columns = SEARCH_KINDS[kind]
+    return ", ".join(
+        [f"{row}id * {KIND_BITS} + {code}", f"'{kind}'", f"{row}id"] + [column.format(row=row) for column in columns]
+    )
+
+def _triggers(kind: str) -> List[str]:
+    code, table = SEARCH_KINDS[kind][:2]
+    insert = f"INSERT INTO search_index (rowid, kind, entity_id, parent_id, name, description, detail) VALUES ({_values(kind, 'new.')});"
+    delete = f"DELETE FROM search_index WHERE rowid = old.id * {KIND_BITS} + {code};"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS search_{table}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS search_{table}_update AFTER UPDATE ON {table} BEGIN {delete} {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS search_{table}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+    ]
+
+def create_search_index(connection: Connection):
+    """Create the full-text index and its triggers, and fill it once.
+
+    Triggers keep it in sync with every write, bulk statements and raw SQL
+    included. Does nothing if the index already exists.
+    """
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+    ).scalar()
+    if exists:
+        return
+    connection.exec_driver_sql(CREATE_SEARCH_INDEX)
+    for kind in SEARCH_KINDS:
+        connection.exec_driver_sql(
+            f"INSERT INTO search_index (rowid, kind, entity_id, parent_id, name, description, detail) "
+            f"SELECT {_values(kind, '')} FROM {SEARCH_KINDS[kind][1]}"
+        )
+        for trigger in _triggers(kind):
+            connection.exec_driver_sql(trigger)
+
+def drop_search_index(connection: Connection):
+    for kind in SEARCH_KINDS:
+        for action in ("insert", "update", "delete"):
+            connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS search_{SEARCH_KINDS[kind][1]}_{action}")
+    connection.exec_driver_sql("DROP TABLE IF EXISTS search_index")
+
+# create_all builds a new database from the models, so it builds the index too
+event.listen(Base.metadata, "after_create", lambda target, connection, **kw: create_search_index(connection))
+event.listen(Base.metadata, "before_drop", lambda target, connection, **kw: drop_search_index(connection))
+
+def match_expression(query: str) -> Optional[str]:
+    """Turn free text into an FTS5 query matching every word as a prefix.
+
+    Words are quoted so FTS5 operators and punctuation in end points or
+    paths are searched for, never interpreted.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+# Names weigh most, then descriptions, then end points, queries and codes
+SEARCH_QUERY = """
+SELECT kind, entity_id, parent_id, name, snippet(search_index, -1, '[', ']', '...', 10) AS snippet,
+       bm25(search_index, 0, 0, 0, 10.0, 4.0, 1.0) AS rank
+FROM search_index
+WHERE search_index MATCH :match {kind_filter}
+ORDER BY rank
+LIMIT :limit
+"""
+
+async def search(db: AsyncSession, query: str, kinds: Optional[List[str]] = None, limit: int = 50) -> List[dict]:
+    """Entities matching query, best first, each with the process it belongs to."""
+    match = match_expression(query)
+    if match is None:
+        return []
+    parameters = {"match": match, "limit": limit}
+    kind_filter = ""
+    if kinds:
+        kind_filter = "AND kind IN (" + ", ".join(f":kind_{i}" for i in range(len(kinds))) + ")"
+        parameters.update({f"kind_{i}": kind for i, kind in enumerate(kinds)})
+    rows = (await db.execute(text(SEARCH_QUERY.format(kind_filter=kind_filter)), parameters)).mappings().all()
+
+    hits = [dict(row) for row in rows]
+    # Connectors and fields hang off a task; one lookup finds their processes
+    task_ids = {hit["parent_id"] for hit in hits if hit["kind"] in ("connector", "field")}
+    task_processes = {}
+    if task_ids:
+        result = await db.execute(
+            select(ProcessTask.id, ProcessTask.integration_process_id).where(ProcessTask.id.in_(task_ids))
+        )
+        task_processes = dict(result.all())
+    for hit in hits:
+        hit["id"] = hit.pop("entity_id")
+        hit["process_id"] = {
+            "process": hit["id"],
+            "task": hit["parent_id"],
+            "connector": task_processes.get(hit["parent_id"]),
+            "field": task_processes.get(hit["parent_id"]),
+        }.get(hit["kind"])
+    return hits
@@ -0,0 +1,117 @@
+import enum
+import json
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from pagination import keyset, paginate
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library is the fallback
+    orjson = None
+
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Rows fetched from the cursor and written per chunk when streaming
+STREAM_CHUNK_SIZE = 500
+
+def _enum_value(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), default=_enum_value).encode()
+
+class RowSerializer:
+    """Turns column rows selected for a response model straight into JSON.
+
+    The columns behind response_model's fields are worked out once, so each
+    row is a tuple zipped with the output keys and never validated by
+    Pydantic. children maps a list field to (child response model, child
+    model, foreign key column); child rows are loaded with one query per
+    chunk of parents.
+    """
+
+    def __init__(self, response_model, model, children: Optional[Dict[str, Tuple]] = None):
+        table_columns = model.__table__.columns
+        self.children = {
+            name: (RowSerializer(child_model, child), foreign_key)
+            for name, (child_model, child, foreign_key) in (children or {}).items()
+        }
+        self.keys = []
+        self.columns = []
+        for name, field in response_model.model_fields.items():
+            if name in self.children:
+                continue
+            # Responses are written by alias, and the alias is the column
+            # name whenever the Pydantic name differs from it
+            key = field.alias or name
+            self.keys.append(key)
+            self.columns.append(getattr(model, key if key in table_columns else name))
+
+    def select(self, query):
+        """Narrow an entity query to the response columns, keeping its filters."""
+        return query.with_only_columns(*self.columns)
+
+    async def dicts(self, db, rows) -> List[dict]:
+        items = [dict(zip(self.keys, row)) for row in rows]
+        for name, (child, foreign_key) in self.children.items():
+            grouped = {item["id"]: [] for item in items}
+            if grouped:
+                query = select(foreign_key, *child.columns).where(foreign_key.in_(list(grouped))).order_by(child.columns[0])
+                for row in (await db.execute(query)).all():
+                    grouped[row[0]].append(dict(zip(child.keys, row[1:])))
+            for item in items:
+                item[name] = grouped[item["id"]]
+        return items
+
+def _headers(response: Response) -> dict:
+    # Headers set by the endpoint so far, such as ETag and X-Next-Cursor
+    return {key: value for key, value in response.headers.items() if key not in ("content-length", "content-type")}
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+async def list_response(
+    request: Request,
+    response: Response,
+    db: AsyncSession,
+    query,
+    serializer: RowSerializer,
+    *columns,
+    limit: int,
+    after: Optional[str] = None,
+    skip: int = 0,
+) -> Response:
+    """Serve a list endpoint from column rows, bypassing response_model.
+
+    A JSON array for one page by default, or with ``Accept:
+    application/x-ndjson`` every matching row after the cursor streamed as
+    the database produces it. The stream only honours ``limit`` when the
+    client passes it.
+    """
+    query = serializer.select(query)
+    if wants_ndjson(request):
+        query = keyset(query, *columns, after=after, skip=skip)
+        if "limit" in request.query_params:
+            query = query.limit(limit)
+        return StreamingResponse(_stream(db.bind, query, serializer), media_type=NDJSON_MEDIA_TYPE, headers=_headers(response))
+
+    rows = await paginate(db, query, response, *columns, limit=limit, after=after, skip=skip, scalars=False)
+    return Response(dumps(await serializer.dicts(db, rows)), media_type=JSON_MEDIA_TYPE, headers=_headers(response))
+
+async def _stream(engine, query, serializer: RowSerializer):
+    # The request's session is closed before a streaming body is sent, so
+    # the stream holds its own connection for as long as it runs
+    async with engine.connect() as connection:
+        result = await connection.stream(query)
+        async for rows in result.partitions(STREAM_CHUNK_SIZE):
+            yield b"".join(dumps(item) + b"\n" for item in await serializer.dicts(connection, rows))
@@ -0,0 +1,32 @@
+import importlib
+import time
+from contextlib import contextmanager
+
+class StartupReport:
+    """Wall-clock milliseconds spent in each startup phase, in order.
+
+    main.py imports its dependencies phase by phase, so the report shows
+    where cold start and worker respawn time goes without -X importtime.
+    """
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    def import_module(self, name: str):
+        with self.phase(f"import {name}"):
+            return importlib.import_module(name)
+
+    def stats(self) -> dict:
+        return {"total_ms": round(sum(self.phases.values()), 1), "phases": dict(self.phases)}
+
+# Only the standard library is imported above, so the first phase starts
+# before anything heavy has been loaded
+startup_report = StartupReport()
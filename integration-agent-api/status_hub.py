@@ -0,0 +1,211 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models.models import IntegrationProcess
+
+# Default and smallest interval between two messages to the same client
+STATUS_TICK = float(os.getenv("INTEGRATION_AGENT_STATUS_TICK", "0.5"))
+MIN_STATUS_TICK = 0.05
+# Idle clients get a keepalive this often so dead connections are noticed
+STATUS_KEEPALIVE = 15.0
+
+class Subscription:
+    """One connected client: the processes it watches and which of them
+    changed since it was last sent anything.
+
+    There is no message queue. Repeated updates to a process between two
+    ticks collapse into its latest state, so a slow client holds at most one
+    pending entry per process.
+    """
+
+    def __init__(self, hub: "StatusHub", process_ids: Optional[Set[int]]):
+        self.hub = hub
+        self.process_ids = process_ids
+        self.changed: Set[int] = set()
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def _notify(self, process_id: int):
+        # Called under the hub lock, possibly from another thread or loop
+        self.changed.add(process_id)
+        try:
+            same_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            same_loop = False
+        if same_loop:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def updates(self, tick: float = STATUS_TICK, keepalive: float = STATUS_KEEPALIVE):
+        """Yield the changed process states, at most once per tick.
+
+        An empty list is yielded when nothing changed for keepalive seconds.
+        """
+        tick = max(tick, MIN_STATUS_TICK)
+        last_sent = 0.0
+        while True:
+            try:
+                await asyncio.wait_for(self._event.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield []
+                continue
+            delay = last_sent + tick - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._event.clear()
+            states = self.hub._drain(self)
+            last_sent = time.monotonic()
+            if states:
+                yield states
+
+class StatusHub:
+    """In-memory pub/sub of process state: status, run progress and per-task
+    counters.
+
+    The database is read once to seed processes nobody has asked about yet;
+    after that every client is served from memory. Each worker process has
+    its own hub and sees the commits made through it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.states: Dict[int, dict] = {}
+        self._all_loaded = False
+        self._watchers: Dict[int, Set[Subscription]] = {}
+        self._watch_all: Set[Subscription] = set()
+        self.published = 0
+        self.sent = 0
+
+    def publish(self, process_id: int, replace: bool = False, **changes):
+        """Merge changes into the state of process_id and flag it for its watchers.
+
+        ``tasks`` maps task ids to counters and is merged per task; every
+        other key replaces the previous value. ``replace`` starts the state
+        over, as for a newly created process.
+        """
+        with self._lock:
+            if replace or process_id not in self.states:
+                self.states[process_id] = {"id": process_id}
+            state = self.states[process_id]
+            tasks = changes.pop("tasks", None)
+            state.update(changes)
+            if tasks:
+                counters = state.setdefault("tasks", {})
+                for task_id, values in tasks.items():
+                    counters.setdefault(str(task_id), {}).update(values)
+            self.published += 1
+            for subscription in self._watchers.get(process_id, set()) | self._watch_all:
+                subscription._notify(process_id)
+
+    async def subscribe(self, db: AsyncSession, process_ids: Optional[List[int]] = None) -> Subscription:
+        """Register a client for process_ids, or every process when None.
+
+        Its first tick carries the current state of everything it watches.
+        """
+        wanted = None if process_ids is None else set(process_ids)
+        if wanted is None and not self._all_loaded:
+            await self._load(db, None)
+        elif wanted:
+            await self._load(db, wanted - set(self.states))
+
+        subscription = Subscription(self, wanted)
+        with self._lock:
+            if wanted is None:
+                self._watch_all.add(subscription)
+                initial = [id for id, state in self.states.items() if not state.get("deleted")]
+            else:
+                for process_id in wanted:
+                    self._watchers.setdefault(process_id, set()).add(subscription)
+                initial = [id for id in wanted if id in self.states]
+            for process_id in initial:
+                subscription._notify(process_id)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._watch_all.discard(subscription)
+            for process_id in subscription.process_ids or ():
+                watchers = self._watchers.get(process_id)
+                if watchers is not None:
+                    watchers.discard(subscription)
+                    if not watchers:
+                        del self._watchers[process_id]
+
+    async def _load(self, db: AsyncSession, process_ids: Optional[Set[int]]):
+        if process_ids is not None and not process_ids:
+            return
+        query = select(IntegrationProcess.id, IntegrationProcess.status)
+        if process_ids is not None:
+            query = query.where(IntegrationProcess.id.in_(process_ids))
+        rows = (await db.execute(query)).all()
+        with self._lock:
+            # A state published while the query ran is newer than the row
+            for process_id, status in rows:
+                self.states.setdefault(process_id, {"id": process_id, "status": _status_value(status)})
+            if process_ids is None:
+                self._all_loaded = True
+
+    def _drain(self, subscription: Subscription) -> List[dict]:
+        with self._lock:
+            changed, subscription.changed = subscription.changed, set()
+            states = [_copy_state(self.states[id]) for id in sorted(changed) if id in self.states]
+            self.sent += len(states)
+            return states
+
+    def clear(self):
+        with self._lock:
+            self.states.clear()
+            self._all_loaded = False
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._watch_all | {s for watchers in self._watchers.values() for s in watchers}),
+            "processes": len(self.states),
+            "published": self.published,
+            "sent": self.sent,
+        }
+
+def _status_value(status):
+    return getattr(status, "value", status)
+
+def _copy_state(state: dict) -> dict:
+    copy = dict(state)
+    if "tasks" in copy:
+        copy["tasks"] = {task_id: dict(counters) for task_id, counters in copy["tasks"].items()}
+    return copy
+
+status_hub = StatusHub()
+
+# Status changes are collected per session and published once committed
+
+def _pending(session: Session) -> dict:
+    return session.info.setdefault("pending_statuses", {})
+
+@event.listens_for(Session, "after_flush")
+def _track_status(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, IntegrationProcess):
+            _pending(session)[obj.id] = {"replace": True, "status": _status_value(obj.status)}
+    for obj in session.dirty:
+        if isinstance(obj, IntegrationProcess) and inspect(obj).attrs.status.history.has_changes():
+            _pending(session).setdefault(obj.id, {})["status"] = _status_value(obj.status)
+    for obj in session.deleted:
+        if isinstance(obj, IntegrationProcess):
+            _pending(session)[obj.id] = {"status": None, "deleted": True}
+
+@event.listens_for(Session, "after_commit")
+def _publish_statuses(session):
+    for process_id, changes in session.info.pop("pending_statuses", {}).items():
+        status_hub.publish(process_id, **changes)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_statuses(session):
+    session.info.pop("pending_statuses", None)
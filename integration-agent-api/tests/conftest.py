@@ -1,19 +1,30 @@
+import os
+
+# Create test database with a file instead of memory
+TEST_DB_PATH = "test.db"
+TEST_DATABASE_URL = f"sqlite:///{TEST_DB_PATH}"
+TEST_ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{TEST_DB_PATH}"
+# The app's own engine, which startup migrates and background work writes
+# through, must never reach the checked-in integration_agent.db; set before
+# anything imports database
+os.environ["INTEGRATION_AGENT_DATABASE_URL"] = TEST_ASYNC_DATABASE_URL
+
 import pytest
 import asyncio
 from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 from fastapi.testclient import TestClient
 from models.models import (
     Base, Connector, ProcessTask, IntegrationProcess, 
     IntegrationAgent, IntegrationType, TriggerType, TaskType
 )
 from database import get_db
+from cache import existence_cache
+from routers.auth import principal_cache
+from status_hub import status_hub
 from main import app
-import os
-
-# Create test database with a file instead of memory
-TEST_DB_PATH = "test.db"
-TEST_DATABASE_URL = f"sqlite:///{TEST_DB_PATH}"
 
 # Use a test-specific database URL
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test_sql_app.db"
@@ -30,8 +41,9 @@ def print_db_contents(session):
 @pytest.fixture(scope="session")
 def engine():
     """Create the test database engine"""
-    if os.path.exists(TEST_DB_PATH):
-        os.remove(TEST_DB_PATH)
+    for path in (TEST_DB_PATH, f"{TEST_DB_PATH}-wal", f"{TEST_DB_PATH}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
     
     test_engine = create_engine(
         TEST_DATABASE_URL,
@@ -46,31 +58,46 @@ def engine():
     # Cleanup
     Base.metadata.drop_all(bind=test_engine)
     test_engine.dispose()
-    if os.path.exists(TEST_DB_PATH):
-        os.remove(TEST_DB_PATH)
+    # The WAL profile tests leave the database in WAL mode
+    for path in (TEST_DB_PATH, f"{TEST_DB_PATH}-wal", f"{TEST_DB_PATH}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+@pytest.fixture(scope="session")
+def async_engine(engine):
+    """Async engine used by the application under test"""
+    # NullPool: each TestClient runs its own event loop, so connections
+    # must not be pooled across tests
+    test_async_engine = create_async_engine(TEST_ASYNC_DATABASE_URL, poolclass=NullPool)
+    yield test_async_engine
 
 @pytest.fixture(scope="function")
 def db_session(engine):
     """Creates a new database session for each test"""
-    connection = engine.connect()
-    transaction = connection.begin()
-    session_factory = sessionmaker(bind=connection)
+    session_factory = sessionmaker(bind=engine)
     session = session_factory()
 
     yield session
 
     session.close()
-    transaction.rollback()
-    connection.close()
+    # The application commits through its own async connections, so empty
+    # every table instead of rolling back a shared transaction
+    with engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    # Those deletes bypass the session events that keep the cache in sync
+    existence_cache.clear()
+    principal_cache.clear()
+    status_hub.clear()
 
 @pytest.fixture(scope="function")
-def client(db_session):
+def client(db_session, async_engine):
     """Test client with database session"""
-    def override_get_db():
-        try:
-            yield db_session
-        finally:
-            pass  # Session cleanup is handled by db_session fixture
+    session_factory = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_db():
+        async with session_factory() as session:
+            yield session
 
     app.dependency_overrides[get_db] = override_get_db
     with TestClient(app) as test_client:
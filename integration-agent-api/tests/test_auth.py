@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from password_pool import PasswordPool
+from routers.auth import principal_cache
+
+def _login(client, username="automation", password="secret"):
+    client.post("/api/user/register", json={"username": username, "password": password})
+    response = client.post("/api/user/login", json={"username": username, "password": password})
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def test_protected_route_caches_principal(client, async_engine):
+    headers = _login(client)
+    response = client.get("/api/user/protected-route", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["user"] == "automation"
+
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        for _ in range(3):
+            response = client.get("/api/user/protected-route", headers=headers)
+            assert response.json()["user"] == "automation"
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    assert statements == []
+
+def test_principal_is_loaded_with_one_query(client, async_engine):
+    headers = _login(client)
+    principal_cache.invalidate("tokens")
+
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        assert client.get("/api/user/protected-route", headers=headers).status_code == 200
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    assert len(statements) == 1 and "entity_versions" in statements[0]
+
+def test_protected_route_rejects_bad_token(client, db_session):
+    response = client.get("/api/user/protected-route", headers={"Authorization": "Bearer nonsense"})
+    assert response.status_code == 401
+
+def test_revoke_tokens(client, db_session):
+    headers = _login(client)
+    assert client.get("/api/user/protected-route", headers=headers).status_code == 200
+
+    assert client.post("/api/user/revoke-tokens", headers=headers).status_code == 200
+    assert client.get("/api/user/protected-route", headers=headers).status_code == 401
+
+    headers = _login(client)
+    assert client.get("/api/user/protected-route", headers=headers).status_code == 200
+
+def test_password_pool_rejects_beyond_max_pending():
+    pool = PasswordPool(workers=1, max_pending=2)
+    release = threading.Event()
+
+    async def burst():
+        calls = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as rejected:
+            await pool.run(release.wait)
+        release.set()
+        await asyncio.gather(*calls)
+        return rejected.value
+
+    try:
+        rejected = asyncio.run(burst())
+    finally:
+        pool.shutdown()
+    assert rejected.status_code == 503
+    assert pool.stats()["rejected"] == 1
+    assert pool.stats()["peak_pending"] == 2
+    assert pool.stats()["completed"] == 2
+    assert pool.stats()["pending"] == 0
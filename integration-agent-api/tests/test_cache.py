@@ -0,0 +1,64 @@
+import time
+from sqlalchemy import event
+from cache import LRUCache
+from models.models import IntegrationType, TriggerType, TaskType, DataType
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.put(("t", 1), True, cache.generation("t"))
+    cache.put(("t", 2), True, cache.generation("t"))
+    assert cache.get(("t", 1))
+    cache.put(("t", 3), True, cache.generation("t"))
+
+    assert cache.get(("t", 2)) is None
+    assert cache.get(("t", 1)) and cache.get(("t", 3))
+    assert cache.stats()["evictions"] == 1
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(maxsize=10, ttl=0.01)
+    cache.put(("t", 1), True, cache.generation("t"))
+    time.sleep(0.02)
+    assert cache.get(("t", 1)) is None
+    assert cache.stats()["expirations"] == 1
+
+def test_lru_cache_ignores_reads_older_than_an_invalidation():
+    cache = LRUCache(maxsize=10, ttl=60)
+    generation = cache.generation("t")
+    cache.invalidate("t", [1])
+    cache.put(("t", 1), True, generation)
+    assert cache.get(("t", 1)) is None
+
+def test_parent_checks_are_cached_until_delete(client, async_engine):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Cached Agent", "code": "CACHE001", "type": IntegrationType.Process.value,
+    }).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": TriggerType.WebService.value,
+    }).json()
+    task = client.post("/api/process-tasks/", json={
+        "integration_process_id": process["id"], "task_name": "Task", "type": TaskType.Input.value,
+    }).json()
+
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        for i in range(5):
+            response = client.post("/api/fields/", json={
+                "field_name": f"Field{i}", "data_type": DataType.Single.value, "process_task_id": task["id"],
+            })
+            assert response.status_code == 200
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+
+    # The first request loads the task, the others hit the cache
+    assert sum(statement.startswith("SELECT process_tasks.id \nFROM process_tasks") for statement in statements) == 1
+    assert client.get("/api/metrics/cache").json()["hits"] >= 4
+
+    client.delete(f"/api/process-tasks/{task['id']}")
+    response = client.post("/api/fields/", json={
+        "field_name": "Late", "data_type": DataType.Single.value, "process_task_id": task["id"],
+    })
+    assert response.status_code == 404
@@ -0,0 +1,128 @@
+import asyncio
+import time
+import httpx
+import pytest
+import connector_clients
+from circuit_breakers import CircuitBreaker, CircuitBreakers, RetryBudget, backoff, CLOSED, OPEN, HALF_OPEN
+from connector_clients import CircuitOpenError, ConnectorError, WebServiceClient
+from models.models import Connector, ConnectorType, DataType
+from rate_limits import RateLimiter
+
+def test_breaker_opens_after_failures_and_recovers_through_half_open():
+    breaker = CircuitBreaker(failures=3, open_seconds=0.05, half_open_calls=1)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.failure()
+    breaker.success()
+    # Only failures in a row count
+    for _ in range(3):
+        breaker.failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN and breaker.opened == 2
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.abandon()
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CLOSED and breaker.allow() and breaker.allow()
+
+def test_retry_budget_is_earned_by_successes():
+    budget = RetryBudget(ratio=0.5, reserve=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw() and not budget.withdraw()
+    assert (budget.retries, budget.refused) == (3, 2)
+
+def test_backoff_is_jittered_and_capped():
+    delays = [backoff(3, base=0.1, cap=0.5) for _ in range(200)]
+    assert all(0 <= delay <= 0.5 for delay in delays)
+    assert len(set(delays)) > 100
+    assert max(backoff(1, base=0.1, cap=10) for _ in range(200)) <= 0.2
+
+def _client(url: str, transport) -> WebServiceClient:
+    client = WebServiceClient(Connector(id=1, data_type=DataType.List, connector_type=ConnectorType.WebService, end_point=url))
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(transport))
+    return client
+
+def test_failing_target_fails_fast_while_others_carry_on(monkeypatch):
+    breakers = CircuitBreakers(max_retries=2, backoff_base=0.001, failures=4, open_seconds=60)
+    monkeypatch.setattr(connector_clients, "circuit_breakers", breakers)
+    monkeypatch.setattr(connector_clients, "rate_limiter", RateLimiter("worker"))
+    calls = {"down": 0, "up": 0}
+
+    def down(request):
+        calls["down"] += 1
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    def up(request):
+        calls["up"] += 1
+        return httpx.Response(200)
+
+    async def scenario():
+        failing, healthy = _client("http://down.invalid", down), _client("http://up.invalid", up)
+        # Three tries, then the next call's first try opens the breaker and
+        # its retry finds it open
+        with pytest.raises(ConnectorError) as error:
+            await failing.send([{"id": 1}])
+        assert not isinstance(error.value, CircuitOpenError)
+        assert calls["down"] == 3 and failing.retries == 2
+        with pytest.raises(CircuitOpenError):
+            await failing.send([{"id": 2}])
+        assert calls["down"] == 4
+        started = time.perf_counter()
+        for _ in range(20):
+            with pytest.raises(CircuitOpenError):
+                await failing.send([{"id": 3}])
+        rejected_in = time.perf_counter() - started
+        for _ in range(20):
+            await healthy.send([{"id": 4}])
+        await failing.close()
+        await healthy.close()
+        return rejected_in
+
+    assert asyncio.run(scenario()) < 0.05
+    assert calls == {"down": 4, "up": 20}
+    stats = breakers.stats()
+    assert stats["WebService:http://down.invalid"]["state"] == OPEN
+    assert stats["WebService:http://down.invalid"]["rejected"] == 21
+    assert stats["WebService:http://up.invalid"]["state"] == CLOSED
+
+def test_retries_stop_when_the_budget_runs_out(monkeypatch):
+    monkeypatch.setattr(connector_clients, "circuit_breakers", CircuitBreakers(
+        max_retries=5, backoff_base=0.001, failures=100, retry_ratio=0.5, retry_reserve=1,
+    ))
+    monkeypatch.setattr(connector_clients, "rate_limiter", RateLimiter("worker"))
+    answers = []
+
+    def flaky(request):
+        return httpx.Response(answers.pop(0) if answers else 503)
+
+    async def scenario():
+        client = _client("http://flaky.invalid", flaky)
+        # One retry in reserve gets past a single 503
+        answers.extend([503, 200])
+        await client.send([{"id": 1}])
+        # Then only what successes earned, half a retry each
+        answers.extend([200])
+        await client.send([{"id": 2}])
+        answers.extend([503, 200])
+        await client.send([{"id": 3}])
+        with pytest.raises(ConnectorError):
+            await client.send([{"id": 3}])
+        # A client error is not retried at all
+        answers.extend([404, 200])
+        with pytest.raises(ConnectorError) as error:
+            await client.send([{"id": 4}])
+        await client.close()
+        return client.retries, error.value
+
+    retries, error = asyncio.run(scenario())
+    assert retries == 2 and not error.retryable
@@ -122,4 +122,65 @@ def test_delete_connector(client, db_session, test_data):
     
     # Verify it's gone
     get_response = client.get(f"/api/connectors/{created_connector['id']}")
-    assert get_response.status_code == 404 
\ No newline at end of file
+    assert get_response.status_code == 404 
+
+def test_batch_connectors(client, db_session):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Batch Agent", "code": "BATCH", "type": "Process"
+    }).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": "WebService"
+    }).json()
+    task = client.post("/api/process-tasks/", json={
+        "integration_process_id": process["id"], "task_name": "Batch Task", "type": "Output"
+    }).json()
+    existing = client.post("/api/connectors/", json={
+        "process_task_id": task["id"],
+        "data_type": DataType.Single.value,
+        "connector_type": ConnectorType.File.value,
+    }).json()
+
+    response = client.post("/api/connectors/batch", json={
+        "create": [
+            {
+                "process_task_id": task["id"],
+                "data_type": DataType.List.value,
+                "connector_type": ConnectorType.WebService.value,
+                "service_type": ServiceType.REST.value,
+                "end_point": f"http://test.api/{i}",
+            }
+            for i in range(3)
+        ],
+        "update": [{
+            "id": existing["id"],
+            "process_task_id": task["id"],
+            "data_type": DataType.Single.value,
+            "connector_type": ConnectorType.MessageQueue.value,
+            "queue_path": "orders",
+        }],
+    })
+    assert response.status_code == 200
+    data = response.json()
+    assert [c["end_point"] for c in data["created"]] == [f"http://test.api/{i}" for i in range(3)]
+    assert data["updated"][0]["queue_path"] == "orders"
+
+    response = client.post("/api/connectors/batch", json={"delete": [existing["id"], 999]})
+    assert response.status_code == 404
+    assert client.get(f"/api/connectors/{existing['id']}").status_code == 200
+
+    # Fields left out of an update keep their values, as with PUT
+    first, second = data["created"][:2]
+    response = client.post("/api/connectors/batch", json={"update": [
+        {"id": first["id"], "process_task_id": task["id"], "data_type": DataType.Single.value,
+         "connector_type": ConnectorType.WebService.value, "rate_limit": 5},
+        {"id": second["id"], "process_task_id": task["id"], "data_type": DataType.List.value,
+         "connector_type": ConnectorType.WebService.value, "end_point": "http://test.api/moved"},
+    ]})
+    assert response.status_code == 200
+    updated = response.json()["updated"]
+    assert (updated[0]["end_point"], updated[0]["service_type"], updated[0]["rate_limit"]) == ("http://test.api/0", ServiceType.REST.value, 5)
+    assert (updated[1]["end_point"], updated[1]["rate_limit"]) == ("http://test.api/moved", None)
+    put = client.put(f"/api/connectors/{second['id']}", json={
+        "process_task_id": task["id"], "data_type": DataType.List.value, "connector_type": ConnectorType.WebService.value,
+    }).json()
+    assert put["end_point"] == updated[1]["end_point"]
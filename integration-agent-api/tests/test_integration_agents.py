@@ -1,7 +1,12 @@
 import pytest
+import json
 from fastapi.testclient import TestClient
 from tests.conftest import print_db_contents
-from models.models import IntegrationType
+from sqlalchemy import event
+from models.models import (
+    IntegrationType, TriggerType, Recurrence, TaskType, DataType,
+    ConnectorType, ServiceType, ConditionType
+)
 
 def test_create_integration_agent(client, db_session):
     print("\nBefore creating agent:")
@@ -100,4 +105,298 @@ def test_delete_integration_agent(client, db_session):
     
     # Verify it's gone
     get_response = client.get(f"/api/integration-agents/{created_agent['id']}")
-    assert get_response.status_code == 404 
\ No newline at end of file
+    assert get_response.status_code == 404 
+
+def test_get_integration_agent_graph(client, async_engine):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Graph Agent",
+        "code": "GRAPH001",
+        "type": IntegrationType.Process.value,
+    }).json()
+
+    for p in range(2):
+        process = client.post("/api/integration-processes/", json={
+            "integration_agent_id": agent["id"],
+            "name": f"Process {p}",
+            "trigger_type": TriggerType.Scheduler.value,
+        }).json()
+        client.post("/api/process-schedules/", json={
+            "integration_process_id": process["id"],
+            "recurrence_type": Recurrence.Daily.value,
+            "start_date": "2025-01-01T00:00:00",
+        })
+        for t in range(3):
+            task = client.post("/api/process-tasks/", json={
+                "integration_process_id": process["id"],
+                "task_name": f"Task {t}",
+                "type": TaskType.Input.value,
+                "sequence_number": 30 - t * 10,
+                "static_fields": [{"key": "Id", "data_type": DataType.Single.value}],
+            }).json()
+            client.post("/api/connectors/", json={
+                "process_task_id": task["id"],
+                "data_type": DataType.List.value,
+                "connector_type": ConnectorType.WebService.value,
+                "service_type": ServiceType.REST.value,
+                "end_point": "http://test.api/endpoint",
+            })
+            field_id = task["static_fields"][0]["id"]
+            client.post("/api/transformations/", json={
+                "process_task_id": task["id"],
+                "condition_type": ConditionType.Equal.value,
+                "c_field_id": field_id,
+                "v_field_id": field_id,
+            })
+
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.get(f"/api/integration-agents/{agent['id']}/graph")
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["name"] == "Graph Agent"
+    assert len(data["processes"]) == 2
+    for process in data["processes"]:
+        assert process["scheduler"]["recurrence_type"] == Recurrence.Daily.value
+        assert [task["task_name"] for task in process["tasks"]] == ["Task 2", "Task 1", "Task 0"]
+        for task in process["tasks"]:
+            assert task["static_fields"][0]["field_name"] == "Id"
+            assert task["connectors"][0]["end_point"] == "http://test.api/endpoint"
+            assert len(task["transformations"]) == 1
+
+    # Version lookup, agent, processes, schedules, tasks, fields, connectors, transformations
+    assert len(statements) == 8
+
+def test_get_integration_agent_graph_not_found(client, db_session):
+    response = client.get("/api/integration-agents/999/graph")
+    assert response.status_code == 404
+
+def test_page_integration_agents_with_cursor(client, db_session):
+    for i in range(5):
+        client.post("/api/integration-agents/", json={
+            "name": f"Paged Agent {i}",
+            "code": f"PAGE00{i}",
+            "type": IntegrationType.Service.value,
+        })
+
+    names = []
+    after = None
+    pages = 0
+    while True:
+        params = {"limit": 2}
+        if after:
+            params["after"] = after
+        response = client.get("/api/integration-agents/", params=params)
+        assert response.status_code == 200
+        names.extend(agent["name"] for agent in response.json())
+        pages += 1
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+
+    assert names == [f"Paged Agent {i}" for i in range(5)]
+    assert pages == 3
+
+def test_page_integration_agents_invalid_cursor(client, db_session):
+    response = client.get("/api/integration-agents/", params={"after": "not-a-cursor"})
+    assert response.status_code == 400
+
+def _create_bundle_agent(client):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Bundle Agent",
+        "code": "BUNDLE001",
+        "type": IntegrationType.Process.value,
+    }).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"],
+        "name": "Bundle Process",
+        "trigger_type": TriggerType.Scheduler.value,
+    }).json()
+    client.post("/api/process-schedules/", json={
+        "integration_process_id": process["id"],
+        "recurrence_type": Recurrence.Daily.value,
+        "start_date": "2025-01-01T00:00:00",
+    })
+    task = client.post("/api/process-tasks/", json={
+        "integration_process_id": process["id"],
+        "task_name": "Bundle Task",
+        "type": TaskType.Input.value,
+        "static_fields": [
+            {"key": "Id", "data_type": DataType.Single.value},
+            {"key": "Name", "data_type": DataType.Single.value, "value": "x"},
+        ],
+    }).json()
+    client.post("/api/connectors/", json={
+        "process_task_id": task["id"],
+        "data_type": DataType.List.value,
+        "connector_type": ConnectorType.WebService.value,
+        "service_type": ServiceType.REST.value,
+        "end_point": "http://test.api/endpoint",
+    })
+    client.post("/api/transformations/", json={
+        "process_task_id": task["id"],
+        "condition_type": ConditionType.Equal.value,
+        "c_field_id": task["static_fields"][0]["id"],
+        "v_field_id": task["static_fields"][1]["id"],
+    })
+    return agent
+
+def _graph_without_ids(graph):
+    # Strip every id so graphs from different agents can be compared
+    if isinstance(graph, dict):
+        return {key: _graph_without_ids(value) for key, value in graph.items() if key != "id" and not key.endswith("_id")}
+    if isinstance(graph, list):
+        return [_graph_without_ids(value) for value in graph]
+    return graph
+
+@pytest.mark.parametrize("format,media_type", [("json", "application/json"), ("msgpack", "application/msgpack")])
+def test_export_import_integration_agent(client, db_session, format, media_type):
+    if format == "msgpack":
+        pytest.importorskip("msgpack")
+    agent = _create_bundle_agent(client)
+
+    export = client.get(f"/api/integration-agents/{agent['id']}/export", params={"format": format})
+    assert export.status_code == 200
+    assert export.headers["content-type"] == media_type
+
+    response = client.post("/api/integration-agents/import", content=export.content, headers={"Content-Type": media_type})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["agent"]["id"] != agent["id"]
+    assert data["counts"] == {
+        "integration_processes": 1, "process_schedules": 1, "process_tasks": 1,
+        "fields": 2, "connectors": 1, "transformations": 1, "task_dependencies": 0,
+    }
+
+    original = client.get(f"/api/integration-agents/{agent['id']}/graph").json()
+    imported = client.get(f"/api/integration-agents/{data['agent']['id']}/graph").json()
+    assert _graph_without_ids(imported) == _graph_without_ids(original)
+
+    # Transformations point at the imported fields, not the original ones
+    task = imported["processes"][0]["tasks"][0]
+    field_ids = [field["id"] for field in task["static_fields"]]
+    transformation = task["transformations"][0]
+    assert [transformation["c_field_id"], transformation["v_field_id"]] == field_ids
+
+def test_import_integration_agent_rejects_bad_bundle(client, db_session):
+    agent = _create_bundle_agent(client)
+    bundle = client.get(f"/api/integration-agents/{agent['id']}/export").json()
+
+    bundle["tables"]["fields"]["rows"][0][bundle["tables"]["fields"]["columns"].index("process_task_id")] = 999
+    response = client.post("/api/integration-agents/import", json=bundle)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "fields.process_task_id references unknown ids: [999]"
+
+    bundle["version"] = 2
+    assert client.post("/api/integration-agents/import", json=bundle).status_code == 400
+    assert len(client.get("/api/integration-agents/").json()) == 1
+
+def test_import_integration_agent_checks_float_columns(client, db_session):
+    agent = _create_bundle_agent(client)
+    bundle = client.get(f"/api/integration-agents/{agent['id']}/export").json()
+    connectors = bundle["tables"]["connectors"]
+    column = connectors["columns"].index("rate_limit")
+
+    connectors["rows"][0][column] = "fast"
+    response = client.post("/api/integration-agents/import", json=bundle)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "connectors.rate_limit values must be of type int or float"
+
+    # A whole number arrives as an int
+    for rate in (5, 2.5):
+        connectors["rows"][0][column] = rate
+        assert client.post("/api/integration-agents/import", json=bundle).status_code == 200
+
+def test_integration_agents_conditional_get(client, async_engine):
+    client.post("/api/integration-agents/", json={
+        "name": "Polled Agent", "code": "POLL001", "type": IntegrationType.Service.value,
+    })
+    response = client.get("/api/integration-agents/")
+    etag = response.headers["ETag"]
+
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.get("/api/integration-agents/", headers={"If-None-Match": etag})
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+    # Only the version lookup runs
+    assert len(statements) == 1
+
+    # A different page is a different representation
+    assert client.get("/api/integration-agents/", params={"limit": 1}).headers["ETag"] != etag
+
+    client.post("/api/integration-agents/", json={
+        "name": "Other Agent", "code": "POLL002", "type": IntegrationType.Service.value,
+    })
+    response = client.get("/api/integration-agents/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+def test_agent_graph_etag_follows_nested_changes(client, db_session):
+    agents = [
+        client.post("/api/integration-agents/", json={
+            "name": f"Agent {i}", "code": f"AGG00{i}", "type": IntegrationType.Process.value,
+        }).json()
+        for i in range(2)
+    ]
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agents[0]["id"], "trigger_type": TriggerType.WebService.value,
+    }).json()
+    task = client.post("/api/process-tasks/", json={
+        "integration_process_id": process["id"], "task_name": "Task", "type": TaskType.Input.value,
+    }).json()
+
+    def etags(*paths):
+        paths = [f"/api/integration-agents/{agent['id']}/graph" for agent in agents] + [
+            f"/api/integration-processes/{process['id']}/tasks",
+        ] + list(paths)
+        return [client.get(path).headers["ETag"] for path in paths]
+
+    task_path = f"/api/process-tasks/{task['id']}"
+    before = etags(task_path)
+    assert etags(task_path) == before
+
+    # A field three levels down moves the task, process and agent versions
+    # but leaves the unrelated agent alone
+    client.post("/api/fields/", json={
+        "field_name": "Id", "data_type": DataType.Single.value, "process_task_id": task["id"],
+    })
+    after = etags(task_path)
+    assert after[1] == before[1]
+    assert all(a != b for a, b in zip(after[:1] + after[2:], before[:1] + before[2:]))
+
+    # Bulk statements are tracked too
+    response = client.post("/api/process-tasks/batch", json={"delete": [task["id"]]})
+    assert response.status_code == 200
+    final = etags()
+    assert final[0] != after[0] and final[1] == after[1] and final[2] != after[2]
+
+def test_integration_agents_etag_varies_by_accept(client, db_session):
+    client.post("/api/integration-agents/", json={
+        "name": "Vary Agent", "code": "VARY001", "type": IntegrationType.Service.value,
+    })
+
+    response = client.get("/api/integration-agents/")
+    assert response.headers["Vary"] == "Accept"
+    stream = client.get("/api/integration-agents/", headers={"Accept": "application/x-ndjson"})
+    assert stream.headers["ETag"] != response.headers["ETag"]
+    assert json.loads(stream.text) == response.json()[0]
+
+    # A cached JSON array must not be revalidated as the NDJSON stream
+    response = client.get("/api/integration-agents/", headers={
+        "Accept": "application/x-ndjson", "If-None-Match": response.headers["ETag"],
+    })
+    assert response.status_code == 200
@@ -142,4 +142,20 @@ def test_start_stop_integration_process(client, test_data):
     response = client.post(f"/api/integration-processes/{created_process['id']}/stop")
     assert response.status_code == 200
     data = response.json()
-    assert data["status"] == ProcessStatus.Stopped.value 
\ No newline at end of file
+    assert data["status"] == ProcessStatus.Stopped.value 
+
+def test_delete_integration_process_clears_its_checkpoint(client, tmp_path, monkeypatch):
+    from checkpoints import CheckpointStore
+    store = CheckpointStore(str(tmp_path / "checkpoints"))
+    monkeypatch.setattr("routers.integration_processes.checkpoint_store", store)
+    agent = client.post("/api/integration-agents/", json={"name": "Gone", "code": "GONE", "type": "Process"}).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": TriggerType.WebService.value,
+    }).json()
+    store.save(process["id"], {"run_id": "interrupted", "tasks": [], "sources": {}})
+    assert client.get(f"/api/integration-processes/{process['id']}/checkpoint").status_code == 200
+
+    assert client.delete(f"/api/integration-processes/{process['id']}").status_code == 200
+    # A process that gets the id next starts afresh
+    assert store.load(process["id"]) is None
+    assert store.process_ids() == []
@@ -0,0 +1,199 @@
+import os
+import subprocess
+import sys
+import pytest
+from sqlalchemy import create_engine, event, inspect
+from models.models import Base
+import migrations
+from migrations import SCHEMA_VERSION, check_schema, migrate, migrate_in_transaction, schema_version
+
+def _indexes(engine):
+    inspector = inspect(engine)
+    return {
+        (table, index["name"], tuple(index["column_names"]), bool(index["unique"]))
+        for table in inspector.get_table_names()
+        for index in inspector.get_indexes(table)
+    }
+
+def test_migrate_new_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    with engine.begin() as connection:
+        assert migrate(connection) == SCHEMA_VERSION
+
+    with engine.connect() as connection:
+        assert schema_version(connection) == SCHEMA_VERSION
+    expected = {
+        (table.name, index.name, tuple(column.name for column in index.columns), bool(index.unique))
+        for table in Base.metadata.sorted_tables
+        for index in table.indexes
+    }
+    assert _indexes(engine) == expected
+    engine.dispose()
+
+def _columns(engine, table):
+    return [(column["name"], str(column["type"]), column["nullable"]) for column in inspect(engine).get_columns(table)]
+
+def test_migrate_unversioned_database(tmp_path):
+    # The layout create_all produced before migrations existed: no foreign
+    # key indexes, redundant ones on integer primary keys and no
+    # entity_versions table
+    legacy = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with legacy.begin() as connection:
+        Base.metadata.create_all(connection)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if not index.unique:
+                    connection.exec_driver_sql(f"DROP INDEX {index.name}")
+        connection.exec_driver_sql("DROP TABLE entity_versions")
+        # Added by migration 4, from its frozen SQL
+        connection.exec_driver_sql("DROP TABLE task_dependencies")
+        for table in ("process_tasks", "fields", "users"):
+            connection.exec_driver_sql(f"CREATE INDEX ix_{table}_id ON {table} (id)")
+        connection.exec_driver_sql(
+            "INSERT INTO integration_agents (name, code, type, enabled, updates_available) "
+            "VALUES ('Legacy Agent', 'LEGACY', 'Process', 1, 0)"
+        )
+
+    with legacy.begin() as connection:
+        assert migrate(connection) == SCHEMA_VERSION
+    with legacy.begin() as connection:
+        # Already current, nothing to do
+        assert migrate(connection) == SCHEMA_VERSION
+        assert connection.exec_driver_sql("SELECT name FROM integration_agents").scalar() == "Legacy Agent"
+
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    with fresh.begin() as connection:
+        migrate(connection)
+    # Both paths must end in the same schema as the models describe
+    assert _indexes(legacy) == _indexes(fresh)
+    assert set(inspect(legacy).get_table_names()) == set(inspect(fresh).get_table_names())
+    assert _columns(legacy, "task_dependencies") == _columns(fresh, "task_dependencies")
+    assert inspect(legacy).get_unique_constraints("task_dependencies") == inspect(fresh).get_unique_constraints("task_dependencies")
+
+    with legacy.begin() as connection:
+        connection.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    with legacy.begin() as connection:
+        with pytest.raises(RuntimeError):
+            migrate(connection)
+    legacy.dispose()
+    fresh.dispose()
+
+def test_failed_migration_rolls_back_its_ddl(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'broken.db'}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE integration_agents (id INTEGER PRIMARY KEY)")
+
+    def broken(connection):
+        connection.exec_driver_sql("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("migration failed")
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:1] + [(2, "broken", broken)])
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        with pytest.raises(RuntimeError):
+            migrate_in_transaction(connection)
+
+    # Neither the baseline tables nor the half-done step were kept
+    assert inspect(engine).get_table_names() == ["integration_agents"]
+    with engine.connect() as connection:
+        assert schema_version(connection) == 0
+    engine.dispose()
+
+def test_check_schema_only_reads_the_stamp(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'check.db'}")
+    with engine.connect() as connection:
+        with pytest.raises(RuntimeError):
+            check_schema(connection)
+    # Checking must not have created anything
+    assert inspect(engine).get_table_names() == []
+
+    with engine.begin() as connection:
+        migrate(connection)
+    with engine.connect() as connection:
+        assert check_schema(connection) == SCHEMA_VERSION
+    engine.dispose()
+
+def test_startup_report(client):
+    report = client.get("/api/metrics/startup").json()
+    assert "import routers.integration_agents" in report["phases"]
+    assert any(phase.startswith("init_db") for phase in report["phases"])
+    assert report["total_ms"] >= max(report["phases"].values())
+
+def test_importing_the_app_leaves_the_engine_unloaded():
+    # A fresh interpreter, since this one has imported everything already
+    script = "import sys, main; print(sorted({'process_engine', 'connector_clients', 'bundles'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=os.path.dirname(migrations.__file__))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+def test_router_filters_use_indexes(client, db_session, engine, async_engine):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and "WHERE" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        agent = client.post("/api/integration-agents/", json={
+            "name": "Plan Agent", "code": "PLAN", "type": "Process"
+        }).json()
+        process = client.post("/api/integration-processes/", json={
+            "integration_agent_id": agent["id"], "trigger_type": "Scheduler"
+        }).json()
+        client.post("/api/process-schedules/", json={
+            "integration_process_id": process["id"], "recurrence_type": "Daily", "start_date": "2025-01-01"
+        })
+        task_ids = []
+        for sequence_number in (2, 1):
+            task = client.post("/api/process-tasks/", json={
+                "integration_process_id": process["id"],
+                "task_name": f"Plan Task {sequence_number}",
+                "type": "Input",
+                "sequence_number": sequence_number,
+                "static_fields": [{"key": "Id", "data_type": "Single"}],
+            }).json()
+            field_id = task["static_fields"][0]["id"]
+            client.post("/api/connectors/", json={
+                "process_task_id": task["id"], "data_type": "List", "connector_type": "WebService"
+            })
+            client.post("/api/transformations/", json={
+                "process_task_id": task["id"], "condition_type": "Equal", "c_field_id": field_id, "v_field_id": field_id
+            })
+            task_ids.append(task["id"])
+
+        task_id = task_ids[0]
+        paths = [
+            f"/api/integration-processes/?agent_id={agent['id']}",
+            f"/api/process-schedules/?process_id={process['id']}",
+            f"/api/process-tasks/?process_id={process['id']}&limit=1",
+            "/api/process-tasks/?limit=1",
+            f"/api/connectors/?process_task_id={task_id}",
+            f"/api/fields/?process_task_id={task_id}",
+            f"/api/transformations/?process_task_id={task_id}",
+            f"/api/process-tasks/{task_id}/connectors",
+            f"/api/process-tasks/{task_id}/fields",
+            f"/api/process-tasks/{task_id}/transformations",
+            f"/api/integration-agents/{agent['id']}/graph",
+            f"/api/integration-agents/{agent['id']}/export",
+        ]
+        for path in paths:
+            response = client.get(path)
+            assert response.status_code == 200, path
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor:
+                assert client.get(f"{path}&after={cursor}").status_code == 200
+        assert client.delete(f"/api/process-tasks/{task_id}").status_code == 200
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", capture)
+
+    assert statements
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            scans = [row[-1] for row in plan if row[-1].startswith("SCAN")]
+            assert not scans, f"{statement} -> {scans}"
+
+def test_app_never_opens_the_checked_in_database(client):
+    import database
+    # Startup migrated, and background work writes through, this engine
+    assert database.engine.url.database == "test.db"
+    assert client.get("/api/metrics/startup").status_code == 200
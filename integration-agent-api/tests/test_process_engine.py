@@ -0,0 +1,550 @@
+import asyncio
+import json
+import time
+import tracemalloc
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+import checkpoints
+import connector_clients
+import process_engine
+from checkpoints import CheckpointStore
+from connector_clients import StubClient
+from run_history import RunHistoryStore
+from run_logs import RunLogStore
+from models.models import (
+    IntegrationAgent, IntegrationProcess, ProcessTask, Connector, Field, Transformation, TaskDependency, IntegrationType, TriggerType,
+    TaskType, LogicType, ConnectorType, DataType, ConditionType, InputSource, ServiceType, QueryType,
+)
+
+SAMPLE = [
+    {"id": 1, "customer": "acme", "amount": "250"},
+    {"id": 2, "customer": "acme", "amount": "40"},
+    {"id": 3, "customer": "globex", "amount": "900"},
+    {"id": 3, "customer": "globex", "amount": "900"},
+]
+
+def _create_process(db_session, output_connector: dict):
+    agent = IntegrationAgent(name="Engine Agent", code="ENGINE", type=IntegrationType.Process)
+    db_session.add(agent)
+    db_session.flush()
+    process = IntegrationProcess(integration_agent_id=agent.id, trigger_type=TriggerType.WebService, name="Invoices")
+    db_session.add(process)
+    db_session.flush()
+
+    fetch = ProcessTask(
+        integration_process_id=process.id, task_name="Fetch", type=TaskType.Input, sequence_number=10,
+        input_source=InputSource.Text, input=json.dumps(SAMPLE),
+    )
+    large = ProcessTask(
+        integration_process_id=process.id, task_name="Large only", type=TaskType.Logic, sequence_number=20,
+        logic_type=LogicType.RecordFilter,
+    )
+    unique = ProcessTask(
+        integration_process_id=process.id, task_name="Unique", type=TaskType.Logic, sequence_number=30,
+        logic_type=LogicType.UniqueFilter,
+    )
+    tag = ProcessTask(
+        integration_process_id=process.id, task_name="Tag", type=TaskType.Logic, sequence_number=40,
+        logic_type=LogicType.Transformation,
+    )
+    send = ProcessTask(integration_process_id=process.id, task_name="Send", type=TaskType.Output, sequence_number=50)
+    disabled = ProcessTask(
+        integration_process_id=process.id, task_name="Disabled", type=TaskType.Output, sequence_number=60, enabled=False,
+    )
+    db_session.add_all([fetch, large, unique, tag, send, disabled])
+    db_session.flush()
+
+    minimum = Field(process_task_id=large.id, field_name="amount", data_type=DataType.Single, value="100")
+    unique_key = Field(process_task_id=unique.id, field_name="id", data_type=DataType.Single)
+    acme = Field(process_task_id=tag.id, field_name="customer", data_type=DataType.Single, value="acme")
+    priority = Field(process_task_id=tag.id, field_name="priority", data_type=DataType.Single, value="high")
+    db_session.add_all([minimum, unique_key, acme, priority])
+    db_session.flush()
+    db_session.add_all([
+        Transformation(process_task_id=large.id, condition_type=ConditionType.GreaterThan, c_field_id=minimum.id),
+        Transformation(process_task_id=tag.id, condition_type=ConditionType.Equal, c_field_id=acme.id, v_field_id=priority.id),
+        Connector(process_task_id=send.id, **output_connector),
+    ])
+    db_session.commit()
+    return process.id
+
+def test_compare_reads_numbers_as_numbers():
+    assert process_engine.compare(ConditionType.GreaterThan, "250", "100")
+    assert not process_engine.compare(ConditionType.GreaterThan, "40", "100")
+    assert process_engine.compare(ConditionType.Equal, "acme", "acme")
+    assert process_engine.compare(ConditionType.LessThan, None, "a")
+
+def test_dry_run_reports_every_task(client, db_session):
+    # A real endpoint that must never be called during a dry run
+    process_id = _create_process(db_session, {
+        "data_type": DataType.List, "connector_type": ConnectorType.WebService,
+        "service_type": ServiceType.REST, "end_point": "http://partner.invalid/invoices",
+    })
+
+    response = client.post(f"/api/integration-processes/{process_id}/dry-run", json={"sample_size": 5, "profile_memory": True})
+    assert response.status_code == 200
+    report = response.json()
+    assert report["dry_run"] is True
+    assert report["status"] == "Stopped"
+    assert report["records"] == 2
+
+    tasks = {task["task_name"]: task for task in report["tasks"]}
+    assert list(tasks) == ["Fetch", "Large only", "Unique", "Tag", "Send"]
+    assert [(task["records_in"], task["records_out"]) for task in tasks.values()] == [(0, 4), (4, 3), (3, 2), (2, 2), (2, 2)]
+    assert tasks["Send"]["sample"] == [
+        {"id": 1, "customer": "acme", "amount": "250", "priority": "high"},
+        {"id": 3, "customer": "globex", "amount": "900"},
+    ]
+    for task in report["tasks"]:
+        assert task["wall_ms"] >= 0 and task["cpu_ms"] >= 0 and task["error"] is None
+    assert tasks["Fetch"]["peak_memory_bytes"] > 0
+
+    # An uploaded payload stands in for the Input task
+    report = client.post(f"/api/integration-processes/{process_id}/dry-run", json={
+        "payload": {"id": 9, "customer": "acme", "amount": 1000}, "sample_size": 1,
+    }).json()
+    assert report["tasks"][-1]["sample"] == [{"id": 9, "customer": "acme", "amount": 1000, "priority": "high"}]
+    # Memory is only traced when asked for
+    assert all(task["peak_memory_bytes"] == 0 for task in report["tasks"])
+    assert client.post("/api/integration-processes/999999/dry-run").status_code == 404
+
+def test_input_files_are_read_from_the_input_directory(client, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(process_engine, "INPUT_FILE_DIR", str(tmp_path / "inputs"))
+    (tmp_path / "inputs").mkdir()
+    (tmp_path / "inputs" / "invoices.json").write_text(json.dumps(SAMPLE[:1]))
+    (tmp_path / "secret.json").write_text(json.dumps([{"password": "hunter2"}]))
+    process_id = _create_process(db_session, {
+        "data_type": DataType.List, "connector_type": ConnectorType.WebService, "end_point": "http://partner.invalid",
+    })
+    fetch = db_session.query(ProcessTask).filter_by(integration_process_id=process_id, task_name="Fetch").one()
+    fetch.input_source = InputSource.File
+
+    for path, records in (("invoices.json", 1), ("../secret.json", None), (str(tmp_path / "secret.json"), None)):
+        fetch.input = path
+        db_session.commit()
+        report = client.post(f"/api/integration-processes/{process_id}/dry-run").json()
+        if records is None:
+            assert report["status"] == "Error" and "must be under" in report["tasks"][0]["error"]
+        else:
+            assert report["tasks"][0]["records_out"] == records
+
+def test_overlapping_profiled_runs_share_memory_tracing():
+    tracing = process_engine.MemoryTracing()
+    assert not tracemalloc.is_tracing()
+    tracing.acquire()
+    tracing.acquire()
+    tracing.release()
+    # The other run still profiles
+    assert tracemalloc.is_tracing()
+    tracing.release()
+    assert not tracemalloc.is_tracing()
+
+def test_execute_runs_in_the_background(client, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(process_engine, "run_history", RunHistoryStore(str(tmp_path / "history")))
+    monkeypatch.setattr(process_engine, "run_log_store", RunLogStore(str(tmp_path / "logs")))
+    monkeypatch.setattr(process_engine, "checkpoint_store", CheckpointStore(str(tmp_path / "checkpoints")))
+    output = tmp_path / "out.jsonl"
+    process_id = _create_process(db_session, {
+        "data_type": DataType.List, "connector_type": ConnectorType.File, "end_point": str(output),
+    })
+
+    response = client.post(f"/api/integration-processes/{process_id}/execute")
+    assert response.status_code == 202
+    run_id = response.json()["run_id"]
+    deadline = time.time() + 5
+    while client.get("/api/metrics/engine").json()["active"] and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert client.get(f"/api/integration-processes/{process_id}").json()["status"] == "Stopped"
+    assert [json.loads(line)["id"] for line in output.read_text().splitlines()] == [1, 3]
+    runs = process_engine.run_history.runs(0, time.time() + 1, process_id)
+    assert [(run["run_id"], run["status"], run["records"]) for run in runs] == [(run_id, "Stopped", 2)]
+    assert process_engine.run_log_store.tail(process_id, 1)[0]["message"] == "Run finished, 2 records"
+
+    # A run that fails leaves the process in Error with the reason logged
+    db_session.query(Connector).update({"end_point": str(tmp_path)})
+    db_session.commit()
+    client.post(f"/api/integration-processes/{process_id}/execute")
+    deadline = time.time() + 5
+    while client.get("/api/metrics/engine").json()["active"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert client.get(f"/api/integration-processes/{process_id}").json()["status"] == "Error"
+    messages = [record["message"] for record in process_engine.run_log_store.tail(process_id, 2)]
+    assert messages[0].startswith("Writing") and messages[1].startswith("Run failed")
+
+def test_concurrent_starts_launch_one_run(db_session, async_engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(process_engine, "run_history", RunHistoryStore(str(tmp_path / "history")))
+    monkeypatch.setattr(process_engine, "run_log_store", RunLogStore(str(tmp_path / "logs")))
+    monkeypatch.setattr(process_engine, "checkpoint_store", CheckpointStore(str(tmp_path / "checkpoints")))
+    output = tmp_path / "out.jsonl"
+    process_id = _create_process(db_session, {
+        "data_type": DataType.List, "connector_type": ConnectorType.File, "end_point": str(output),
+    })
+
+    async def scenario():
+        engine = process_engine.ProcessEngine()
+        sessions = async_sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+        async with sessions() as first, sessions() as second:
+            results = await asyncio.gather(
+                engine.start(first, process_id, resume=True), engine.start(second, process_id, resume=True),
+                return_exceptions=True,
+            )
+            await engine.wait(process_id)
+        return results, engine.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert isinstance(results[0], process_engine.Run)
+    assert isinstance(results[1], process_engine.EngineError)
+    assert stats["runs"] == 1 and stats["active"] == 0
+    assert [json.loads(line)["id"] for line in output.read_text().splitlines()] == [1, 3]
+
+def _task(task_id, sequence_number, enabled=True, depends_on=(), task_type=TaskType.Logic):
+    task = ProcessTask(id=task_id, sequence_number=sequence_number, enabled=enabled, type=task_type)
+    task.dependencies = [TaskDependency(depends_on_id=dependency) for dependency in depends_on]
+    return task
+
+def test_task_graph_groups_sequence_numbers_and_skips_disabled_tasks():
+    graph = process_engine.task_graph([
+        _task(1, 10, task_type=TaskType.Input), _task(2, 10, task_type=TaskType.Input),
+        _task(3, 20), _task(4, 20, enabled=False),
+        _task(5, 30), _task(6, 40, depends_on=[1]), _task(7, 50, depends_on=[4]),
+    ])
+    assert graph == {1: [], 2: [], 3: [1, 2], 5: [3, 1, 2], 6: [1], 7: [1, 2]}
+
+    with pytest.raises(process_engine.EngineError):
+        process_engine.task_graph([_task(1, 10, depends_on=[2]), _task(2, 20)])
+
+def test_tasks_on_the_default_sequence_number_run_in_creation_order():
+    # Created without sequence numbers, so all on the default one
+    graph = process_engine.task_graph([
+        _task(4, 10, task_type=TaskType.Output), _task(1, 10, task_type=TaskType.Input),
+        _task(2, 10), _task(3, 10, enabled=False), _task(5, 10, task_type=TaskType.Input),
+    ])
+    assert graph == {1: [], 5: [], 2: [1, 5], 4: [2]}
+    # Without Input tasks the first one is fed by the payload, if any
+    assert process_engine.task_graph([_task(2, 10, task_type=TaskType.Output), _task(1, 10)]) == {1: [], 2: [1]}
+
+def test_independent_branches_run_concurrently(client, db_session, monkeypatch):
+    process_id = _create_process(db_session, {
+        "data_type": DataType.List, "connector_type": ConnectorType.WebService, "end_point": "http://a.invalid",
+    })
+    # A second sink on the same sequence number as Send, and a task joining them
+    send = db_session.query(ProcessTask).filter_by(integration_process_id=process_id, task_name="Send").one()
+    archive = ProcessTask(integration_process_id=process_id, task_name="Archive", type=TaskType.Output, sequence_number=50)
+    count = ProcessTask(
+        integration_process_id=process_id, task_name="After both", type=TaskType.Logic, sequence_number=55,
+        logic_type=LogicType.Transformation,
+    )
+    db_session.add_all([archive, count])
+    db_session.flush()
+    db_session.add(Connector(
+        process_task_id=archive.id, data_type=DataType.List, connector_type=ConnectorType.File, end_point="/nonexistent",
+    ))
+    db_session.commit()
+
+    async def slow_send(self, records):
+        await asyncio.sleep(0.2)
+        self.sent.extend(records)
+    monkeypatch.setattr(StubClient, "send", slow_send)
+
+    started = time.perf_counter()
+    report = client.post(f"/api/integration-processes/{process_id}/dry-run").json()
+    elapsed = time.perf_counter() - started
+    assert report["status"] == "Stopped"
+    # Both sinks wait 0.2s on the same batch, side by side
+    assert elapsed < 0.35
+    tasks = {task["task_name"]: task for task in report["tasks"]}
+    assert tasks["Send"]["depends_on"] == tasks["Archive"]["depends_on"] == [tasks["Tag"]["task_id"]]
+    assert sorted(tasks["After both"]["depends_on"]) == sorted([send.id, archive.id])
+    # The batch both sinks handed on is taken once at the join
+    assert tasks["After both"]["records_in"] == 2
+    assert report["records"] == 2
+    assert report["critical_path"][-1] == tasks["After both"]["task_id"]
+    assert report["critical_path_ms"] < 350
+
+def test_parallel_inputs_are_joined(client, db_session):
+    process_id = _create_process(db_session, {
+        "data_type": DataType.List, "connector_type": ConnectorType.WebService, "end_point": "http://a.invalid",
+    })
+    db_session.add(ProcessTask(
+        integration_process_id=process_id, task_name="Fetch more", type=TaskType.Input, sequence_number=10,
+        input_source=InputSource.Text, input=json.dumps([{"id": 7, "customer": "initech", "amount": "500"}]),
+    ))
+    db_session.commit()
+
+    report = client.post(f"/api/integration-processes/{process_id}/dry-run").json()
+    tasks = {task["task_name"]: task for task in report["tasks"]}
+    assert tasks["Large only"]["records_in"] == 5
+    assert [record["id"] for record in tasks["Send"]["sample"]] == [1, 3, 7]
+
+def test_task_dependency_endpoints(client, db_session):
+    process_id = _create_process(db_session, {
+        "data_type": DataType.List, "connector_type": ConnectorType.WebService, "end_point": "http://a.invalid",
+    })
+    tasks = {task.task_name: task.id for task in db_session.query(ProcessTask).filter_by(integration_process_id=process_id)}
+    path = f"/api/process-tasks/{tasks['Send']}/dependencies"
+
+    assert client.get(path).json() == {"depends_on": []}
+    response = client.put(path, json={"depends_on": [tasks["Fetch"], tasks["Large only"]]})
+    assert response.json() == {"depends_on": sorted([tasks["Fetch"], tasks["Large only"]])}
+    assert client.put(path, json={"depends_on": [tasks["Fetch"]]}).status_code == 200
+    assert client.get(path).json() == {"depends_on": [tasks["Fetch"]]}
+
+    # Fetch comes first, so depending on Send would close a cycle
+    response = client.put(f"/api/process-tasks/{tasks['Fetch']}/dependencies", json={"depends_on": [tasks["Send"]]})
+    assert response.status_code == 400
+    assert client.put(path, json={"depends_on": [tasks["Send"]]}).status_code == 400
+    assert client.put(path, json={"depends_on": [999999]}).status_code == 400
+    assert client.get("/api/process-tasks/999999/dependencies").status_code == 404
+
+    # Moving Fetch after Send closes the same cycle through sequence numbers
+    order = [tasks[name] for name in ("Send", "Fetch", "Large only", "Unique", "Tag")]
+    assert client.post("/api/process-tasks/reorder", json=order).status_code == 400
+    moved = {"integration_process_id": process_id, "task_name": "Fetch", "type": "Input", "sequence_number": 60}
+    assert client.put(f"/api/process-tasks/{tasks['Fetch']}", json=moved).status_code == 400
+    assert client.post("/api/process-tasks/batch", json={"update": [{"id": tasks["Fetch"], **moved}]}).status_code == 400
+    agent_id = db_session.get(IntegrationProcess, process_id).integration_agent_id
+    bundle = client.get(f"/api/integration-agents/{agent_id}/export").json()
+    process_tasks = bundle["tables"]["process_tasks"]
+    columns = process_tasks["columns"]
+    fetch = next(row for row in process_tasks["rows"] if row[columns.index("task_name")] == "Fetch")
+    fetch[columns.index("sequence_number")] = 60
+    response = client.post("/api/integration-agents/import", json=bundle)
+    assert response.status_code == 400 and "depends on itself" in response.json()["detail"]
+
+    report = client.post(f"/api/integration-processes/{process_id}/dry-run").json()
+    send = next(task for task in report["tasks"] if task["task_name"] == "Send")
+    # Straight from the Input task, past every filter
+    assert send["records_in"] == 4
+
+    client.delete(f"/api/process-tasks/{tasks['Fetch']}")
+    assert db_session.query(TaskDependency).count() == 0
+
+def test_fan_out_reorders_within_the_in_flight_limit():
+    async def collect(ordered: bool, max_in_flight: int):
+        running, peak = 0, 0
+        async def work(item):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            # The first item is the slowest
+            await asyncio.sleep(0.05 if item == 0 else 0.001 * item)
+            running -= 1
+            return item
+        stats = process_engine.TaskStats(ProcessTask(id=1), 0)
+        results = [item async for item in process_engine.fan_out(range(10), work, 4, max_in_flight, ordered, stats)]
+        return results, peak, stats
+
+    results, peak, stats = asyncio.run(collect(True, 6))
+    assert results == list(range(10))
+    assert peak == 4
+    # Item 0 holds back everything after the sixth
+    assert stats.peak_in_flight == 6 and stats.peak_reordered == 5
+
+    results, peak, stats = asyncio.run(collect(False, 6))
+    assert sorted(results) == list(range(10)) and results[-1] == 0
+    assert stats.peak_reordered == 0
+
+    async def failing():
+        async def work(item):
+            if item == 2:
+                raise ValueError("item 2")
+            await asyncio.sleep(1)
+        return [item async for item in process_engine.fan_out(range(5), work, 5)]
+    started = time.perf_counter()
+    with pytest.raises(ValueError):
+        asyncio.run(failing())
+    assert time.perf_counter() - started < 0.5
+
+def test_single_connectors_send_records_in_parallel(client, db_session, monkeypatch):
+    process_id = _create_process(db_session, {
+        "data_type": DataType.Single, "connector_type": ConnectorType.WebService, "end_point": "http://a.invalid",
+    })
+    process = db_session.get(IntegrationProcess, process_id)
+    process.parallelism = 8
+    db_session.commit()
+
+    async def slow_send_one(self, record):
+        await asyncio.sleep(0.1 if record["id"] % 2 else 0.01)
+        self.sent.append(record)
+    monkeypatch.setattr(StubClient, "send_one", slow_send_one)
+    payload = [{"id": i, "customer": "initech", "amount": "500"} for i in range(16)]
+
+    started = time.perf_counter()
+    report = client.post(f"/api/integration-processes/{process_id}/dry-run", json={"payload": payload, "sample_size": 16}).json()
+    # One at a time this would take 0.88s
+    assert time.perf_counter() - started < 0.6
+    send = next(task for task in report["tasks"] if task["task_name"] == "Send")
+    assert [record["id"] for record in send["sample"]] == list(range(16))
+    assert 0 < send["peak_in_flight"] <= 16 and send["peak_reordered"] > 0
+
+    response = client.put(f"/api/integration-processes/{process_id}", json={
+        "integration_agent_id": process.integration_agent_id, "trigger_type": "WebService",
+        "parallelism": 8, "preserve_order": False,
+    })
+    assert response.json()["preserve_order"] is False
+    report = client.post(f"/api/integration-processes/{process_id}/dry-run", json={"payload": payload, "sample_size": 16}).json()
+    send = next(task for task in report["tasks"] if task["task_name"] == "Send")
+    ids = [record["id"] for record in send["sample"]]
+    # The fast even records come out ahead of the slow odd ones
+    assert sorted(ids) == list(range(16)) and sorted(ids[:8]) == list(range(0, 16, 2))
+    assert client.put(f"/api/integration-processes/{process_id}", json={
+        "integration_agent_id": process.integration_agent_id, "trigger_type": "WebService", "parallelism": 0,
+    }).status_code == 422
+
+def test_full_queues_hold_back_the_source(client, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(process_engine, "QUEUE_RECORDS", 20)
+    process_id = _create_process(db_session, {
+        "data_type": DataType.List, "connector_type": ConnectorType.File, "end_point": str(tmp_path / "out.jsonl"),
+    })
+    progress = {"fetched": 0, "sent": 0, "lead": 0}
+
+    async def fast_source(self, position=None):
+        for number in range(100):
+            progress["fetched"] += 1
+            yield [{"id": number * 10 + i, "customer": "initech", "amount": "500"} for i in range(10)]
+
+    async def slow_send(self, records):
+        await asyncio.sleep(0.002)
+        progress["sent"] += 1
+        progress["lead"] = max(progress["lead"], progress["fetched"] - progress["sent"])
+    monkeypatch.setattr(process_engine.TaskRunner, "source", fast_source)
+    monkeypatch.setattr(StubClient, "send", slow_send)
+
+    report = client.post(f"/api/integration-processes/{process_id}/dry-run").json()
+    assert report["records"] == 1000 and progress["sent"] == 100
+    # Four queues of two batches each between the source and Send, plus
+    # what each task has in hand; unbounded, the source would run 99 ahead
+    assert progress["lead"] <= 15
+    tasks = {task["task_name"]: task for task in report["tasks"]}
+    assert tasks["Send"]["peak_queue_depth"] <= 20 and tasks["Send"]["queue_depth"] == 0
+    assert tasks["Send"]["queue_unit"] == "records"
+    # Every task before the bottleneck waited on it
+    assert tasks["Fetch"]["stall_ms"] > 0 and tasks["Tag"]["stall_ms"] > 0
+    assert tasks["Send"]["stall_ms"] == 0
+
+    # The same run measured in bytes
+    monkeypatch.setattr(process_engine, "QUEUE_BYTES", 2000)
+    report = client.post(f"/api/integration-processes/{process_id}/dry-run").json()
+    send = next(task for task in report["tasks"] if task["task_name"] == "Send")
+    assert report["records"] == 1000 and send["queue_unit"] == "bytes"
+    assert 0 < send["peak_queue_depth"] <= 2000
+    assert client.get(f"/api/integration-processes/{process_id}/execution").status_code == 404
+
+def test_inbox_lets_in_the_rest_of_a_join():
+    async def scenario():
+        inbox = process_engine.Inbox(10)
+        assert await inbox.put((1, (1, 0), ["a"] * 10), 10) == 0
+        # Full, so the next key waits until the task releases something
+        waiting = asyncio.create_task(inbox.put((1, (1, 1), ["b"] * 5), 5))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        # ...but the other part of a key the task holds goes straight in
+        inbox.joining[(1, 0)] = {1: ["a"] * 10}
+        assert await inbox.put((2, (1, 0), ["c"] * 5), 5) == 0
+        assert inbox.held == 15 and inbox.peak == 15
+        inbox.release(15)
+        assert await waiting > 0
+        assert inbox.held == 5
+    asyncio.run(scenario())
+
+def test_database_rows_are_fetched_a_batch_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(connector_clients, "BATCH_SIZE", 100)
+    path = tmp_path / "rows.db"
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE invoices (id INTEGER, amount TEXT)")
+        connection.exec_driver_sql("INSERT INTO invoices VALUES (?, ?)", [(i, str(i)) for i in range(250)])
+    engine.dispose()
+    client = connector_clients.DatabaseClient(Connector(
+        id=1, data_type=DataType.List, connector_type=ConnectorType.Database,
+        connection_string=f"sqlite:///{path}", query="SELECT id, amount FROM invoices ORDER BY id",
+        query_type=QueryType.SelectQuery,
+    ))
+
+    async def read():
+        sizes = [len(batch) async for batch in client.fetch()]
+        # Stopping early closes the cursor
+        rows = client.fetch()
+        first = await rows.__anext__()
+        await rows.aclose()
+        await client.close()
+        return sizes, first[0]
+    assert asyncio.run(read()) == ([100, 100, 50], {"id": 0, "amount": "0"})
+
+def test_failed_run_resumes_from_its_checkpoint(client, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(process_engine, "run_history", RunHistoryStore(str(tmp_path / "history")))
+    monkeypatch.setattr(process_engine, "run_log_store", RunLogStore(str(tmp_path / "logs")))
+    monkeypatch.setattr(process_engine, "checkpoint_store", CheckpointStore(str(tmp_path / "checkpoints")))
+    monkeypatch.setattr("routers.integration_processes.checkpoint_store", process_engine.checkpoint_store)
+    monkeypatch.setattr(checkpoints, "CHECKPOINT_INTERVAL", 0)
+    monkeypatch.setattr(connector_clients, "BATCH_SIZE", 10)
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    source.write_text("".join(json.dumps({"id": i, "customer": "initech", "amount": "500"}) + "\n" for i in range(50)))
+    process_id = _create_process(db_session, {
+        "data_type": DataType.List, "connector_type": ConnectorType.File, "end_point": str(output),
+    })
+    fetch = db_session.query(ProcessTask).filter_by(integration_process_id=process_id, task_name="Fetch").one()
+    db_session.add(Connector(
+        process_task_id=fetch.id, data_type=DataType.List, connector_type=ConnectorType.File, end_point=str(source),
+    ))
+    db_session.commit()
+
+    def wait_for_runs():
+        deadline = time.time() + 5
+        while client.get("/api/metrics/engine").json()["active"] and time.time() < deadline:
+            time.sleep(0.01)
+
+    send = connector_clients.FileClient.send
+    calls = []
+    async def failing_send(self, records):
+        calls.append(len(records))
+        if len(calls) == 3:
+            raise connector_clients.ConnectorError("partner went away")
+        await send(self, records)
+    monkeypatch.setattr(connector_clients.FileClient, "send", failing_send)
+    client.post(f"/api/integration-processes/{process_id}/execute")
+    wait_for_runs()
+    assert client.get(f"/api/integration-processes/{process_id}").json()["status"] == "Error"
+    checkpoint = client.get(f"/api/integration-processes/{process_id}/checkpoint").json()
+    assert checkpoint["sources"] == {str(fetch.id): {"batches": 2, "position": [0, sum(len(line) for line in source.read_bytes().splitlines(True)[:20])]}}
+    assert len(output.read_text().splitlines()) == 20
+
+    # Starting the failed process again carries on with the third batch
+    monkeypatch.setattr(connector_clients.FileClient, "send", send)
+    assert client.post(f"/api/integration-processes/{process_id}/start").status_code == 200
+    wait_for_runs()
+    assert client.get(f"/api/integration-processes/{process_id}").json()["status"] == "Stopped"
+    assert [json.loads(line)["id"] for line in output.read_text().splitlines()] == list(range(50))
+    runs = process_engine.run_history.runs(0, time.time() + 1, process_id)
+    assert [(run["status"], run["records"]) for run in runs] == [("Stopped", 30), ("Error", 20)]
+    messages = [record["message"] for record in process_engine.run_log_store.tail(process_id, 2)]
+    assert messages == [f"Resumed run {checkpoint['run_id']} from its checkpoint", "Run finished, 30 records"]
+    assert client.get(f"/api/integration-processes/{process_id}/checkpoint").status_code == 404
+
+    # Stopped processes start without running anything
+    client.post(f"/api/integration-processes/{process_id}/start")
+    assert client.get("/api/metrics/engine").json()["active"] == 0
+
+def test_file_connectors_read_on_a_worker_thread(tmp_path, monkeypatch):
+    import threading
+    monkeypatch.setattr(connector_clients, "BATCH_SIZE", 2)
+    path = tmp_path / "in.jsonl"
+    path.write_text("".join(json.dumps({"id": number}) + "\n" for number in range(5)))
+    client = connector_clients.FileClient(Connector(
+        id=1, data_type=DataType.List, connector_type=ConnectorType.File, end_point=str(path),
+    ))
+    read_batch, threads = client._read_batch, set()
+    def tracked(file):
+        threads.add(threading.get_ident())
+        return read_batch(file)
+    client._read_batch = tracked
+
+    async def collect(position=None):
+        return [[record["id"] for record in batch] async for batch in client.fetch(position)]
+
+    assert asyncio.run(collect()) == [[0, 1], [2, 3], [4]]
+    assert threads and threading.get_ident() not in threads
+    # Resumes from the byte offset after the first batch
+    assert asyncio.run(collect(len(b'{"id": 0}\n{"id": 1}\n'))) == [[2, 3], [4]]
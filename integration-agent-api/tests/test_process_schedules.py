@@ -177,4 +177,42 @@ def test_delete_process_schedule(client, test_data):
     
     # Verify it's gone
     get_response = client.get(f"/api/process-schedules/{created_schedule['id']}")
-    assert get_response.status_code == 404 
\ No newline at end of file
+    assert get_response.status_code == 404 
+
+def test_batch_process_schedules(client, db_session):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Batch Agent", "code": "BATCH", "type": "Process"
+    }).json()
+    process_ids = [
+        client.post("/api/integration-processes/", json={
+            "integration_agent_id": agent["id"], "trigger_type": "Scheduler"
+        }).json()["id"]
+        for _ in range(2)
+    ]
+
+    response = client.post("/api/process-schedules/batch", json={
+        "create": [
+            {
+                "integration_process_id": process_id,
+                "recurrence_type": Recurrence.Daily.value,
+                "start_date": datetime.now(timezone.utc).isoformat(),
+                "hour": 6,
+            }
+            for process_id in process_ids
+        ],
+    })
+    assert response.status_code == 200
+    created = response.json()["created"]
+    assert [s["integration_process_id"] for s in created] == process_ids
+
+    update = dict(created[0], hour=25)
+    response = client.post("/api/process-schedules/batch", json={"update": [update]})
+    assert response.status_code == 400
+
+    response = client.post("/api/process-schedules/batch", json={
+        "update": [dict(created[0], hour=7)],
+        "delete": [created[1]["id"]],
+    })
+    assert response.status_code == 200
+    assert response.json()["updated"][0]["hour"] == 7
+    assert client.get(f"/api/process-schedules/{created[1]['id']}").status_code == 404
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import time
+import process_engine
+from checkpoints import CheckpointStore
+from run_history import RunHistoryStore
+from run_logs import RunLogStore
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from status_hub import StatusHub, status_hub
+from routers.process_status import _sse_events
+from models.models import IntegrationType, TriggerType
+
+def _create_process(client):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Status Agent", "code": "STATUS", "type": IntegrationType.Process.value
+    }).json()
+    return client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": TriggerType.WebService.value
+    }).json()
+
+def test_status_hub_coalesces_updates_per_tick():
+    async def scenario():
+        hub = StatusHub()
+        hub.publish(1, status="Running")
+        subscription = await hub.subscribe(None, [1])
+        updates = subscription.updates(tick=0.05)
+        assert await updates.__anext__() == [{"id": 1, "status": "Running"}]
+
+        # A burst between two ticks reaches the client as one message with
+        # the latest progress and the merged task counters
+        for done in range(1, 101):
+            hub.publish(1, run={"done": done, "total": 100}, tasks={7: {"records": done}})
+        hub.publish(1, tasks={8: {"records": 1}})
+        hub.publish(2, status="Running")
+        assert await updates.__anext__() == [{
+            "id": 1,
+            "status": "Running",
+            "run": {"done": 100, "total": 100},
+            "tasks": {"7": {"records": 100}, "8": {"records": 1}},
+        }]
+        assert hub.stats()["sent"] == 2
+
+        hub.unsubscribe(subscription)
+        assert hub.stats()["subscribers"] == 0
+
+    asyncio.run(scenario())
+
+def test_process_status_sse_events(client, async_engine):
+    process = _create_process(client)
+
+    async def scenario():
+        async with async_sessionmaker(bind=async_engine)() as db:
+            subscription = await status_hub.subscribe(db, None)
+        events = _sse_events(subscription, 0.05)
+        first = await events.__anext__()
+        assert first.startswith(b"event: status\ndata: ")
+        assert json.loads(first.split(b"data: ")[1]) == {"processes": [{"id": process["id"], "status": "Stopped"}]}
+        await events.aclose()
+        assert status_hub.stats()["subscribers"] == 0
+
+    asyncio.run(scenario())
+
+def test_process_status_websocket(client, async_engine):
+    process = _create_process(client)
+    other = _create_process(client)
+
+    with client.websocket_connect(f"/api/process-status/ws?process_id={process['id']}&tick=0.05") as socket:
+        assert socket.receive_json() == {"processes": [{"id": process["id"], "status": "Stopped"}]}
+
+        # Status is served from memory from now on, changes are pushed
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            if "FROM integration_processes" in statement:
+                statements.append(statement)
+        event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+        try:
+            with client.websocket_connect(f"/api/process-status/ws?process_id={process['id']}") as second:
+                assert second.receive_json()["processes"][0]["status"] == "Stopped"
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+        assert statements == []
+
+        client.post(f"/api/integration-processes/{other['id']}/start")
+        client.post(f"/api/integration-processes/{process['id']}/start")
+        assert socket.receive_json() == {"processes": [{"id": process["id"], "status": "Running"}]}
+
+        client.delete(f"/api/integration-processes/{process['id']}")
+        assert socket.receive_json() == {"processes": [{"id": process["id"], "status": None, "deleted": True}]}
+
+    assert client.get("/api/metrics/status-hub").json()["subscribers"] == 0
+
+def test_runs_publish_task_counters(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(process_engine, "run_history", RunHistoryStore(str(tmp_path / "history")))
+    monkeypatch.setattr(process_engine, "run_log_store", RunLogStore(str(tmp_path / "logs")))
+    monkeypatch.setattr(process_engine, "checkpoint_store", CheckpointStore(str(tmp_path / "checkpoints")))
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    source.write_text("".join(json.dumps({"id": number}) + "\n" for number in range(5)))
+    process = _create_process(client)
+    tasks = [
+        client.post("/api/process-tasks/", json={
+            "integration_process_id": process["id"], "task_name": name, "type": task_type, "sequence_number": sequence_number,
+        }).json()
+        for name, task_type, sequence_number in (("Read", "Input", 10), ("Write", "Output", 20))
+    ]
+    for task, path in zip(tasks, (source, output)):
+        client.post("/api/connectors/", json={
+            "process_task_id": task["id"], "data_type": "List", "connector_type": "File", "end_point": str(path),
+        })
+
+    client.post(f"/api/integration-processes/{process['id']}/execute")
+    deadline = time.time() + 5
+    while client.get("/api/metrics/engine").json()["active"] and time.time() < deadline:
+        time.sleep(0.01)
+
+    state = status_hub.states[process["id"]]
+    assert state["run"]["records"] == 5
+    assert state["tasks"] == {
+        str(tasks[0]["id"]): {"in": 0, "out": 5, "errors": 0},
+        str(tasks[1]["id"]): {"in": 5, "out": 5, "errors": 0},
+    }
@@ -1,5 +1,7 @@
 import pytest
+import json
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from tests.conftest import print_db_contents
 from models.models import TaskType, InputSource, LogicType, ConnectorType, OptionType, DataType
 
@@ -180,4 +182,153 @@ def test_reorder_process_tasks(client, test_data):
     
     # Verify sequence numbers are updated
     seq_numbers = [task["sequence_number"] for task in reordered_tasks]
-    assert seq_numbers == sorted(seq_numbers) 
\ No newline at end of file
+    assert seq_numbers == sorted(seq_numbers) 
+
+def test_page_process_tasks_with_cursor(client, db_session):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Paging Agent", "code": "PAGE", "type": "Process"
+    }).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": "WebService"
+    }).json()
+
+    # Equal and missing sequence numbers must not make rows skip or repeat
+    for i, sequence_number in enumerate([20, None, 10, 20, 10, None, 30]):
+        client.post("/api/process-tasks/", json={
+            "integration_process_id": process["id"],
+            "task_name": f"Paged Task {i}",
+            "type": TaskType.Input.value,
+            "sequence_number": sequence_number,
+        })
+
+    expected = client.get(f"/api/process-tasks/?process_id={process['id']}").json()
+    paged = []
+    after = None
+    while True:
+        params = {"process_id": process["id"], "limit": 3}
+        if after:
+            params["after"] = after
+        response = client.get("/api/process-tasks/", params=params)
+        assert response.status_code == 200
+        paged.extend(response.json())
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+
+    assert [task["id"] for task in paged] == [task["id"] for task in expected]
+    assert len(paged) == 7
+
+def test_batch_process_tasks(client, db_session, async_engine):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Batch Agent", "code": "BATCH", "type": "Process"
+    }).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": "WebService"
+    }).json()
+    existing = [
+        client.post("/api/process-tasks/", json={
+            "integration_process_id": process["id"],
+            "task_name": f"Existing Task {i}",
+            "type": TaskType.Input.value,
+            "static_fields": [{"key": "Old", "data_type": DataType.Single.value}],
+        }).json()
+        for i in range(2)
+    ]
+
+    batch = {
+        "create": [
+            {
+                "integration_process_id": process["id"],
+                "task_name": f"New Task {i}",
+                "type": TaskType.Output.value,
+                "sequence_number": i,
+                "static_fields": [{"key": f"Field{i}", "data_type": DataType.Single.value}],
+            }
+            for i in range(100)
+        ],
+        "update": [{
+            "id": existing[0]["id"],
+            "integration_process_id": process["id"],
+            "task_name": "Renamed Task",
+            "type": TaskType.Logic.value,
+            "static_fields": [{"key": "New", "data_type": DataType.List.value}],
+        }],
+        "delete": [existing[1]["id"]],
+    }
+
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.post("/api/process-tasks/batch", json=batch)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [task["task_name"] for task in data["created"]] == [f"New Task {i}" for i in range(100)]
+    assert data["created"][42]["static_fields"][0]["field_name"] == "Field42"
+    assert data["updated"][0]["task_name"] == "Renamed Task"
+    assert [field["field_name"] for field in data["updated"][0]["static_fields"]] == ["New"]
+    assert data["deleted"] == [existing[1]["id"]]
+    assert client.get(f"/api/process-tasks/{existing[1]['id']}").status_code == 404
+    assert len(statements) < 20
+
+def test_batch_process_tasks_is_atomic(client, db_session):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Batch Agent", "code": "BATCH", "type": "Process"
+    }).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": "WebService"
+    }).json()
+
+    response = client.post("/api/process-tasks/batch", json={
+        "create": [{
+            "integration_process_id": process["id"],
+            "task_name": "Never Saved",
+            "type": TaskType.Input.value,
+        }],
+        "delete": [999],
+    })
+    assert response.status_code == 404
+    assert "Process task not found: [999]" in response.json()["detail"]
+
+    tasks = client.get(f"/api/process-tasks/?process_id={process['id']}").json()
+    assert tasks == []
+
+def test_stream_process_tasks_ndjson(client, db_session):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Stream Agent", "code": "STREAM", "type": "Process"
+    }).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": "WebService"
+    }).json()
+    for i, sequence_number in enumerate([3, 1, None, 2]):
+        client.post("/api/process-tasks/", json={
+            "integration_process_id": process["id"],
+            "task_name": f"Stream Task {i}",
+            "type": TaskType.Input.value,
+            "sequence_number": sequence_number,
+            "static_fields": [{"key": f"Field {i}", "data_type": DataType.Single.value}],
+        })
+
+    # The list is served without the response model, so it must still match
+    # what the single task endpoint validates through Pydantic
+    expected = client.get(f"/api/process-tasks/?process_id={process['id']}").json()
+    for task in expected:
+        assert client.get(f"/api/process-tasks/{task['id']}").json() == task
+
+    ndjson = {"Accept": "application/x-ndjson"}
+    response = client.get(f"/api/process-tasks/?process_id={process['id']}", headers=ndjson)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == expected
+
+    # A stream resumes from a page cursor and only stops at limit when given one
+    cursor = client.get(f"/api/process-tasks/?process_id={process['id']}&limit=1").headers["X-Next-Cursor"]
+    response = client.get(f"/api/process-tasks/?process_id={process['id']}&after={cursor}", headers=ndjson)
+    assert [json.loads(line) for line in response.text.splitlines()] == expected[1:]
+    response = client.get(f"/api/process-tasks/?process_id={process['id']}&limit=2", headers=ndjson)
+    assert [json.loads(line) for line in response.text.splitlines()] == expected[:2]
@@ -0,0 +1,96 @@
+import asyncio
+import time
+import httpx
+import pytest
+import connector_clients
+from circuit_breakers import CircuitBreakers
+from connector_clients import ConnectorError, DatabaseClient, WebServiceClient
+from models.models import Connector, ConnectorType, DataType
+from rate_limits import RateLimiter
+
+def test_bucket_lets_a_burst_through_then_paces_calls():
+    async def scenario():
+        limiter = RateLimiter("worker")
+        started = time.perf_counter()
+        waits = [await limiter.acquire("WebService:http://partner", 50, 5) for _ in range(10)]
+        elapsed = time.perf_counter() - started
+        # Another target has a bucket of its own
+        assert await limiter.acquire("WebService:http://other", 50, 5) == 0
+        return waits, elapsed, limiter.stats()
+
+    waits, elapsed, stats = asyncio.run(scenario())
+    assert waits[:5] == [0] * 5 and all(wait > 0 for wait in waits[5:])
+    assert 0.09 < elapsed < 0.2
+    assert stats["targets"]["WebService:http://partner"]["throttled"] == 5
+
+def test_limit_is_shared_between_workers_through_the_database(tmp_path):
+    path = str(tmp_path / "limits.db")
+
+    async def scenario():
+        workers = [RateLimiter("database", path), RateLimiter("database", path)]
+        started = time.perf_counter()
+        # Three calls from each worker at 20 a second, no burst
+        await asyncio.gather(*(workers[i % 2].acquire("Database:abc", 20) for i in range(6)))
+        elapsed = time.perf_counter() - started
+        for worker in workers:
+            await worker.close()
+        return elapsed
+
+    assert asyncio.run(scenario()) >= 0.24
+
+def test_too_many_requests_holds_back_every_caller(monkeypatch):
+    limiter = RateLimiter("worker")
+    monkeypatch.setattr(connector_clients, "rate_limiter", limiter)
+    # The 429 surfaces instead of being retried
+    monkeypatch.setattr(connector_clients, "circuit_breakers", CircuitBreakers(max_retries=0))
+    answers = [httpx.Response(429, headers={"Retry-After": "0.2"}), httpx.Response(200, json={"ok": True})]
+    connector = Connector(
+        id=1, data_type=DataType.List, connector_type=ConnectorType.WebService, end_point="http://partner.invalid/orders",
+    )
+
+    async def scenario():
+        client = WebServiceClient(connector)
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: answers.pop(0)))
+        with pytest.raises(ConnectorError):
+            await client.send([{"id": 1}])
+        started = time.perf_counter()
+        await client.send([{"id": 1}])
+        waited = time.perf_counter() - started
+        await client.close()
+        return waited, client.throttled_ms
+
+    waited, throttled_ms = asyncio.run(scenario())
+    assert waited >= 0.15 and throttled_ms >= 150
+    assert limiter.stats()["targets"]["WebService:http://partner.invalid/orders"]["holds"] == 1
+
+def test_database_connectors_share_a_target_by_connection_string():
+    def client(connector_id, connection_string):
+        return DatabaseClient(Connector(
+            id=connector_id, data_type=DataType.List, connector_type=ConnectorType.Database,
+            connection_string=connection_string, query="SELECT 1",
+        ))
+    first = client(1, "postgresql://sync:secret@db/erp")
+    assert first.target == client(2, "postgresql://sync:secret@db/erp").target
+    assert first.target != client(3, "postgresql://sync:secret@db/crm").target
+    assert "secret" not in first.target
+
+def test_connector_rate_limit_settings(client):
+    agent = client.post("/api/integration-agents/", json={"name": "Limits", "code": "LIMITS", "type": "Process"}).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": "WebService",
+    }).json()
+    task = client.post("/api/process-tasks/", json={
+        "integration_process_id": process["id"], "task_name": "Send orders", "type": "Output",
+    }).json()
+    connector = {
+        "process_task_id": task["id"],
+        "data_type": DataType.List.value,
+        "connector_type": ConnectorType.WebService.value,
+        "end_point": "https://partner.example.com/orders",
+        "rate_limit": 2.5,
+        "rate_burst": 10,
+    }
+    response = client.post("/api/connectors/", json=connector)
+    assert response.status_code == 200
+    assert (response.json()["rate_limit"], response.json()["rate_burst"]) == (2.5, 10)
+    assert client.post("/api/connectors/", json={**connector, "rate_limit": 0}).status_code == 422
@@ -0,0 +1,112 @@
+import os
+import time
+from datetime import datetime, timezone
+import routers.run_history
+from run_history import RunHistoryStore
+from models.models import IntegrationType, TriggerType
+
+DAY = 86400
+# Midday on 2026-03-10, UTC
+NOW = datetime(2026, 3, 10, 12, tzinfo=timezone.utc).timestamp()
+
+def _run(store, run_id, started_at, process_id=1, status="Stopped", duration_ms=100, now=NOW):
+    store.record_run(
+        {"run_id": run_id, "process_id": process_id, "started_at": started_at, "status": status,
+         "duration_ms": duration_ms, "records": 10},
+        [{"task_id": 1, "duration_ms": duration_ms / 2, "records_in": 10, "records_out": 10},
+         {"task_id": 2, "duration_ms": duration_ms / 2, "records_in": 10, "errors": int(status == "Error")}],
+        now=now,
+    )
+
+def test_detail_is_partitioned_by_day_and_rolled_up(tmp_path):
+    store = RunHistoryStore(str(tmp_path), detail_days=3)
+    _run(store, "a", NOW - DAY + 60)
+    _run(store, "b", NOW - DAY + 120, status="Error", duration_ms=300)
+    _run(store, "c", NOW - DAY + 7200, process_id=2)
+    _run(store, "d", NOW - 60)
+    assert sorted(os.listdir(tmp_path)) == ["daily.db", "detail-20260309.db", "detail-20260310.db"]
+
+    # Yesterday is compacted on the first write of the next day
+    _run(store, "e", NOW, now=NOW + 1)
+    store.maintain(NOW + 1)
+    assert "hourly-202603.db" in os.listdir(tmp_path)
+    daily = store.aggregate(NOW - DAY, NOW, bucket="day")
+    assert daily[0] == {
+        "bucket": NOW - DAY - 12 * 3600, "process_id": 1, "runs": 2, "failed": 1,
+        "duration_ms_total": 400, "duration_ms_max": 300, "records": 20,
+    }
+    hourly = store.aggregate(NOW - DAY, NOW - DAY + 3 * 3600)
+    assert [(row["bucket"] - (NOW - DAY), row["process_id"], row["runs"]) for row in hourly] == [(0, 1, 2), (7200, 2, 1)]
+    tasks = store.aggregate(NOW - DAY, NOW - 12 * 3600, bucket="day", process_id=1, tasks=True)
+    assert [(row["task_id"], row["executions"], row["errors"]) for row in tasks] == [(1, 2, 0), (2, 2, 1)]
+
+    # Today is grouped from its detail partition on the fly
+    last_hour = store.aggregate(NOW - 3600, NOW + 1)
+    assert [(row["runs"], row["records"]) for row in last_hour] == [(1, 10), (1, 10)]
+    assert [run["run_id"] for run in store.runs(NOW - 2 * DAY, NOW + 1, process_id=1)] == ["e", "d", "b", "a"]
+    assert [run["run_id"] for run in store.runs(NOW - 2 * DAY, NOW + 1, limit=2)] == ["e", "d"]
+
+def test_directory_is_made_by_the_first_write(tmp_path):
+    root = tmp_path / "history"
+    store = RunHistoryStore(str(root))
+    assert store.stats()["detail_partitions"] == 0
+    assert store.runs(NOW - DAY, NOW) == []
+    assert not root.exists()
+    _run(store, "a", NOW - 60, now=NOW)
+    assert os.listdir(root)
+
+def test_expired_partitions_are_dropped_as_files(tmp_path):
+    store = RunHistoryStore(str(tmp_path), detail_days=2, hourly_months=1)
+    for days in range(3):
+        _run(store, f"run-{days}", NOW - days * DAY, now=NOW)
+    store.maintain(NOW + 70 * DAY)
+
+    # Detail and hourly partitions are gone, the daily rollups remain
+    assert os.listdir(tmp_path) == ["daily.db"]
+    assert store.stats()["dropped_partitions"] == 4
+    assert store.runs(NOW - 3 * DAY, NOW + 1) == []
+    assert store.aggregate(NOW - 3 * DAY, NOW + 1) == []
+    assert [row["runs"] for row in store.aggregate(NOW - 3 * DAY, NOW + 1, bucket="day")] == [1, 1, 1]
+
+    try:
+        _run(store, "late", NOW, now=NOW + 70 * DAY)
+        assert False, "a run older than the detail retention was accepted"
+    except ValueError:
+        pass
+
+def test_late_run_reopens_a_compacted_day(tmp_path):
+    store = RunHistoryStore(str(tmp_path))
+    _run(store, "a", NOW - DAY)
+    store.maintain(NOW)
+    _run(store, "b", NOW - DAY + 10)
+    assert [row["runs"] for row in store.aggregate(NOW - DAY, NOW, bucket="day")] == [2]
+    store.maintain(NOW)
+    assert [row["runs"] for row in store.aggregate(NOW - DAY, NOW, bucket="day")] == [2]
+
+def test_run_history_endpoints(client, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(routers.run_history, "run_history", RunHistoryStore(str(tmp_path)))
+    agent = client.post("/api/integration-agents/", json={
+        "name": "History Agent", "code": "HISTORY", "type": IntegrationType.Process.value
+    }).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": TriggerType.WebService.value
+    }).json()
+    path = f"/api/integration-processes/{process['id']}/runs"
+
+    started = time.time() - 5
+    response = client.post(path, json={
+        "run_id": "r1", "started_at": started, "status": "Error", "duration_ms": 50,
+        "tasks": [{"task_id": 3, "duration_ms": 50, "errors": 1}],
+    })
+    assert response.status_code == 204
+    assert client.post(path, json={"run_id": "old", "started_at": 0, "status": "Stopped"}).status_code == 400
+    assert client.post("/api/integration-processes/999999/runs", json={
+        "run_id": "r", "started_at": started, "status": "Stopped"
+    }).status_code == 404
+
+    assert [run["run_id"] for run in client.get(path).json()] == ["r1"]
+    stats = client.get("/api/run-history/stats", params={"process_id": process["id"]}).json()
+    assert [(row["runs"], row["failed"]) for row in stats] == [(1, 1)]
+    tasks = client.get("/api/run-history/task-stats").json()
+    assert [(row["task_id"], row["errors"]) for row in tasks] == [(3, 1)]
+    assert client.post("/api/run-history/maintain").status_code == 204
@@ -0,0 +1,129 @@
+import os
+import time
+import pytest
+from run_logs import RunLogStore, Segment
+import routers.run_logs
+from models.models import IntegrationType, TriggerType
+
+def _messages(records):
+    return [record["message"] for record in records]
+
+def test_segments_roll_over_and_seek_by_index(tmp_path):
+    store = RunLogStore(str(tmp_path), segment_bytes=20000)
+    for batch in range(20):
+        store.append(7, [{"level": "INFO", "message": f"record {batch * 50 + i}"} for i in range(50)])
+
+    directory = tmp_path / "7"
+    segments = sorted(name for name in os.listdir(directory) if name.endswith(".log"))
+    assert len(segments) > 2
+    # Each segment is named after its first sequence number
+    assert segments[0] == f"{1:020d}.log"
+
+    assert _messages(store.tail(7, 3)) == ["record 997", "record 998", "record 999"]
+    records = store.read(7, after_seq=500, limit=2)
+    assert [record["seq"] for record in records] == [501, 502]
+    assert _messages(store.read(7, after_seq=999)) == ["record 999"]
+
+    # Reads only the indexed neighbourhood of the cursor, not the whole log
+    segment = store._log(7).segments[-1]
+    assert segment.seek_seq(segment.last_seq) > 0
+    assert len(store.read(7)) == 100
+
+def test_time_range_and_search(tmp_path):
+    store = RunLogStore(str(tmp_path), segment_bytes=2000)
+    store.append(1, [{"level": "INFO", "message": f"early {i}"} for i in range(30)])
+    time.sleep(0.02)
+    middle = time.time()
+    store.append(1, [{"level": "ERROR", "message": "connector timeout", "task_id": 4}])
+    store.append(1, [{"level": "INFO", "message": f"late {i}"} for i in range(30)])
+    time.sleep(0.02)
+    end = time.time()
+    store.append(1, [{"level": "INFO", "message": "after the range"}])
+
+    records = store.read(1, since=middle, until=end, limit=1000)
+    assert _messages(records)[0] == "connector timeout"
+    assert len(records) == 31
+
+    assert _messages(store.search(1, r"time(out|d)", regex=True)) == ["connector timeout"]
+    assert store.search(1, r"time(out|d)") == []
+    assert _messages(store.search(1, "timeout")) == ["connector timeout"]
+    assert store.search(1, "late", level="ERROR") == []
+    assert len(store.search(1, r"^late \d+$", since=middle, limit=5, regex=True)) == 5
+    # The scan stops after about scan_bytes of messages
+    assert _messages(store.search(1, "late", since=middle, scan_bytes=30)) == ["late 0", "late 1", "late 2"]
+    with pytest.raises(ValueError):
+        store.search(1, "a" * 257, regex=True)
+    assert store.read(2) == []
+
+def test_search_rejects_nested_repeats_and_caps_messages(tmp_path, monkeypatch):
+    store = RunLogStore(str(tmp_path))
+    store.append(1, [{"message": "a" * 5000 + "!"}, {"message": "b" * 10 + "!"}])
+    for pattern in [r"(a+)+$", r"(a|b*)*", r"(?:x(a+))+"]:
+        with pytest.raises(ValueError):
+            store.search(1, pattern, regex=True)
+    assert len(store.search(1, r"(ab)+|\d{2}|a+!", regex=True)) == 0
+
+    # Only the start of each message is matched
+    monkeypatch.setattr("run_logs.SEARCH_MESSAGE_CHARS", 20)
+    assert _messages(store.search(1, "!")) == ["b" * 10 + "!"]
+
+def test_retention_drops_whole_segments(tmp_path):
+    store = RunLogStore(str(tmp_path), segment_bytes=1000, retention_bytes=5000)
+    for i in range(100):
+        store.append(3, [{"level": "INFO", "message": f"record {i:04d} " + "x" * 40}])
+
+    log = store._log(3)
+    assert sum(segment.size for segment in log.segments) <= 5000 + 1000
+    assert len(os.listdir(tmp_path / "3")) == 2 * len(log.segments)
+    # Reads start from the oldest record still kept
+    first = store.read(3, limit=1)[0]
+    assert first["seq"] == log.segments[0].base_seq
+    assert _messages(store.tail(3, 1)) == ["record 0099 " + "x" * 40]
+
+    aged = RunLogStore(str(tmp_path), segment_bytes=1000, retention_seconds=0)
+    aged.append(3, [{"level": "INFO", "message": "new"}])
+    assert len(aged._log(3).segments) == 1
+
+def test_reopen_recovers_sequence_and_torn_write(tmp_path):
+    store = RunLogStore(str(tmp_path), segment_bytes=100000)
+    store.append(5, [{"level": "INFO", "message": f"record {i}"} for i in range(200)])
+    segment_path = store._log(5).segments[-1].log_path
+    with open(segment_path, "ab") as log:
+        log.write(b'{"seq":201,"ts":1.0,"mess')
+
+    reopened = RunLogStore(str(tmp_path), segment_bytes=100000)
+    assert reopened.append(5, [{"level": "INFO", "message": "after restart"}]) == [201]
+    assert _messages(reopened.tail(5, 2)) == ["record 199", "after restart"]
+    assert Segment.open(str(tmp_path / "5"), 1).last_seq == 201
+
+def test_run_log_endpoints(client, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(routers.run_logs, "run_log_store", RunLogStore(str(tmp_path)))
+    monkeypatch.setattr("routers.integration_processes.run_log_store", routers.run_logs.run_log_store)
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Log Agent", "code": "LOG", "type": IntegrationType.Process.value
+    }).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": TriggerType.WebService.value
+    }).json()
+    path = f"/api/integration-processes/{process['id']}/logs"
+
+    response = client.post(path, json=[
+        {"message": "run started", "run_id": "r1"},
+        {"level": "ERROR", "message": "task failed", "run_id": "r1", "task_id": 9},
+    ])
+    assert response.json() == {"first_seq": 1, "last_seq": 2}
+
+    records = client.get(path).json()
+    assert [(record["seq"], record["level"]) for record in records] == [(1, "INFO"), (2, "ERROR")]
+    assert client.get(f"{path}?after_seq=1").json()[0]["task_id"] == 9
+    assert client.get(f"{path}/tail?lines=1").json()[0]["message"] == "task failed"
+    assert client.get(f"{path}/search", params={"q": "fail", "level": "ERROR"}).json()[0]["seq"] == 2
+    assert client.get(f"{path}/search", params={"q": "("}).json() == []
+    assert client.get(f"{path}/search", params={"q": "(", "regex": True}).status_code == 400
+    assert client.get(f"{path}/search", params={"q": "(a+)+$", "regex": True}).status_code == 400
+    assert client.get(f"{path}/search", params={"q": "f" * 257}).status_code == 422
+    assert client.get(f"{path}/search", params={"q": "fail(ed)?$", "regex": True}).json()[0]["seq"] == 2
+    assert client.get("/api/integration-processes/999999/logs").status_code == 404
+
+    client.delete(f"/api/integration-processes/{process['id']}")
+    assert not os.path.exists(tmp_path / str(process["id"]))
@@ -0,0 +1,103 @@
+import time
+from sqlalchemy import create_engine, insert
+from models.models import Base, IntegrationAgent, ProcessTask, DataType, ConnectorType
+from migrations import migrate
+from search_index import drop_search_index, match_expression
+
+def _process_with_connector(client):
+    agent = client.post("/api/integration-agents/", json={
+        "name": "Search Agent", "code": "SEARCH", "type": "Process"
+    }).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": "WebService",
+        "name": "Nightly sync", "description": "Copies invoices to the partner",
+    }).json()
+    task = client.post("/api/process-tasks/", json={
+        "integration_process_id": process["id"], "task_name": "Send invoices", "type": "Output"
+    }).json()
+    connector = client.post("/api/connectors/", json={
+        "process_task_id": task["id"],
+        "data_type": DataType.List.value,
+        "connector_type": ConnectorType.WebService.value,
+        "end_point": "https://partner.example.com/api/v2/invoices",
+    }).json()
+    return agent, process, task, connector
+
+def test_match_expression_quotes_every_word():
+    assert match_expression("invoice") == '"invoice"*'
+    assert match_expression('orders/in* OR "x"') == '"orders"* "in"* "OR"* "x"*'
+    assert match_expression("  -- ") is None
+
+def test_search_endpoint_follows_writes(client, db_session):
+    agent, process, task, connector = _process_with_connector(client)
+
+    hits = client.get("/api/search", params={"q": "invoice"}).json()
+    # The task name outranks the process description and the end point
+    assert [(hit["kind"], hit["id"]) for hit in hits] == [
+        ("task", task["id"]), ("process", process["id"]), ("connector", connector["id"]),
+    ]
+    assert all(hit["process_id"] == process["id"] for hit in hits)
+    assert "[invoices]" in hits[0]["snippet"]
+
+    hits = client.get("/api/search", params={"q": "partner.example.com/api", "kind": "connector"}).json()
+    assert [(hit["id"], hit["parent_id"]) for hit in hits] == [(connector["id"], task["id"])]
+    assert client.get("/api/search", params={"q": "SEARCH", "kind": ["agent", "process"]}).json()[0]["id"] == agent["id"]
+
+    # Updates and deletes are reflected straight away
+    client.put(f"/api/connectors/{connector['id']}", json={
+        "process_task_id": task["id"],
+        "data_type": DataType.List.value,
+        "connector_type": ConnectorType.MessageQueue.value,
+        "end_point": "https://billing.example.com/hooks",
+        "queue_path": "billing/outbound",
+    })
+    assert client.get("/api/search", params={"q": "partner", "kind": "connector"}).json() == []
+    assert client.get("/api/search", params={"q": "outbound"}).json()[0]["id"] == connector["id"]
+    client.delete(f"/api/connectors/{connector['id']}")
+    assert client.get("/api/search", params={"q": "outbound"}).json() == []
+    assert client.get("/api/search", params={"q": "%%"}).json() == []
+
+def test_search_index_is_built_for_existing_rows(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    with engine.begin() as connection:
+        Base.metadata.create_all(connection)
+        drop_search_index(connection)
+        connection.exec_driver_sql("PRAGMA user_version = 2")
+        connection.execute(insert(IntegrationAgent), [{"name": "Legacy", "code": "OLD", "type": "Process"}])
+    with engine.begin() as connection:
+        migrate(connection)
+        assert connection.exec_driver_sql("SELECT entity_id FROM search_index WHERE search_index MATCH 'legacy'").scalar() == 1
+    engine.dispose()
+
+def test_search_scales_to_many_entities(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'many.db'}")
+    with engine.begin() as connection:
+        migrate(connection)
+        connection.execute(insert(IntegrationAgent), [{"name": "Agent", "code": "A", "type": "Process"}])
+        connection.exec_driver_sql(
+            "INSERT INTO integration_processes (integration_agent_id, name, trigger_type) VALUES (1, ?, 'WebService')",
+            [(f"Process {i}",) for i in range(1000)],
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO process_tasks (integration_process_id, task_name, type) VALUES (?, ?, 'Output')",
+            [(i % 1000 + 1, f"Task {i}") for i in range(20000)],
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO connectors (process_task_id, data_type, connector_type, end_point) VALUES (?, 'List', 'WebService', ?)",
+            [(i % 20000 + 1, f"https://host{i % 500}.example.com/api/resource{i}") for i in range(80000)],
+        )
+        connection.execute(insert(ProcessTask), [
+            {"integration_process_id": 7, "task_name": "Fetch invoice batch", "type": "Input"}
+        ])
+        assert connection.exec_driver_sql("SELECT count(*) FROM search_index").scalar() == 101002
+
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        hits = connection.exec_driver_sql(
+            "SELECT kind, entity_id FROM search_index WHERE search_index MATCH ? ORDER BY bm25(search_index) LIMIT 50",
+            (match_expression("invoice"),),
+        ).all()
+        elapsed = time.perf_counter() - started
+    assert hits == [("task", 20001)]
+    assert elapsed < 0.05
+    engine.dispose()
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import time
+import process_engine
+from checkpoints import CheckpointStore
+from run_history import RunHistoryStore
+from run_logs import RunLogStore
+from webhook_buffer import EventBuffer, WebhookIngest, WebhookStream
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from models.models import ConnectorType, DataType, IntegrationProcess, TriggerType
+
+def test_buffer_survives_a_reopen(tmp_path):
+    directory = str(tmp_path / "process-1")
+    buffer = EventBuffer(directory, idempotency_seconds=60, fsync=False)
+    now = time.time()
+    assert buffer.append([("a", {"id": 1}), (None, {"id": 2})], now) == 0
+    buffer.remember("a", now)
+    assert buffer.append([("b", {"id": 3})], now) == 2
+    assert buffer.read(2) == [{"id": 1}, {"id": 2}]
+    buffer.commit()
+    buffer.close()
+    # A write cut short by a crash
+    with open(buffer._path(0), "ab") as log:
+        log.write(b'{"seq":3,"ts":')
+
+    reopened = EventBuffer(directory, idempotency_seconds=60, fsync=False)
+    assert (reopened.pending, reopened.next_seq) == (1, 3)
+    assert reopened.seen("a", time.time()) and reopened.seen("b", time.time())
+    assert not reopened.seen("a", now + 61)
+    assert reopened.read(10) == [{"id": 3}]
+    # A failed run's batch is read again
+    reopened.rewind()
+    assert reopened.read(10) == [{"id": 3}]
+
+def test_consumed_segments_go_once_their_keys_expire(tmp_path):
+    buffer = EventBuffer(str(tmp_path / "process-1"), idempotency_seconds=0, segment_bytes=1, fsync=False)
+    for number in range(4):
+        buffer.append([(f"key-{number}", {"id": number})], time.time())
+    assert len(buffer.segments) == 4
+    assert buffer.read(3) == [{"id": 0}, {"id": 1}, {"id": 2}]
+    # The segment the cursor is in stays
+    assert buffer.commit() == 2
+    assert [segment["base"] for segment in buffer.segments] == [2, 3]
+    assert buffer.read(3) == [{"id": 3}]
+
+def test_duplicate_of_a_failed_write_is_written_instead(tmp_path):
+    buffer = EventBuffer(str(tmp_path / "process-1"), fsync=False)
+    append = buffer.append
+    failures = [OSError("disk full")]
+    def flaky_append(events, ts):
+        if failures:
+            raise failures.pop()
+        return append(events, ts)
+    buffer.append = flaky_append
+
+    async def scenario():
+        stream = WebhookStream(1, buffer, sessions=None)
+        first, second = await asyncio.gather(
+            stream.accept({"id": 1}, "order-1"), stream.accept({"id": 1}, "order-1"), return_exceptions=True,
+        )
+        third = await stream.accept({"id": 1}, "order-1")
+        return first, second, third, stream
+
+    first, second, third, stream = asyncio.run(scenario())
+    assert isinstance(first, OSError)
+    assert second == (0, False)
+    assert third == (None, True)
+    assert (stream.accepted, stream.duplicates, buffer.pending) == (1, 1, 1)
+
+def test_batches_of_processes_no_longer_on_webhooks_are_dead_lettered(client, db_session, async_engine, tmp_path):
+    agent = client.post("/api/integration-agents/", json={"name": "Hooks", "code": "HOOKS", "type": "Process"}).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": "WebHook",
+    }).json()
+    db_session.query(IntegrationProcess).filter_by(id=process["id"]).update({"trigger_type": TriggerType.WebService})
+    db_session.commit()
+
+    async def scenario(process_id):
+        buffer = EventBuffer(str(tmp_path / f"process-{process_id}"), fsync=False)
+        stream = WebhookStream(process_id, buffer, async_sessionmaker(bind=async_engine, class_=AsyncSession))
+        await stream.accept({"id": 1}, "order-1")
+        await stream.accept({"id": 2})
+        await stream._run_batch()
+        await stream.close()
+        return stream
+
+    for process_id, reason in ((process["id"], "process triggered by WebService"), (999999, "process deleted")):
+        stream = asyncio.run(scenario(process_id))
+        assert (stream.runs, stream.dead_lettered, stream.buffer.pending) == (0, 2, 0)
+        letters = (tmp_path / f"process-{process_id}" / "dead-letter.jsonl").read_text().splitlines()
+        assert [(json.loads(line)["payload"], json.loads(line)["reason"]) for line in letters] == [({"id": 1}, reason), ({"id": 2}, reason)]
+
+def test_webhooks_run_in_micro_batches(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(process_engine, "run_history", RunHistoryStore(str(tmp_path / "history")))
+    monkeypatch.setattr(process_engine, "run_log_store", RunLogStore(str(tmp_path / "logs")))
+    monkeypatch.setattr(process_engine, "checkpoint_store", CheckpointStore(str(tmp_path / "checkpoints")))
+    ingest = WebhookIngest(str(tmp_path / "webhooks"), batch_records=3, batch_seconds=0.2, fsync=False)
+    monkeypatch.setattr("routers.integration_processes.webhook_ingest", ingest)
+    output = tmp_path / "out.jsonl"
+    agent = client.post("/api/integration-agents/", json={"name": "Hooks", "code": "HOOKS", "type": "Process"}).json()
+    process = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": "WebHook",
+    }).json()
+    task = client.post("/api/process-tasks/", json={
+        "integration_process_id": process["id"], "task_name": "Write orders", "type": "Output",
+    }).json()
+    client.post("/api/connectors/", json={
+        "process_task_id": task["id"], "data_type": DataType.List.value,
+        "connector_type": ConnectorType.File.value, "end_point": str(output),
+    })
+
+    url = f"/api/integration-processes/{process['id']}/webhook"
+    answers = [client.post(url, json={"id": number}, headers={"Idempotency-Key": f"order-{number}"}) for number in range(7)]
+    assert [answer.status_code for answer in answers] == [202] * 7
+    assert [answer.json()["seq"] for answer in answers] == list(range(7))
+    duplicate = client.post(url, json={"id": 2}, headers={"Idempotency-Key": "order-2"})
+    assert duplicate.status_code == 202 and duplicate.json() == {"seq": None, "duplicate": True}
+
+    deadline = time.time() + 5
+    while ingest.stats()[str(process["id"])]["pending"] and time.time() < deadline:
+        time.sleep(0.02)
+    while client.get("/api/metrics/engine").json()["active"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert [json.loads(line)["id"] for line in output.read_text().splitlines()] == list(range(7))
+    stats = client.get("/api/metrics/webhooks").json()[str(process["id"])]
+    assert (stats["accepted"], stats["duplicates"], stats["records"]) == (7, 1, 7)
+    assert 2 <= stats["runs"] <= 4
+
+    other = client.post("/api/integration-processes/", json={
+        "integration_agent_id": agent["id"], "trigger_type": "WebService",
+    }).json()
+    assert client.post(f"/api/integration-processes/{other['id']}/webhook", json={"id": 1}).status_code == 409
+    assert client.post("/api/integration-processes/999999/webhook", json={"id": 1}).status_code == 404
@@ -0,0 +1,19 @@
+import pytest
+from worker_lock import DirectoryLocked, DirectoryLocks
+
+def test_second_worker_cannot_take_the_same_directories(tmp_path):
+    first, second = DirectoryLocks(), DirectoryLocks()
+    directories = [str(tmp_path / "logs"), str(tmp_path / "webhooks")]
+    first.acquire(directories)
+    with pytest.raises(DirectoryLocked):
+        second.acquire([str(tmp_path / "other"), directories[1]])
+    # Nothing stays locked after a failed start
+    assert second.stats() == {"locked": []}
+
+    first.release()
+    second.acquire(directories)
+    assert second.stats() == {"locked": directories}
+    second.release()
+
+def test_app_locks_its_store_directories(client):
+    assert len(client.get("/api/metrics/directory-locks").json()["locked"]) == 4
@@ -0,0 +1,180 @@
+import hashlib
+from typing import Dict, Set
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+
+from models.models import Base, EntityVersion, IntegrationProcess, ProcessTask
+
+# For each versioned table, the columns naming the aggregates a row belongs
+# to. Tasks roll up into their process and processes into their agent.
+OWNERS = {
+    "integration_agents": {"id": "agent"},
+    "integration_processes": {"id": "process", "integration_agent_id": "agent"},
+    "process_schedules": {"integration_process_id": "process"},
+    "process_tasks": {"id": "task", "integration_process_id": "process"},
+    "fields": {"process_task_id": "task"},
+    "connectors": {"process_task_id": "task"},
+    "transformations": {"process_task_id": "task"},
+    "task_dependencies": {"task_id": "task"},
+}
+
+# Deleting a row can cascade into these tables without them being flushed
+# on their own, so their list versions move along with it
+CASCADES = {
+    mapper.local_table.name: {
+        relationship.mapper.local_table.name
+        for relationship in mapper.relationships if relationship.cascade.delete
+    }
+    for mapper in Base.registry.mappers
+}
+
+versions_table = EntityVersion.__table__
+
+def _pending(session: Session) -> Dict[str, Set]:
+    return session.info.setdefault("pending_versions", {"table": set(), "agent": set(), "process": set(), "task": set()})
+
+def _record(session: Session, table_name: str, rows):
+    pending = _pending(session)
+    pending["table"].add(table_name)
+    pending["table"].update(CASCADES.get(table_name, ()))
+    for row in rows:
+        for column, kind in OWNERS[table_name].items():
+            value = row.get(column)
+            if value is not None:
+                pending[kind].add(value)
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table_name = getattr(obj, "__tablename__", None)
+        if table_name not in OWNERS:
+            continue
+        # Read loaded state only, plus the old value of a changed owner,
+        # so that moving a row bumps both its old and new aggregate
+        state = inspect(obj)
+        rows = [{column: state.dict.get(column) for column in OWNERS[table_name]}]
+        for column in OWNERS[table_name]:
+            rows.extend({column: old} for old in state.attrs[column].history.deleted)
+        _record(session, table_name, rows)
+
+def _owners_in(table, whereclause):
+    # "owner = value" or "owner IN (...)" on a table with a single owner
+    # column already names every owner, so no lookup is needed
+    if (
+        len(OWNERS[table.name]) != 1
+        or not isinstance(whereclause, BinaryExpression)
+        or whereclause.operator not in (operators.eq, operators.in_op)
+        or not isinstance(whereclause.right, BindParameter)
+        or getattr(getattr(whereclause.left, "table", None), "name", None) != table.name
+        or whereclause.left.name not in OWNERS[table.name]
+    ):
+        return None
+    values = whereclause.right.value
+    return [{whereclause.left.name: value} for value in (values if whereclause.right.expanding else [values])]
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = orm_execute_state.statement.table
+    if table.name not in OWNERS:
+        return
+
+    session = orm_execute_state.session
+    params = orm_execute_state.parameters or []
+    if isinstance(params, dict):
+        params = [params]
+    rows = list(params)
+
+    whereclause = getattr(orm_execute_state.statement, "whereclause", None)
+    owners = _owners_in(table, whereclause)
+    if owners is not None:
+        rows.extend(owners)
+    elif not orm_execute_state.is_insert:
+        # Rows about to change or disappear still name their old owners
+        columns = [table.c[column] for column in OWNERS[table.name]]
+        if whereclause is not None:
+            query = select(*columns).where(whereclause)
+        else:
+            ids = [row["id"] for row in rows if "id" in row]
+            query = select(*columns).where(table.c.id.in_(ids)) if ids else select(*columns)
+        rows.extend(row._asdict() for row in session.connection().execute(query))
+    _record(session, table.name, rows)
+
+@event.listens_for(Session, "before_commit")
+def _bump_versions(session):
+    # Changes made since the last flush are only flushed after this hook
+    session.flush()
+    pending = session.info.pop("pending_versions", None)
+    if not pending:
+        return
+
+    connection = session.connection()
+    if pending["task"]:
+        pending["process"].update(connection.execute(
+            select(ProcessTask.integration_process_id).where(ProcessTask.id.in_(pending["task"]))
+        ).scalars())
+    if pending["process"]:
+        pending["agent"].update(connection.execute(
+            select(IntegrationProcess.integration_agent_id).where(IntegrationProcess.id.in_(pending["process"]))
+        ).scalars())
+
+    scopes = sorted(pending.pop("table"))
+    for kind, ids in pending.items():
+        scopes.extend(f"{kind}:{id}" for id in ids if id is not None)
+    connection.execute(_bump_statement(), [{"scope": scope, "version": 1} for scope in scopes])
+
+@event.listens_for(Session, "after_rollback")
+def _discard_versions(session):
+    session.info.pop("pending_versions", None)
+
+def _bump_statement():
+    return sqlite_insert(versions_table).on_conflict_do_update(
+        index_elements=[versions_table.c.scope], set_={"version": versions_table.c.version + 1}
+    )
+
+async def bump_versions(session: AsyncSession, *scopes: str):
+    """Move scopes that are not tied to config tables, such as user:<id>."""
+    await session.execute(_bump_statement(), [{"scope": scope, "version": 1} for scope in scopes])
+
+async def current_version(db: AsyncSession, scope: str) -> int:
+    return await db.scalar(select(versions_table.c.version).where(versions_table.c.scope == scope)) or 0
+
+def with_version(statement, scope):
+    """Add the current version of scope, a SQL expression, as a column of statement."""
+    return statement.add_columns(func.coalesce(versions_table.c.version, 0)).outerjoin(
+        versions_table, versions_table.c.scope == scope
+    )
+
+async def conditional_get(request: Request, response: Response, db: AsyncSession, *scopes: str) -> str:
+    """Set a strong ETag for the current versions of scopes, or answer 304.
+
+    This is a single primary-key lookup made before the endpoint loads any
+    rows, so polling unchanged data never reaches the ORM. The ETag is
+    returned for endpoints that build their own Response.
+    """
+    versions = dict((await db.execute(
+        select(versions_table.c.scope, versions_table.c.version).where(versions_table.c.scope.in_(scopes))
+    )).all())
+    # The Accept header picks the representation (JSON array or NDJSON)
+    key = "|".join(
+        [request.url.path, request.url.query, request.headers.get("accept", "")]
+        + [f"{scope}={versions.get(scope, 0)}" for scope in scopes]
+    )
+    etag = f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+    # If-None-Match uses weak comparison, so ignore any W/ prefix
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        raise HTTPException(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept"
+    return etag
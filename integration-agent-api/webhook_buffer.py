@@ -0,0 +1,483 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from models.models import IntegrationProcess, ProcessStatus, TriggerType
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_DIR = os.getenv("INTEGRATION_AGENT_WEBHOOK_DIR", "webhooks")
+# A run starts once this many events wait, or once the oldest has waited
+# this long, and takes at most this many
+WEBHOOK_BATCH_RECORDS = int(os.getenv("INTEGRATION_AGENT_WEBHOOK_BATCH_RECORDS", "1000"))
+WEBHOOK_BATCH_SECONDS = float(os.getenv("INTEGRATION_AGENT_WEBHOOK_BATCH_SECONDS", "1"))
+# An event repeating an earlier Idempotency-Key is dropped for this long
+WEBHOOK_IDEMPOTENCY_SECONDS = float(os.getenv("INTEGRATION_AGENT_WEBHOOK_IDEMPOTENCY_SECONDS", "600"))
+# Events a process may have waiting before its webhooks are turned away
+WEBHOOK_MAX_PENDING = int(os.getenv("INTEGRATION_AGENT_WEBHOOK_MAX_PENDING", "1000000"))
+# A batch whose run failed is run again after this long
+WEBHOOK_RETRY_SECONDS = float(os.getenv("INTEGRATION_AGENT_WEBHOOK_RETRY_SECONDS", "30"))
+WEBHOOK_SEGMENT_BYTES = int(os.getenv("INTEGRATION_AGENT_WEBHOOK_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+# Whether each write reaches the disk before its webhooks are acknowledged
+WEBHOOK_FSYNC = os.getenv("INTEGRATION_AGENT_WEBHOOK_FSYNC", "1") == "1"
+
+class BufferFull(Exception):
+    """A process has WEBHOOK_MAX_PENDING events waiting already."""
+
+class EventBuffer:
+    """The webhook events of one process, in append-only segment files of
+    JSON lines named after their first sequence number, and how far runs
+    have consumed them.
+
+    A segment is removed once it is consumed and every idempotency key in
+    it has expired, so the key index is rebuilt from the files alone when
+    the buffer is opened. Writes and commits hold the lock and reads only
+    go as far as what was written under it; the key index belongs to the
+    event loop.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        idempotency_seconds: float = WEBHOOK_IDEMPOTENCY_SECONDS,
+        segment_bytes: int = WEBHOOK_SEGMENT_BYTES,
+        fsync: bool = WEBHOOK_FSYNC,
+    ):
+        self.directory = directory
+        self.idempotency_seconds = idempotency_seconds
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = None
+        self.segments: List[dict] = []
+        self.next_seq = 0
+        # Where the next unconsumed event is: its sequence number, segment
+        # and byte offset. cursor moves on as a batch is read, committed
+        # once its run has finished.
+        self.committed = {"seq": 0, "segment": 0, "offset": 0}
+        self.keys: "OrderedDict[str, float]" = OrderedDict()
+        self._open()
+        self.cursor = dict(self.committed)
+
+    def _path(self, base: int) -> str:
+        return os.path.join(self.directory, f"{base:020d}.log")
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(os.path.join(self.directory, "offset.json"), "r", encoding="utf-8") as file:
+                self.committed = json.load(file)
+        except (FileNotFoundError, ValueError):
+            pass
+        now = time.time()
+        bases = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".log") and name[:-4].isdigit())
+        for base in bases:
+            with open(self._path(base), "rb+") as log:
+                data = log.read()
+                # Drop an event cut short by a crash, it was never acknowledged
+                if data and not data.endswith(b"\n"):
+                    data = data[:data.rfind(b"\n") + 1]
+                    log.truncate(len(data))
+            segment = {"base": base, "size": len(data), "last_ts": 0.0}
+            for line in data.splitlines():
+                event = json.loads(line)
+                self.next_seq, segment["last_ts"] = event["seq"] + 1, event["ts"]
+                if event["key"] is not None and event["ts"] + self.idempotency_seconds > now:
+                    self.keys[event["key"]] = event["ts"] + self.idempotency_seconds
+            self.segments.append(segment)
+        self.next_seq = max(self.next_seq, self.committed["seq"])
+
+    @property
+    def pending(self) -> int:
+        return self.next_seq - self.committed["seq"]
+
+    def seen(self, key: str, now: float) -> bool:
+        # Keys expire in the order they were written
+        while self.keys and next(iter(self.keys.values())) <= now:
+            self.keys.popitem(last=False)
+        return key in self.keys
+
+    def remember(self, key: str, ts: float):
+        self.keys[key] = ts + self.idempotency_seconds
+
+    def append(self, events: List[Tuple[Optional[str], object]], ts: float) -> int:
+        """Write events, as (idempotency key, payload), and return the
+        sequence number of the first."""
+        with self._lock:
+            if not self.segments or self.segments[-1]["size"] >= self.segment_bytes:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self.segments.append({"base": self.next_seq, "size": 0, "last_ts": ts})
+            segment = self.segments[-1]
+            if self._file is None:
+                self._file = open(self._path(segment["base"]), "ab")
+            first = self.next_seq
+            data = "".join(
+                json.dumps({"seq": first + index, "ts": ts, "key": key, "payload": payload}, separators=(",", ":"), default=str) + "\n"
+                for index, (key, payload) in enumerate(events)
+            ).encode("utf-8")
+            try:
+                self._file.write(data)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except Exception:
+                # Leave no half-written events behind the next write
+                self._file.truncate(segment["size"])
+                raise
+            segment["size"] += len(data)
+            segment["last_ts"] = ts
+            self.next_seq += len(events)
+            return first
+
+    def read(self, limit: int) -> List[object]:
+        """The payloads of up to limit events after the cursor, which moves
+        past them."""
+        with self._lock:
+            segments = [(segment["base"], segment["size"]) for segment in self.segments]
+        payloads = []
+        seq, base, offset = self.cursor["seq"], self.cursor["segment"], self.cursor["offset"]
+        for segment_base, size in segments:
+            if segment_base < base or len(payloads) >= limit:
+                continue
+            position = offset if segment_base == base else 0
+            with open(self._path(segment_base), "rb") as log:
+                log.seek(position)
+                while position < size and len(payloads) < limit:
+                    line = log.readline()
+                    position += len(line)
+                    payloads.append(json.loads(line)["payload"])
+            base, offset = segment_base, position
+        self.cursor = {"seq": seq + len(payloads), "segment": base, "offset": offset}
+        return payloads
+
+    def rewind(self):
+        """Read the events after the committed position again."""
+        self.cursor = dict(self.committed)
+
+    def commit(self) -> int:
+        """Mark the events read so far consumed and remove the segments no
+        longer needed. Returns how many were removed."""
+        with self._lock:
+            path = os.path.join(self.directory, "offset.json")
+            with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(self.cursor, file)
+            os.replace(f"{path}.tmp", path)
+            self.committed = dict(self.cursor)
+            now, removed = time.time(), 0
+            while (
+                len(self.segments) > 1
+                and self.segments[0]["base"] < self.committed["segment"]
+                and self.segments[0]["last_ts"] + self.idempotency_seconds <= now
+            ):
+                os.remove(self._path(self.segments.pop(0)["base"]))
+                removed += 1
+            return removed
+
+    def dead_letter(self, payloads: List[object], reason: str, ts: float):
+        """Set events aside in dead-letter.jsonl instead of running them."""
+        data = "".join(
+            json.dumps({"ts": ts, "reason": reason, "payload": payload}, separators=(",", ":"), default=str) + "\n"
+            for payload in payloads
+        ).encode("utf-8")
+        with self._lock:
+            with open(os.path.join(self.directory, "dead-letter.jsonl"), "ab") as file:
+                file.write(data)
+                if self.fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class WebhookStream:
+    """Takes the webhooks of one process into its EventBuffer and runs the
+    process on them in micro-batches.
+
+    Webhooks that arrive while a write is under way go to disk together in
+    the next one, so a burst costs a write and an fsync per group rather
+    than per request. A run starts once batch_records events wait or the
+    oldest has waited batch_seconds, and events keep collecting while it
+    goes. Its batch is only marked consumed once the run has finished
+    without error, so events are delivered at least once: a failed run is
+    tried again after retry_seconds, and a run cut off by a shutdown is
+    run again when the buffer is next opened. A batch whose process has
+    been deleted or no longer has the WebHook trigger is dead-lettered.
+    """
+
+    def __init__(
+        self,
+        process_id: int,
+        buffer: EventBuffer,
+        sessions: async_sessionmaker,
+        batch_records: int = WEBHOOK_BATCH_RECORDS,
+        batch_seconds: float = WEBHOOK_BATCH_SECONDS,
+        max_pending: int = WEBHOOK_MAX_PENDING,
+        retry_seconds: float = WEBHOOK_RETRY_SECONDS,
+    ):
+        self.process_id = process_id
+        self.buffer = buffer
+        self.sessions = sessions
+        self.batch_records = batch_records
+        self.batch_seconds = batch_seconds
+        self.max_pending = max_pending
+        self.retry_seconds = retry_seconds
+        self._queued: List[tuple] = []
+        self._writing: Dict[str, asyncio.Future] = {}
+        self._writer: Optional[asyncio.Task] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._arrived = asyncio.Event()
+        # The last sequence number and arrival time of each write, for the
+        # age of the oldest waiting event; events found on opening the
+        # buffer have waited long enough
+        self._arrivals: Deque[Tuple[int, float]] = deque([(buffer.next_seq - 1, 0.0)] if buffer.pending else [])
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.writes = 0
+        self.runs = 0
+        self.failed_runs = 0
+        self.records = 0
+        self.dead_lettered = 0
+
+    def start(self):
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def accept(self, payload, key: Optional[str] = None) -> Tuple[Optional[int], bool]:
+        """Write an event to the buffer and return its sequence number and
+        whether it was dropped as a duplicate."""
+        if key is not None:
+            while key in self._writing:
+                # Only a duplicate if the first copy makes it to disk; if it
+                # does not, nothing is stored under the key and this copy is
+                # written instead
+                try:
+                    await asyncio.shield(self._writing[key])
+                except Exception:
+                    continue
+                self.duplicates += 1
+                return None, True
+            if self.buffer.seen(key, time.time()):
+                self.duplicates += 1
+                return None, True
+        if self.buffer.pending + len(self._queued) >= self.max_pending:
+            self.rejected += 1
+            raise BufferFull(f"Integration process {self.process_id} has {self.max_pending} webhooks waiting")
+
+        future = asyncio.get_running_loop().create_future()
+        self._queued.append((key, payload, future))
+        if key is not None:
+            self._writing[key] = future
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write())
+        try:
+            # A client that hangs up does not take the write down with it
+            seq = await asyncio.shield(future)
+        finally:
+            if key is not None and self._writing.get(key) is future:
+                del self._writing[key]
+        self.accepted += 1
+        return seq, False
+
+    async def _write(self):
+        while self._queued:
+            queued, self._queued = self._queued, []
+            ts = time.time()
+            try:
+                first = await run_in_threadpool(self.buffer.append, [(key, payload) for key, payload, _ in queued], ts)
+            except Exception as error:
+                logger.exception("Writing webhooks of process %s failed", self.process_id)
+                for key, _, future in queued:
+                    # Copies waiting on this one try again before they hear
+                    if key is not None and self._writing.get(key) is future:
+                        del self._writing[key]
+                    future.set_exception(error)
+                continue
+            self.writes += 1
+            for index, (key, _, future) in enumerate(queued):
+                if key is not None:
+                    self.buffer.remember(key, ts)
+                future.set_result(first + index)
+            self._arrivals.append((first + len(queued) - 1, time.monotonic()))
+            self._arrived.set()
+
+    def _due_in(self) -> float:
+        while self._arrivals and self._arrivals[0][0] < self.buffer.committed["seq"]:
+            self._arrivals.popleft()
+        arrived = self._arrivals[0][1] if self._arrivals else 0.0
+        return arrived + self.batch_seconds - time.monotonic()
+
+    async def _dispatch(self):
+        while True:
+            self._arrived.clear()
+            due_in = self._due_in()
+            if not self.buffer.pending:
+                await self._arrived.wait()
+            elif self.buffer.pending < self.batch_records and due_in > 0:
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), due_in)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                try:
+                    await self._run_batch()
+                except Exception:
+                    logger.exception("Running webhooks of process %s failed", self.process_id)
+                    self.buffer.rewind()
+                    await asyncio.sleep(self.retry_seconds)
+
+    async def _run_batch(self):
+        # Imported with the first batch, so recovering buffers at startup does
+        # not load the engine and its connector clients
+        from connector_clients import records_from
+        from process_engine import EngineError, process_engine
+
+        payloads = await run_in_threadpool(self.buffer.read, self.batch_records)
+        async with self.sessions() as db:
+            # Events buffered before the process was deleted or switched to
+            # another trigger must not run it
+            trigger_type = await db.scalar(
+                select(IntegrationProcess.trigger_type).filter(IntegrationProcess.id == self.process_id)
+            )
+            if trigger_type != TriggerType.WebHook:
+                reason = "process deleted" if trigger_type is None else f"process triggered by {trigger_type.value}"
+                await run_in_threadpool(self.buffer.dead_letter, payloads, reason, time.time())
+                await run_in_threadpool(self.buffer.commit)
+                self.dead_lettered += len(payloads)
+                logger.warning("Dead-lettered %s webhooks of process %s: %s", len(payloads), self.process_id, reason)
+                return
+            records = [record for payload in payloads for record in records_from(payload)]
+            try:
+                run = await process_engine.start(db, self.process_id, records)
+            except EngineError:
+                # Started some other way, the batch goes once that run ends
+                self.buffer.rewind()
+                await process_engine.wait(self.process_id)
+                return
+        if run is None:
+            raise EngineError(f"Integration process {self.process_id} not found")
+        await process_engine.wait(self.process_id)
+        self.runs += 1
+        if run.status == ProcessStatus.Error:
+            self.failed_runs += 1
+            self.buffer.rewind()
+            await asyncio.sleep(self.retry_seconds)
+            return
+        self.records += len(payloads)
+        await run_in_threadpool(self.buffer.commit)
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+        if self._writer is not None:
+            await asyncio.gather(self._writer, return_exceptions=True)
+        await run_in_threadpool(self.buffer.close)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.buffer.pending, "accepted": self.accepted, "duplicates": self.duplicates,
+            "rejected": self.rejected, "writes": self.writes, "runs": self.runs, "failed_runs": self.failed_runs,
+            "records": self.records, "dead_lettered": self.dead_lettered, "segments": len(self.buffer.segments),
+            "idempotency_keys": len(self.buffer.keys),
+        }
+
+class WebhookIngest:
+    """A WebhookStream per process with webhooks, each buffered in its own
+    directory under root."""
+
+    def __init__(
+        self,
+        root: str,
+        batch_records: int = WEBHOOK_BATCH_RECORDS,
+        batch_seconds: float = WEBHOOK_BATCH_SECONDS,
+        idempotency_seconds: float = WEBHOOK_IDEMPOTENCY_SECONDS,
+        max_pending: int = WEBHOOK_MAX_PENDING,
+        retry_seconds: float = WEBHOOK_RETRY_SECONDS,
+        segment_bytes: int = WEBHOOK_SEGMENT_BYTES,
+        fsync: bool = WEBHOOK_FSYNC,
+    ):
+        self.root = root
+        self.batch_records = batch_records
+        self.batch_seconds = batch_seconds
+        self.idempotency_seconds = idempotency_seconds
+        self.max_pending = max_pending
+        self.retry_seconds = retry_seconds
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.streams: Dict[int, WebhookStream] = {}
+
+    def _directory(self, process_id: int) -> str:
+        return os.path.join(self.root, f"process-{process_id}")
+
+    async def open(self, bind, process_id: int) -> WebhookStream:
+        buffer = await run_in_threadpool(
+            EventBuffer, self._directory(process_id), self.idempotency_seconds, self.segment_bytes, self.fsync,
+        )
+        # Another request may have opened it while this one read the files
+        stream = self.streams.get(process_id)
+        if stream is not None:
+            buffer.close()
+            return stream
+        sessions = async_sessionmaker(bind=bind, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+        stream = WebhookStream(
+            process_id, buffer, sessions, self.batch_records, self.batch_seconds, self.max_pending, self.retry_seconds,
+        )
+        stream.start()
+        self.streams[process_id] = stream
+        return stream
+
+    async def ingest(self, bind, process_id: int, payload, key: Optional[str] = None) -> Tuple[Optional[int], bool]:
+        stream = self.streams.get(process_id) or await self.open(bind, process_id)
+        return await stream.accept(payload, key)
+
+    async def recover(self, bind) -> List[int]:
+        """Open the buffers that still hold events, so runs pick them up."""
+        try:
+            names = await run_in_threadpool(os.listdir, self.root)
+        except FileNotFoundError:
+            return []
+        recovered = []
+        for name in sorted(names):
+            if not (name.startswith("process-") and name[len("process-"):].isdigit()):
+                continue
+            stream = await self.open(bind, int(name[len("process-"):]))
+            if stream.buffer.pending:
+                recovered.append(stream.process_id)
+            else:
+                await self.close(stream.process_id)
+        return recovered
+
+    async def close(self, process_id: int):
+        """Stop taking and running a process's webhooks; waiting events stay
+        on disk."""
+        stream = self.streams.pop(process_id, None)
+        if stream is not None:
+            await stream.close()
+
+    async def drop(self, process_id: int):
+        await self.close(process_id)
+        await run_in_threadpool(shutil.rmtree, self._directory(process_id), True)
+
+    async def shutdown(self):
+        for process_id in list(self.streams):
+            await self.close(process_id)
+
+    def stats(self) -> dict:
+        return {str(process_id): stream.stats() for process_id, stream in self.streams.items()}
+
+webhook_ingest = WebhookIngest(WEBHOOK_DIR)
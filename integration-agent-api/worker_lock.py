@@ -0,0 +1,48 @@
+import os
+from typing import List
+
+try:
+    import fcntl
+except ImportError:  # No advisory locks (Windows), one worker is then up to the deployment
+    fcntl = None
+
+class DirectoryLocked(RuntimeError):
+    """Another worker already owns a store directory."""
+
+class DirectoryLocks:
+    """Exclusive locks on the directories of the local stores.
+
+    Run logs, run history, checkpoints and webhook buffers keep sequence
+    numbers, offsets and idempotency keys in memory on top of their files,
+    so only one worker process may use a directory at a time. Each worker
+    takes a lock file in every directory at startup. A second worker pointed
+    at the same directories fails to start instead of writing over the
+    first; run several workers only with a directory set of their own each.
+    """
+
+    def __init__(self):
+        self._files: List = []
+
+    def acquire(self, directories: List[str]):
+        if fcntl is None:
+            return
+        for directory in directories:
+            os.makedirs(directory, exist_ok=True)
+            file = open(os.path.join(directory, ".lock"), "a")
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                file.close()
+                self.release()
+                raise DirectoryLocked(f"{directory} is in use by another worker")
+            self._files.append(file)
+
+    def release(self):
+        # Closing the file drops its lock
+        while self._files:
+            self._files.pop().close()
+
+    def stats(self) -> dict:
+        return {"locked": [os.path.dirname(file.name) for file in self._files]}
+
+directory_locks = DirectoryLocks()